@@ -0,0 +1,173 @@
+"""JSON API (/api/v1) with ETag / conditional GET support.
+
+Every response carries a strong ETag derived from the user's data_version
+(bumped by every write) plus the request's query string. A matching
+If-None-Match is answered with 304 before any aggregate query runs, so a
+client polling unchanged data costs one primary-key lookup.
+
+Reads go to the replicas, except for /sync: its cursors are positions in
+the primary's change log, and a lagging replica could hand out a snapshot
+older than the version it claims.
+"""
+import hashlib
+from datetime import date
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_login import current_user
+
+import rollups
+from budget_engine import budget_status_to_dict, evaluate_budgets
+from cache import get_data_version
+from db_routing import route_reads_to_replica
+from expense_filters import filtered_expenses
+from models import Goal
+from pagination import InvalidCursor, keyset_paginate
+from sync import CursorExpired, sync_batch
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_PER_PAGE = 100
+# Endpoints that must read the primary
+PRIMARY_ENDPOINTS = {'api.sync'}
+
+
+@api_bp.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return jsonify(error='authentication required'), 401
+    if request.endpoint not in PRIMARY_ENDPOINTS:
+        route_reads_to_replica()
+
+
+def expense_to_dict(expense):
+    return {
+        'id': expense.id,
+        'date': expense.date.isoformat(),
+        'category': expense.category,
+        'amount': expense.amount,
+        'currency': expense.currency,
+        'home_amount': expense.home_amount,
+        'description': expense.description,
+    }
+
+
+def conditional_json(name, build):
+    """Return build() as JSON, or 304 if the client's ETag is still current."""
+    version = get_data_version(current_user.id)
+    etag = hashlib.sha256(
+        f'{name}:{current_user.id}:{version}:{request.query_string.decode()}'.encode()
+    ).hexdigest()
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@api_bp.route('/expenses')
+def expenses():
+    per_page = min(max(request.args.get('per_page', 25, type=int), 1), MAX_PER_PAGE)
+    cursor = request.args.get('cursor', '')
+
+    def build():
+        entity, query, _ = filtered_expenses(current_user.id, request.args)
+        page = keyset_paginate(query, (entity.date, entity.id), cursor=cursor, per_page=per_page)
+        return {
+            'expenses': [expense_to_dict(expense) for expense in page.items],
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+        }
+
+    try:
+        return conditional_json('expenses', build)
+    except InvalidCursor:
+        return jsonify(error='invalid cursor'), 400
+
+
+@api_bp.route('/categories')
+def category_totals():
+    def build():
+        return {
+            'categories': [
+                {'category': category, 'total': round(float(total), 2)}
+                for category, total in rollups.category_totals(current_user.id)
+            ]
+        }
+
+    return conditional_json('categories', build)
+
+
+@api_bp.route('/monthly')
+def monthly_totals():
+    months = min(max(request.args.get('months', 6, type=int), 1), 120)
+    today = date.today()
+
+    def build():
+        month_index = today.year * 12 + today.month - 1 - (months - 1)
+        since = date(month_index // 12, month_index % 12 + 1, 1)
+        return {
+            'months': [
+                {'year': int(year), 'month': int(month), 'total': round(float(total), 2)}
+                for year, month, total in rollups.monthly_totals(current_user.id, since=since)
+            ]
+        }
+
+    # The window ends at the current month, so a new month changes the response
+    return conditional_json(f'monthly:{today:%Y-%m}', build)
+
+
+@api_bp.route('/budgets')
+def budgets():
+    def build():
+        return {'budgets': [budget_status_to_dict(item) for item in evaluate_budgets(current_user.id)]}
+
+    return conditional_json('budgets', build)
+
+
+@api_bp.route('/goals')
+def goals():
+    def build():
+        user_goals = Goal.query.filter_by(user_id=current_user.id).order_by(Goal.due_date.asc()).all()
+        return {
+            'goals': [{
+                'id': goal.id,
+                'name': goal.name,
+                'target_amount': goal.target_amount,
+                'current_amount': goal.current_amount,
+                'currency': goal.currency,
+                'due_date': goal.due_date.isoformat(),
+                'progress_percent': round(min(100, goal.current_amount / goal.target_amount * 100), 2) if goal.target_amount > 0 else 0,
+            } for goal in user_goals]
+        }
+
+    return conditional_json('goals', build)
+
+
+@api_bp.route('/forecast')
+def forecast():
+    from forecast import user_forecast  # NumPy is only loaded once a forecast is asked for
+    # Projections depend on today's date as well as the data
+    return conditional_json(f'forecast:{date.today()}', lambda: user_forecast(current_user.id))
+
+
+@api_bp.route('/sync')
+def sync():
+    """Rows created, changed or deleted since `since` (omit it for a full snapshot).
+
+    Keep calling with the returned cursor while has_more is true; store the
+    last cursor for the next sync.
+    """
+    limit = request.args.get('limit', current_app.config['SYNC_BATCH_SIZE'], type=int)
+    limit = min(max(limit, 1), current_app.config['SYNC_MAX_BATCH'])
+    try:
+        changes, cursor, has_more = sync_batch(current_user.id, request.args.get('since'), limit)
+    except InvalidCursor:
+        return jsonify(error='invalid cursor'), 400
+    except CursorExpired:
+        return jsonify(error='cursor expired; sync again without `since`', reset=True), 410
+    response = jsonify(changes=changes, cursor=cursor, has_more=has_more)
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
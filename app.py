@@ -1,18 +1,40 @@
 import os
 import logging
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from db_profiles import engine_options, init_engine_profiles
+from db_routing import RoutingSession, replica_binds, shard_binds
+
 # Load environment variables from .env file
 load_dotenv()
 
-logging.basicConfig(level=logging.DEBUG)
+# "development" creates the schema on boot; "production" leaves it to
+# `flask upgrade-db` and `flask init-db` (start.sh runs both) and logs at
+# INFO instead of DEBUG
+APP_ENV = os.environ.get("APP_ENV", "development").lower()
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def configure_logging():
+    """Set the root log level from LOG_LEVEL (DEBUG in development, INFO in production)."""
+    level = os.environ.get("LOG_LEVEL", "DEBUG" if APP_ENV == "development" else "INFO").upper()
+    logging.basicConfig(level=level)
+    # SQLAlchemy's engine logger echoes every statement at INFO
+    logging.getLogger("sqlalchemy.engine").setLevel(os.environ.get("SQL_LOG_LEVEL", "WARNING").upper())
 
 
 class Base(DeclarativeBase):
@@ -20,60 +42,196 @@ class Base(DeclarativeBase):
     pass
 
 # 1. Initialize Extensions Globally (without passing the app)
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 login_manager = LoginManager()
-migrate = Migrate()
+migrate = None
+
+
+class StartupProfile:
+    """Wall-clock time of each create_app() phase, kept on app.extensions."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
 
 
 def create_app():
     """Application factory function to create and configure the Flask app."""
-    
+    global migrate
+
+    configure_logging()
+    profile = StartupProfile()
     app = Flask(__name__)
+    app.extensions['startup_profile'] = profile
 
     # 2. APPLICATION CONFIGURATION (Reads Environment Variables with defaults)
+    app.config["APP_ENV"] = APP_ENV
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
-        "DATABASE_URL", 
+        "DATABASE_URL",
         "sqlite:///finance.db"  # Default to SQLite for local development
     )
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False 
+    # Engine tuning per backend ("auto", "legacy", "sqlite-wal", "postgres-pool"), see db_profiles.py
+    app.config["DB_PROFILE"] = os.environ.get("DB_PROFILE", "auto")
+    # Optional read replicas (comma-separated URLs), see db_routing.py
+    # Optional user-data shards (comma-separated URLs, append only); DATABASE_URL
+    # then holds the shard directory and shared tables, see shards.py
+    app.config["SQLALCHEMY_BINDS"] = {
+        key: {"url": url, **engine_options(url, app.config["DB_PROFILE"])}
+        for key, url in {
+            **replica_binds(os.environ.get("DATABASE_REPLICA_URLS")),
+            **shard_binds(os.environ.get("DATABASE_SHARD_URLS")),
+        }.items()
+    }
+    app.config["REPLICA_PIN_SECONDS"] = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+    app.config["SHARD_DIRECTORY_TTL"] = int(os.environ.get("SHARD_DIRECTORY_TTL", 5))
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SECRET_KEY"] = os.environ.get(
-        "SECRET_KEY", 
+        "SECRET_KEY",
         "dev-secret-key-please-change-in-production"  # Default for development
     )
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
-    
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"], app.config["DB_PROFILE"]
+    )
+    # Schema creation on boot (development only unless AUTO_CREATE_SCHEMA=1)
+    app.config["AUTO_CREATE_SCHEMA"] = _env_flag("AUTO_CREATE_SCHEMA", APP_ENV == "development")
+
     # CSRF Protection (Flask-WTF handles this automatically with SECRET_KEY)
     app.config["WTF_CSRF_ENABLED"] = True
     app.config["WTF_CSRF_TIME_LIMIT"] = None  # No time limit for CSRF tokens
-    
+
+    # Response cache ("memory" per worker, or "redis" shared across workers)
+    app.config["CACHE_BACKEND"] = os.environ.get("CACHE_BACKEND", "memory")
+    app.config["CACHE_REDIS_URL"] = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    app.config["CACHE_TTL"] = int(os.environ.get("CACHE_TTL", 300))
+    app.config["IDENTITY_CACHE_TTL"] = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+
+    # Exchange rates are quoted per unit of this currency, see fx.py
+    app.config["FX_BASE_CURRENCY"] = os.environ.get("FX_BASE_CURRENCY", "USD")
+    # Compiled-template cache shared by workers ("" disables), see templating.py
+    if os.environ.get("JINJA_BYTECODE_CACHE_DIR") is not None:
+        app.config["JINJA_BYTECODE_CACHE_DIR"] = os.environ["JINJA_BYTECODE_CACHE_DIR"]
+    # Expenses older than this many days are moved to the archive table, see archive.py
+    app.config["ARCHIVE_HORIZON_DAYS"] = int(os.environ.get("ARCHIVE_HORIZON_DAYS", 730))
+    # Background report jobs (`flask run-jobs`), see jobs.py
+    app.config["JOBS_WORKERS"] = int(os.environ.get("JOBS_WORKERS", 2))
+    app.config["JOBS_MAX_ACTIVE_PER_USER"] = int(os.environ.get("JOBS_MAX_ACTIVE_PER_USER", 2))
+    if os.environ.get("JOBS_RESULT_DIR"):
+        app.config["JOBS_RESULT_DIR"] = os.environ["JOBS_RESULT_DIR"]
+    # Change log entries older than this are pruned by `flask prune-changes`, see sync.py
+    app.config["SYNC_RETENTION_DAYS"] = int(os.environ.get("SYNC_RETENTION_DAYS", 90))
+
     # 3. Apply Middleware and Initialize Extensions
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-    db.init_app(app)
-    login_manager.init_app(app)
-    migrate.init_app(app, db)
-    
+    with profile.phase('extensions'):
+        # Flask-Migrate pulls in Alembic, so it is imported here rather than
+        # by every module that only needs `db`
+        from flask_migrate import Migrate
+        migrate = migrate or Migrate()
+        db.init_app(app)
+        login_manager.init_app(app)
+        migrate.init_app(app, db)
+        with app.app_context():
+            init_engine_profiles(app, db.engines)  # SQLite PRAGMAs on connect
+
     login_manager.login_view = "login"
     login_manager.login_message_category = "info"
 
     # 4. Import and register routes within app context
     with app.app_context():
-        import models  # Import models to register them with SQLAlchemy
-        from routes import register_routes
-        register_routes(app)  # Register all routes
-        
+        with profile.phase('models'):
+            import models  # Import models to register them with SQLAlchemy
+            # Routes per-user tables to the user's shard when DATABASE_SHARD_URLS is set
+            from shards import init_sharding
+            init_sharding(app)
+        with profile.phase('templating'):
+            # Bytecode cache and the {% cache %} fragment tag
+            from templating import init_templating
+            fragment_cache = init_templating(app)
+        with profile.phase('routes'):
+            from routes import register_routes
+            from commands import register_commands
+            register_routes(app)  # Register all routes
+
+            from api import api_bp
+            app.register_blueprint(api_bp)  # JSON API under /api/v1
+            register_commands(app)  # Register CLI maintenance commands
+
         # Create all database tables (for development only)
-        # In production, use Flask-Migrate instead
-        db.create_all()
-    
+        # In production, start.sh runs `flask upgrade-db` and `flask init-db` first
+        if app.config["AUTO_CREATE_SCHEMA"]:
+            with profile.phase('create_all'):
+                from shards import create_schema
+                create_schema()
+
+        # Full-text search index for expense descriptions (falls back to ILIKE);
+        # production boots only detect it, `flask init-db` creates it
+        with profile.phase('search_index'):
+            from search import setup_search_index
+            setup_search_index(app, create=app.config["AUTO_CREATE_SCHEMA"])
+
+        with profile.phase('metrics_and_cache'):
+            # Per-request query/latency instrumentation and /metrics
+            from metrics import init_metrics, registry
+            init_metrics(app)
+
+            # Per-user response cache keyed by the user's data version
+            from cache import init_cache
+            response_cache = init_cache(app)
+            registry.add_collector('response_cache', response_cache.metrics_lines)
+            registry.add_collector('fragment_cache', fragment_cache.metrics_lines)
+
+            # current_user comes from a TTL'd identity cache, not a query per request
+            from identity import init_identity_cache
+            identity_cache = init_identity_cache(app)
+            registry.add_collector('identity_cache', identity_cache.metrics_lines)
+
+            # Round-robin read replica selection for @replica_reads views
+            from db_routing import init_replicas
+            replica_health = init_replicas(app)
+            registry.add_collector('replicas', replica_health.metrics_lines)
+            if 'shard_router' in app.extensions:
+                registry.add_collector('shards', app.extensions['shard_router'].metrics_lines)
+
+            # In-process exchange rate table for home-currency conversion
+            from fx import init_fx
+            init_fx(app)
+
+            # Published hot/cold archive cutoff, consulted by date-ranged reads
+            from archive import init_archive
+            init_archive(app)
+
+            # Report job limits and result directory for the background runner
+            from jobs import init_jobs
+            init_jobs(app)
+
+            # Change log written with every synced write, read by /api/v1/sync
+            from sync import init_sync
+            init_sync(app)
+
     return app
 
 
-# Create the application instance
-app = create_app()
+_app = None
+
+
+def __getattr__(name):
+    # The module-level `app` (gunicorn app:app, `from app import app`) is
+    # built on first access, so modules that only need `db` import cheaply
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,146 @@
+"""Hot/cold archival of old expenses.
+
+`flask archive-expenses` moves expenses dated before the archive cutoff
+(ARCHIVE_HORIZON_DAYS ago by default) from `expense` to `expense_archive`.
+Each batch copies and deletes in one transaction, so a row is always in
+exactly one table and an interrupted run just continues where it stopped.
+The hot table and its indexes then only hold recent history.
+
+Readers consult the archive only when the dates they ask for reach before
+the cutoff; without a lower date bound they always do. Rollups are not
+touched by archival, so all-time and per-month totals keep coming from
+them. Archived expenses are read-only: edits, bulk actions and rate
+reconversion only match the hot table.
+
+The cutoff is published before any row moves and cached per process for
+ARCHIVE_STATE_TTL seconds, so after raising it the job waits out that TTL
+before moving anything; no reader can then still be using the old one.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert, select, union_all
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import ArchivedExpense, ArchiveState, Expense
+from shards import each_shard
+
+ARCHIVE_BATCH_SIZE = 5000
+EXPENSE_COLUMNS = ('id', 'user_id', 'date', 'category', 'amount_minor', 'currency', 'home_amount_minor', 'description')
+
+
+class ArchiveStateCache:
+    """The published archive cutoff, reloaded at most every `ttl` seconds."""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded_at = None
+
+    def cutoff(self):
+        with self.lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+                self.value = db.session.execute(select(ArchiveState.cutoff).where(ArchiveState.id == 1)).scalar()
+                self.loaded_at = time.monotonic()
+            return self.value
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+
+def init_archive(app):
+    app.config.setdefault('ARCHIVE_HORIZON_DAYS', 730)
+    app.config.setdefault('ARCHIVE_STATE_TTL', 60)
+    app.extensions['archive_state'] = ArchiveStateCache(ttl=app.config['ARCHIVE_STATE_TTL'])
+    return app.extensions['archive_state']
+
+
+def archive_cutoff():
+    """Expenses dated before this may be archived; None until archival first runs."""
+    return current_app.extensions['archive_state'].cutoff()
+
+
+def reaches_archive(date_from):
+    """True when a date range starting at `date_from` (None: unbounded) needs the archive."""
+    cutoff = archive_cutoff()
+    return cutoff is not None and (date_from is None or date_from < cutoff)
+
+
+def expense_columns(entity):
+    return [getattr(entity, name) for name in EXPENSE_COLUMNS]
+
+
+def with_archive(hot_where, archived_where):
+    """An Expense entity over expense UNION ALL expense_archive, each side filtered first.
+
+    Query it like Expense (`db.session.query(entity).filter(entity.date > ...)`);
+    rows come back as Expense instances, archived ones included.
+    """
+    union = union_all(
+        select(*expense_columns(Expense)).where(*hot_where),
+        select(*expense_columns(ArchivedExpense)).where(*archived_where),
+    ).subquery('expense_all')
+    return aliased(Expense, union, adapt_on_names=True)
+
+
+def default_cutoff(today=None):
+    today = today or date.today()
+    return today - timedelta(days=current_app.config['ARCHIVE_HORIZON_DAYS'])
+
+
+def publish_cutoff(cutoff):
+    """Raise the stored cutoff (it never moves back); return (cutoff, seconds to wait)."""
+    state = db.session.get(ArchiveState, 1, with_for_update=True)
+    if state is None:
+        state = ArchiveState(id=1)
+        db.session.add(state)
+    now = datetime.now()
+    if state.cutoff is None or cutoff > state.cutoff:
+        state.cutoff = cutoff
+        state.published_at = now
+    cutoff, published_at = state.cutoff, state.published_at
+    db.session.commit()
+    current_app.extensions['archive_state'].invalidate()
+
+    ttl = current_app.config['ARCHIVE_STATE_TTL']
+    return cutoff, max(0.0, ttl - (now - published_at).total_seconds())
+
+
+def archive_expenses(cutoff, batch_size=ARCHIVE_BATCH_SIZE, sleep=time.sleep):
+    """Move every expense dated before `cutoff` into the archive; return the number moved."""
+    cutoff, wait = publish_cutoff(cutoff)
+    if wait:
+        sleep(wait)
+
+    moved = 0
+    # The cutoff lives in the directory database; with sharding each shard moves its own rows
+    for shard in each_shard():
+        moved += _archive_batches(cutoff, batch_size)
+    return moved
+
+
+def _archive_batches(cutoff, batch_size):
+    moved = 0
+    while True:
+        # Locked so a concurrent edit cannot land between the copy and the delete
+        ids = db.session.execute(
+            select(Expense.id).where(Expense.date < cutoff).order_by(Expense.id)
+            .limit(batch_size).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(insert(ArchivedExpense).from_select(
+            EXPENSE_COLUMNS, select(*expense_columns(Expense)).where(Expense.id.in_(ids))
+        ))
+        db.session.execute(
+            delete(Expense).where(Expense.id.in_(ids)),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.commit()
+        moved += len(ids)
+    return moved
@@ -0,0 +1,150 @@
+"""Check hot/cold archival: same answers, archive read only when needed.
+
+Usage:
+    python benchmarks/bench_archive.py
+
+Runs against a throwaway in-memory SQLite database. Seeds several years of
+expenses, then compares list/export/budget/total results before and after
+archiving everything older than the horizon. Recent date ranges must not
+touch expense_archive; open-ended ones must include archived rows.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import event, func, select  # noqa: E402
+
+from app import app, db  # noqa: E402
+from archive import archive_expenses, default_cutoff  # noqa: E402
+from budget_engine import evaluate_budgets  # noqa: E402
+from expense_filters import archived_filter_conditions, expense_filter_conditions, filtered_expenses  # noqa: E402
+from exports import export_rows  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from models import ArchivedExpense, Budget, Expense, ExpenseRollup, User  # noqa: E402
+from pagination import keyset_paginate  # noqa: E402
+import rollups  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+EXPENSE_COUNT = 60000
+YEARS = 6
+
+
+def seed(user_id):
+    rng = random.Random(5)
+    today = date.today()
+    amounts = [rng.randint(100, 30000) for _ in range(EXPENSE_COUNT)]
+    db.session.execute(Expense.__table__.insert(), [
+        {
+            'user_id': user_id,
+            'amount_minor': amount_minor,
+            'currency': 'USD',
+            'home_amount_minor': amount_minor,
+            'category': rng.choice(CATEGORIES),
+            'date': today - timedelta(days=rng.randrange(YEARS * 365)),
+            'description': f'Expense {index}',
+        }
+        for index, amount_minor in enumerate(amounts)
+    ])
+    for offset in range(0, YEARS * 365, 90):
+        start = today - timedelta(days=offset + 30)
+        db.session.add(Budget(user_id=user_id, category=rng.choice(CATEGORIES), limit_minor=50000,
+                              start_date=start, end_date=start + timedelta(days=29)))
+    db.session.commit()
+    rollups.rebuild_rollups(user_id)
+
+
+def first_pages(user_id, args, pages=3):
+    entity, query, _ = filtered_expenses(user_id, args)
+    page = keyset_paginate(query, (entity.date, entity.id), per_page=25)
+    ids = [expense.id for expense in page.items]
+    for _ in range(pages - 1):
+        if not page.has_next:
+            break
+        page = keyset_paginate(query, (entity.date, entity.id), cursor=page.next_cursor, per_page=25)
+        ids += [expense.id for expense in page.items]
+    return ids
+
+
+def snapshot(user_id, ranges):
+    result = {}
+    for name, args in ranges.items():
+        conditions, values = expense_filter_conditions(user_id, args)
+        result[name] = (
+            first_pages(user_id, args),
+            sorted(export_rows(user_id, conditions, archived_filter_conditions(user_id, args, values))),
+        )
+    result['budgets'] = [(status['budget'].id, status['spent']) for status in evaluate_budgets(user_id)]
+    result['totals'] = rollups.user_totals(user_id)
+    return result
+
+
+def main():
+    statements = []
+    failures = []
+    today = date.today()
+    ranges = {
+        'all': {},
+        'recent': {'date_from': (today - timedelta(days=200)).isoformat()},
+        'old': {'date_from': (today - timedelta(days=5 * 365)).isoformat(),
+                'date_to': (today - timedelta(days=4 * 365)).isoformat()},
+        'search': {'search': 'Expense 12'},
+    }
+
+    with app.test_request_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        seed(user.id)
+        before = snapshot(user.id, ranges)
+
+        started = time.perf_counter()
+        moved = archive_expenses(default_cutoff(), batch_size=4000, sleep=lambda seconds: None)
+        elapsed = time.perf_counter() - started
+        hot = db.session.execute(select(func.count(Expense.id))).scalar()
+        print(f'archived {moved} expenses in {elapsed:.2f}s; {hot} remain in the hot table')
+        if moved + hot != EXPENSE_COUNT or moved == 0:
+            failures.append('archival lost or duplicated expenses')
+        if archive_expenses(default_cutoff(), sleep=lambda seconds: None) != 0:
+            failures.append('a second run moved expenses again')
+
+        db.session.expire_all()
+        after = snapshot(user.id, ranges)
+        for name in before:
+            if before[name] != after[name]:
+                failures.append(f'{name} changed after archival')
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        for name, args in ranges.items():
+            statements.clear()
+            started = time.perf_counter()
+            first_pages(user.id, args)
+            elapsed = (time.perf_counter() - started) * 1000
+            touched = any(ArchivedExpense.__tablename__ in statement for statement in statements)
+            print(f'{name:<8} {elapsed:>9.2f} ms  archive read: {touched}')
+            if touched != (name != 'recent'):
+                failures.append(f'{name} {"read" if touched else "skipped"} the archive')
+
+        rows = sorted(db.session.execute(select(ExpenseRollup.year, ExpenseRollup.month, ExpenseRollup.category,
+                                                ExpenseRollup.total_minor, ExpenseRollup.count)).all())
+        rollups.rebuild_rollups(user.id)
+        if rows != sorted(db.session.execute(select(ExpenseRollup.year, ExpenseRollup.month, ExpenseRollup.category,
+                                                    ExpenseRollup.total_minor, ExpenseRollup.count)).all()):
+            failures.append('rebuilt rollups differ after archival')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: results unchanged; recent ranges skip the archive')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Check budget running totals and threshold alerts against a recount.
+
+Usage:
+    python benchmarks/bench_budget_alerts.py
+
+Runs against a throwaway in-memory SQLite database. Budgets are created
+through /budgets, then expenses are added, edited (across categories and
+budget windows), deleted, bulk-edited, imported and generated by recurring
+templates. Afterwards every budget total must equal a fresh recount and
+reconciliation must find nothing to repair. One budget is walked through
+its 80% and 100% thresholds to check each crossing alerts exactly once.
+Drift planted by hand must be repaired by reconciliation. Exits non-zero
+on any mismatch.
+"""
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import event, update  # noqa: E402
+
+from app import app, db  # noqa: E402
+from budget_engine import _spent_by_budget, evaluate_budgets, reconcile_budgets  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from importer import import_expenses, parse_csv  # noqa: E402
+from models import Budget, BudgetTotal, Expense, Notification, RecurringExpense, User  # noqa: E402
+from recurring import initial_next_due, materialize_recurring_expenses  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+EXPENSE_COUNT = 50000
+BUDGET_COUNT = 60
+WRITES = 150
+
+
+def seed(user_id):
+    rng = random.Random(5)
+    today = date.today()
+    amounts = [rng.randint(100, 30000) for _ in range(EXPENSE_COUNT)]
+    # Nothing today, so the threshold walk below starts from zero
+    db.session.execute(Expense.__table__.insert(), [
+        {'user_id': user_id, 'amount_minor': amount_minor, 'currency': 'USD', 'home_amount_minor': amount_minor,
+         'category': rng.choice(CATEGORIES), 'date': today - timedelta(days=rng.randint(1, 400)),
+         'description': f'Expense {index}'}
+        for index, amount_minor in enumerate(amounts)
+    ])
+    db.session.commit()
+    rebuild_rollups(user_id)
+
+
+def alerts_for(user_id, category):
+    """Thresholds alerted so far for the user's one-day budget on `category` today."""
+    with app.app_context():
+        return [notification.threshold for notification in Notification.query.join(Budget).filter(
+            Notification.user_id == user_id, Budget.category == category, Budget.start_date == date.today()
+        ).order_by(Notification.id)]
+
+
+def drift(user_id):
+    """Budgets whose running total differs from a recount."""
+    with app.app_context():
+        spent = _spent_by_budget(Budget.user_id == user_id)
+        return [
+            (total.budget_id, total.spent_minor, spent.get(total.budget_id, 0))
+            for total in BudgetTotal.query.join(Budget).filter(Budget.user_id == user_id)
+            if total.spent_minor != spent.get(total.budget_id, 0)
+        ]
+
+
+def random_writes(client, user_id, rng):
+    with app.app_context():
+        ids = [expense_id for expense_id, in db.session.query(Expense.id).filter_by(user_id=user_id)]
+    rng.shuffle(ids)
+    today = date.today()
+    for _ in range(WRITES):
+        day = (today - timedelta(days=rng.randint(1, 400))).isoformat()
+        action = rng.random()
+        if action < 0.4:
+            client.post('/expense/add', data={'amount': f'{rng.randint(1, 300)}.{rng.randint(0, 99):02d}',
+                                              'currency': 'USD', 'category': rng.choice(CATEGORIES), 'date': day})
+        elif action < 0.8:
+            client.post(f'/expense/edit/{ids.pop()}', data={'amount': f'{rng.randint(1, 300)}.00', 'currency': 'USD',
+                                                             'category': rng.choice(CATEGORIES), 'date': day})
+        else:
+            client.post(f'/expense/delete/{ids.pop()}')
+    client.post('/expenses/bulk', data={'action': 'recategorize', 'scope': 'selected', 'new_category': 'travel',
+                                        'ids': [ids.pop() for _ in range(500)]})
+    client.post('/expenses/bulk', data={'action': 'shift', 'scope': 'selected', 'days': '-17',
+                                        'ids': [ids.pop() for _ in range(500)]})
+    client.post('/expenses/bulk', data={'action': 'delete', 'scope': 'selected', 'ids': [ids.pop() for _ in range(500)]})
+
+    rows = ''.join(
+        f'{(today - timedelta(days=rng.randint(1, 400))).isoformat()},{rng.choice(CATEGORIES)},{rng.randint(1, 200)}.50,'
+        f'Imported {index}\n'
+        for index in range(1000)
+    )
+    with app.app_context():
+        import_expenses(user_id, parse_csv(io.StringIO('Date,Category,Amount,Description\n' + rows)))
+        template = RecurringExpense(user_id=user_id, amount_minor=4200, currency='USD', category='utilities',
+                                    frequency='weekly', repeat_interval=1, start_date=today - timedelta(days=90))
+        template.next_due = initial_next_due(template)
+        db.session.add(template)
+        db.session.commit()
+        materialize_recurring_expenses(today - timedelta(days=1))
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    failures = []
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='budgetbench', email='budgetbench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        seed(user_id)
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'budgetbench@example.com', 'password': 'benchmark'})
+    rng = random.Random(8)
+    today = date.today()
+    for _ in range(BUDGET_COUNT):
+        start = today - timedelta(days=rng.randint(1, 400))
+        client.post('/budgets', data={'category': rng.choice(CATEGORIES), 'limit_amount': str(rng.randint(100, 3000)),
+                                      'start_date': start.isoformat(),
+                                      'end_date': (start + timedelta(days=rng.randint(7, 90))).isoformat()})
+    client.post('/budgets', data={'category': 'healthcare', 'limit_amount': '100', 'start_date': today.isoformat(),
+                                  'end_date': today.isoformat()})
+
+    random_writes(client, user_id, rng)
+    if drift(user_id):
+        failures.append(f'{len(drift(user_id))} budget totals differ from a recount after writes')
+    with app.app_context():
+        if reconcile_budgets(user_id):
+            failures.append('reconciliation repaired totals that writes should have kept')
+
+    # 79% -> 80% (alert) -> 90% -> 105% (alert) -> 90% (re-armed) -> 115% (alert)
+    add = {'currency': 'USD', 'category': 'healthcare', 'date': today.isoformat()}
+    for amount in ('79', '1', '10', '15'):
+        client.post('/expense/add', data={**add, 'amount': amount, 'description': f'walk {amount}'})
+    if alerts_for(user_id, 'healthcare') != [80, 100]:
+        failures.append(f'threshold walk alerted {alerts_for(user_id, "healthcare")}, expected [80, 100]')
+    with app.app_context():
+        last_id = db.session.query(db.func.max(Expense.id)).scalar()
+    client.post(f'/expense/delete/{last_id}')
+    client.post('/expense/add', data={**add, 'amount': '25'})
+    if alerts_for(user_id, 'healthcare') != [80, 100, 100]:
+        failures.append(f'a budget that fell below 100% did not alert again: {alerts_for(user_id, "healthcare")}')
+    page = client.get('/dashboard').get_data(as_text=True)
+    if 'Your healthcare budget is used up' not in page:
+        failures.append('the dashboard does not show the alert')
+    client.post('/notifications/dismiss', data={})
+    if 'Your healthcare budget is used up' in client.get('/dashboard').get_data(as_text=True):
+        failures.append('dismissed alerts are still shown')
+
+    with app.app_context():
+        queries = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        db.session.expire_all()
+        started = time.perf_counter()
+        evaluate_budgets(user_id)
+        tracked_ms = (time.perf_counter() - started) * 1000
+        tracked_queries = len(queries)
+        started = time.perf_counter()
+        _spent_by_budget(Budget.user_id == user_id)
+        recount_ms = (time.perf_counter() - started) * 1000
+        event.remove(db.engine, 'before_cursor_execute', count_query)
+        print(f'evaluate {BUDGET_COUNT + 1} budgets: {tracked_ms:.2f} ms in {tracked_queries} query '
+              f'(re-summing expenses: {recount_ms:.2f} ms)')
+        if tracked_queries != 1:
+            failures.append(f'evaluating tracked budgets took {tracked_queries} queries')
+
+        planted = db.session.query(BudgetTotal.budget_id).order_by(BudgetTotal.budget_id).limit(3).all()
+        db.session.execute(update(BudgetTotal).where(BudgetTotal.budget_id.in_([row[0] for row in planted]))
+                           .values(spent_minor=BudgetTotal.spent_minor + 12345))
+        db.session.commit()
+        repaired = reconcile_budgets(user_id)
+    if repaired != 3 or drift(user_id):
+        failures.append(f'reconciliation repaired {repaired} of 3 planted drifts')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: budget totals match a recount and thresholds alert once per crossing')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Show that evaluating budgets costs a constant number of queries.
+
+Usage:
+    python benchmarks/bench_budgets.py
+
+Runs against a throwaway in-memory SQLite database. Budgets are created
+the way the budgets page creates them, with a running total each, and
+evaluated once with those totals and once with the totals deleted, which
+is the fallback that sums expenses for budgets written outside the app.
+The process is warmed up as a server worker is (startup.warm_up) before
+anything is measured. Exits non-zero if either query count depends on the
+number of budgets.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db  # noqa: E402
+from budget_engine import evaluate_budgets, track_budget  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from models import Budget, BudgetTotal, Expense, User  # noqa: E402
+from startup import warm_up  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+BUDGET_COUNTS = (1, 10, 50, 200)
+EXPENSE_COUNT = 20000
+
+
+def seed(user_id):
+    rng = random.Random(42)
+    start = date.today() - timedelta(days=365)
+    amounts = [rng.randint(100, 20000) for _ in range(EXPENSE_COUNT)]
+    db.session.execute(Expense.__table__.insert(), [
+        {
+            'user_id': user_id,
+            'amount_minor': amount_minor,
+            'currency': 'USD',
+            'home_amount_minor': amount_minor,
+            'category': rng.choice(CATEGORIES),
+            'date': start + timedelta(days=rng.randrange(365)),
+        }
+        for amount_minor in amounts
+    ])
+    db.session.commit()
+
+
+def add_budgets(user_id, count):
+    rng = random.Random(count)
+    BudgetTotal.query.delete()
+    Budget.query.filter_by(user_id=user_id).delete()
+    for _ in range(count):
+        start = date.today() - timedelta(days=rng.randrange(365))
+        budget = Budget(
+            user_id=user_id,
+            category=rng.choice(CATEGORIES),
+            limit_minor=rng.randint(10000, 200000),
+            start_date=start,
+            end_date=start + timedelta(days=rng.randrange(7, 120)),
+        )
+        db.session.add(budget)
+        track_budget(budget)
+    db.session.commit()
+
+
+def measure(user_id, queries):
+    """(queries, milliseconds) for one evaluate_budgets() call."""
+    db.session.expire_all()
+    queries.clear()
+    started = time.perf_counter()
+    evaluate_budgets(user_id)
+    return len(queries), (time.perf_counter() - started) * 1000
+
+
+def main():
+    queries = []
+    warm_up(app)
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        # Read once: expire_all() below would otherwise reload the user inside the measurement
+        user_id = user.id
+        seed(user_id)
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        print(f'{"budgets":>8} {"tracked":>8} {"ms":>10} {"untracked":>10} {"ms":>10}')
+        tracked_counts, untracked_counts = set(), set()
+        for budget_count in BUDGET_COUNTS:
+            add_budgets(user_id, budget_count)
+            tracked, tracked_ms = measure(user_id, queries)
+            BudgetTotal.query.delete()
+            db.session.commit()
+            untracked, untracked_ms = measure(user_id, queries)
+            tracked_counts.add(tracked)
+            untracked_counts.add(untracked)
+            print(f'{budget_count:>8} {tracked:>8} {tracked_ms:>10.2f} {untracked:>10} {untracked_ms:>10.2f}')
+
+    if len(tracked_counts) != 1 or len(untracked_counts) != 1:
+        sys.exit('FAIL: query count grows with the number of budgets')
+    print('OK: query count is constant')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Check bulk expense edits: bounded query count, exact rollups, owner-only.
+
+Usage:
+    python benchmarks/bench_bulk.py
+
+Runs against a throwaway in-memory SQLite database. Each bulk action is run
+over selections of growing size; the number of statements must stay under a
+fixed bound, the incrementally maintained rollups must equal a full
+rebuild, and ids belonging to another user must never be touched.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from sqlalchemy import event, select  # noqa: E402
+
+from app import app, db  # noqa: E402
+from expense_bulk import bulk_delete, bulk_recategorize, bulk_shift_dates, selection_conditions  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from fx import rate_cache  # noqa: E402
+from models import ExchangeRate, Expense, ExpenseRollup, User  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+EXPENSES_PER_USER = 20000
+SELECTION_SIZES = (10, 500, 5000)
+# Snapshot, foreign-rate read, write, reconversion, rollup read/update/insert/delete, budget total
+# read/update, version bump, and the sync change log's version bump and insert
+MAX_QUERIES = 13
+
+
+def seed(user_ids):
+    rng = random.Random(3)
+    start = date.today() - timedelta(days=730)
+    db.session.execute(ExchangeRate.__table__.insert(), [
+        {'currency': 'EUR', 'date': start - timedelta(days=30) + timedelta(days=day), 'rate': Decimal('0.9') + Decimal(day % 50) / 1000}
+        for day in range(800)
+    ])
+    for user_id in user_ids:
+        rows = []
+        for _ in range(EXPENSES_PER_USER):
+            amount_minor = rng.randint(100, 50000)
+            euro = rng.random() < 0.2
+            rows.append({
+                'user_id': user_id,
+                'amount_minor': amount_minor,
+                'currency': 'EUR' if euro else 'USD',
+                'home_amount_minor': round(amount_minor / 0.9) if euro else amount_minor,
+                'category': rng.choice(CATEGORIES),
+                'date': start + timedelta(days=rng.randrange(730)),
+            })
+        db.session.execute(Expense.__table__.insert(), rows)
+    db.session.commit()
+    rate_cache().invalidate()
+    rebuild_rollups()
+
+
+def rollup_rows():
+    return sorted(db.session.execute(select(
+        ExpenseRollup.user_id, ExpenseRollup.year, ExpenseRollup.month,
+        ExpenseRollup.category, ExpenseRollup.total_minor, ExpenseRollup.count,
+    )).all())
+
+
+def user_fingerprint(user_id):
+    return db.session.execute(
+        select(Expense.id, Expense.date, Expense.category, Expense.home_amount_minor)
+        .where(Expense.user_id == user_id).order_by(Expense.id)
+    ).all()
+
+
+def main():
+    queries = []
+    failures = []
+
+    with app.app_context():
+        db.create_all()
+        owner = User(username='owner', email='owner@example.com')
+        other = User(username='other', email='other@example.com')
+        for user in (owner, other):
+            user.set_password('benchmark')
+            db.session.add(user)
+        db.session.commit()
+        seed([owner.id, other.id])
+        other_before = user_fingerprint(other.id)
+        other_ids = [row.id for row in other_before]
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        rng = random.Random(11)
+        actions = [
+            ('recategorize', lambda where: bulk_recategorize(owner.id, where, 'travel')),
+            ('shift', lambda where: bulk_shift_dates(owner.id, where, -3, owner.home_currency)),
+            ('delete', lambda where: bulk_delete(owner.id, where)),
+        ]
+        print(f'{"action":<13} {"selected":>8} {"changed":>8} {"queries":>8} {"ms":>10}')
+        for name, action in actions:
+            for size in SELECTION_SIZES:
+                owner_ids = db.session.execute(
+                    select(Expense.id).where(Expense.user_id == owner.id)
+                ).scalars().all()
+                # Half of the other user's ids are mixed in; they must match nothing
+                ids = rng.sample(owner_ids, size) + rng.sample(other_ids, size // 2)
+                where = selection_conditions(owner.id, ids=ids)
+                queries.clear()
+                started = time.perf_counter()
+                changed = action(where)
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f'{name:<13} {size:>8} {changed:>8} {len(queries):>8} {elapsed:>10.2f}')
+                if changed > size:
+                    failures.append(f'{name} changed {changed} rows from a selection of {size}')
+                if len(queries) > MAX_QUERIES:
+                    failures.append(f'{name} of {size} rows took {len(queries)} queries')
+
+        db.session.expire_all()
+        incremental = rollup_rows()
+        rebuild_rollups()
+        if incremental != rollup_rows():
+            failures.append('rollups drifted from a full rebuild')
+        if user_fingerprint(other.id) != other_before:
+            failures.append("another user's expenses were modified")
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: bounded query count, exact rollups, other users untouched')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Compare write throughput of the engine profiles under concurrent workers.
+
+Usage:
+    python benchmarks/bench_db_profiles.py [--workers 4] [--threads 2] [--writes 500]
+
+    # The same against a local PostgreSQL
+    DATABASE_URL=postgresql://localhost/finance_bench python benchmarks/bench_db_profiles.py
+
+Each profile gets a fresh database (a throwaway SQLite file, or a scratch
+table on PostgreSQL). --workers processes, each with --threads threads,
+insert one expense-sized row per transaction through an engine built
+exactly as create_app() would build it. Reports committed writes per
+second and how many transactions failed, e.g. with "database is locked".
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Date, Float, Integer, MetaData, String, Table, create_engine, func  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from db_profiles import apply_sqlite_pragmas, engine_options, resolve_profile, sqlite_pragmas  # noqa: E402
+
+metadata = MetaData()
+bench_writes = Table(
+    'bench_profile_writes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('worker', Integer, nullable=False),
+    Column('amount', Float, nullable=False),
+    Column('category', String(100), nullable=False),
+    Column('date', Date, nullable=False, server_default=func.current_date()),
+    Column('description', String(255)),
+)
+
+
+def make_engine(url, profile):
+    engine = create_engine(url, **engine_options(url, profile))
+    apply_sqlite_pragmas(engine, sqlite_pragmas(url, profile))
+    return engine
+
+
+def writer(url, profile, worker, threads, writes, results):
+    engine = make_engine(url, profile)
+    counts = {'ok': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def run():
+        for i in range(writes):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(bench_writes.insert(), {
+                        'worker': worker, 'amount': i * 0.01, 'category': 'food', 'description': f'write {i}',
+                    })
+                outcome = 'ok'
+            except OperationalError:
+                outcome = 'failed'
+            with lock:
+                counts[outcome] += 1
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    engine.dispose()
+    results.put(counts)
+
+
+def run_profile(url, profile, args):
+    engine = make_engine(url, profile)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    engine.dispose()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=writer, args=(url, profile, worker, args.threads, args.writes, results))
+                 for worker in range(args.workers)]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = {'ok': 0, 'failed': 0}
+    for _ in processes:
+        counts = results.get()
+        totals['ok'] += counts['ok']
+        totals['failed'] += counts['failed']
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    engine = make_engine(url, profile)
+    metadata.drop_all(engine)
+    engine.dispose()
+    return totals, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Engine profile write benchmark.')
+    parser.add_argument('--workers', type=int, default=4, help='writer processes (gunicorn workers)')
+    parser.add_argument('--threads', type=int, default=2, help='threads per worker')
+    parser.add_argument('--writes', type=int, default=500, help='transactions per thread')
+    args = parser.parse_args()
+
+    base_url = os.environ.get('DATABASE_URL')
+    if base_url and not base_url.startswith('sqlite'):
+        profiles = ('legacy', resolve_profile(base_url, 'auto'))
+    else:
+        base_url = None
+        profiles = ('legacy', 'sqlite-wal')
+    os.environ['GUNICORN_THREADS'] = str(args.threads)
+
+    print(f'workers={args.workers} threads={args.threads} writes/thread={args.writes}')
+    print(f'{"profile":<15} {"committed":>10} {"failed":>8} {"seconds":>9} {"writes/s":>10}')
+    for profile in profiles:
+        if base_url is None:
+            url = f'sqlite:///{os.path.join(tempfile.mkdtemp(), f"{profile}.db")}'
+        else:
+            url = base_url
+        totals, elapsed = run_profile(url, profile, args)
+        print(f'{profile:<15} {totals["ok"]:>10} {totals["failed"]:>8} {elapsed:>9.2f} '
+              f'{totals["ok"] / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
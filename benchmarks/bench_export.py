@@ -0,0 +1,87 @@
+"""Measure peak Python memory of the streaming CSV export at several sizes.
+
+Usage:
+    python benchmarks/bench_export.py [--gzip]
+
+Runs against a throwaway SQLite file; peak memory should stay flat as the
+number of exported expenses grows.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_export.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+
+from app import app, db  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from models import Expense, User  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+SIZES = (1000, 10000, 100000, 500000)
+BATCH = 50000
+
+
+def grow_to(user_id, current, target, rng):
+    start = date.today() - timedelta(days=3650)
+    while current < target:
+        batch = min(BATCH, target - current)
+        amounts = [rng.randint(100, 50000) for _ in range(batch)]
+        db.session.execute(Expense.__table__.insert(), [
+            {
+                'user_id': user_id,
+                'amount_minor': amounts[i],
+                'currency': 'USD',
+                'home_amount_minor': amounts[i],
+                'category': rng.choice(CATEGORIES),
+                'date': start + timedelta(days=rng.randrange(3650)),
+                'description': f'Expense {current + i}',
+            }
+            for i in range(batch)
+        ])
+        db.session.commit()
+        current += batch
+    return current
+
+
+def main():
+    compress = '--gzip' in sys.argv
+    app.config['WTF_CSRF_ENABLED'] = False
+    rng = random.Random(7)
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+    print(f'{"rows":>8} {"bytes":>12} {"peak KiB":>10} {"seconds":>8}')
+    rows = 0
+    for size in SIZES:
+        with app.app_context():
+            rows = grow_to(user_id, rows, size, rng)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        response = client.get('/export/csv', query_string={'gzip': 1} if compress else {}, buffered=False)
+        total = sum(len(chunk) for chunk in response.response)
+        response.close()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{size:>8} {total:>12} {peak // 1024:>10} {elapsed:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
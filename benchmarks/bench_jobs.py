@@ -0,0 +1,127 @@
+"""Check background report jobs against the inline export.
+
+Usage:
+    python benchmarks/bench_jobs.py
+
+Runs against a throwaway SQLite file (the job processes need to share it).
+Times how long a request is held by the inline /export/csv compared with
+queueing the same export, runs the queue with a process pool and checks
+that the export job produces the same bytes, statements match the rollups,
+and the per-user limit on active jobs is enforced. Exits non-zero on any
+mismatch.
+"""
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORK_DIR = tempfile.mkdtemp(prefix='jobs-bench-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORK_DIR, "bench.db")}'
+os.environ['JOBS_RESULT_DIR'] = os.path.join(WORK_DIR, 'results')
+os.environ['JOBS_MAX_ACTIVE_PER_USER'] = '2'
+
+from app import app, db  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from jobs import JOB_DONE, run_jobs  # noqa: E402
+from models import Expense, Job, User  # noqa: E402
+import rollups  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+EXPENSE_COUNT = 100000
+
+
+def seed(user_id):
+    rng = random.Random(11)
+    today = date.today()
+    amounts = [rng.randint(100, 30000) for _ in range(EXPENSE_COUNT)]
+    db.session.execute(Expense.__table__.insert(), [
+        {'user_id': user_id, 'amount_minor': amount_minor, 'currency': 'USD', 'home_amount_minor': amount_minor,
+         'category': rng.choice(CATEGORIES), 'date': today - timedelta(days=rng.randrange(3 * 365)),
+         'description': f'Expense {index}'}
+        for index, amount_minor in enumerate(amounts)
+    ])
+    db.session.commit()
+    rollups.rebuild_rollups(user_id)
+
+
+def timed(call):
+    started = time.perf_counter()
+    result = call()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def job_count():
+    with app.app_context():
+        return db.session.query(Job).count()
+
+
+def drain_queue():
+    with app.app_context():
+        ran, elapsed = timed(lambda: run_jobs(workers=2, until_idle=True))
+    print(f'ran {ran} jobs in {elapsed:.0f} ms')
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    failures = []
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='jobbench', email='jobbench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        seed(user_id)
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'jobbench@example.com', 'password': 'benchmark'})
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+    month_value = f'{last_month.year}-{last_month.month:02d}'
+
+    inline, inline_ms = timed(lambda: client.get('/export/csv').get_data())
+    _, queue_ms = timed(lambda: client.post('/reports/export', data={}))
+    print(f'request held by export: {inline_ms:.0f} ms inline, {queue_ms:.1f} ms to queue')
+
+    client.post('/reports/statement', data={'month': month_value, 'format': 'html'})
+    client.post('/reports/statement', data={'month': month_value, 'format': 'csv'})
+    if job_count() != 2:
+        failures.append(f'expected the third job to be refused, found {job_count()} jobs')
+    drain_queue()
+    client.post('/reports/statement', data={'month': month_value, 'format': 'csv'})
+    drain_queue()
+
+    with app.app_context():
+        jobs = db.session.query(Job).order_by(Job.id).all()
+        if any(job.status != JOB_DONE for job in jobs):
+            failures.append('jobs did not finish: ' + ', '.join(f'{job.id} {job.status} {job.error}' for job in jobs))
+        month_total = rollups.month_total(user_id, last_month.year, last_month.month)
+
+    if not failures:
+        export, html_statement, csv_statement = (client.get(f'/reports/{job.id}/download') for job in jobs)
+        if export.get_data() != inline:
+            failures.append('the export job differs from the inline export')
+        if 'attachment' not in export.headers.get('Content-Disposition', ''):
+            failures.append('the download is not served as an attachment')
+        if f'{month_total:,.2f}' not in html_statement.get_data(as_text=True):
+            failures.append('the HTML statement total does not match the rollups')
+        summary = list(csv.reader(io.StringIO(csv_statement.get_data(as_text=True))))
+        total_row = next(row for row in summary if row and row[0] == 'Total')
+        if float(total_row[1]) != round(month_total, 2):
+            failures.append('the CSV statement total does not match the rollups')
+        status = client.get(f'/reports/{jobs[0].id}/status').get_json()
+        if status['status'] != JOB_DONE or status['progress'] != 100 or not status['download_url']:
+            failures.append(f'unexpected job status {status}')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: background reports match the inline export and the rollups')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Exercise primary/replica routing against two local SQLite files.
+
+Usage:
+    python benchmarks/bench_replicas.py
+
+Creates a primary database, copies it to two "replica" files next to one
+unreachable replica URL, and counts which engine serves each request:
+list pages should read from exactly one replica each, spread over the
+healthy replicas, a write should pin the user to the primary for
+REPLICA_PIN_SECONDS, and the unreachable replica should be skipped by its
+health check. Exits non-zero if any check fails.
+The same script works against two local Postgres instances by setting
+DATABASE_URL and DATABASE_REPLICA_URLS before running it.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp()
+if 'DATABASE_REPLICA_URLS' not in os.environ:
+    primary_path = os.path.join(_tmp, 'primary.db')
+    replica_paths = [os.path.join(_tmp, 'replica_a.db'), os.path.join(_tmp, 'replica_b.db')]
+    os.environ['DATABASE_URL'] = f'sqlite:///{primary_path}'
+    # replica_1 is unreachable
+    os.environ['DATABASE_REPLICA_URLS'] = (
+        f'sqlite:///{replica_paths[0]},sqlite:////nonexistent-dir/replica.db,sqlite:///{replica_paths[1]}'
+    )
+else:
+    primary_path, replica_paths = None, []
+os.environ['REPLICA_PIN_SECONDS'] = '1'
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import User  # noqa: E402
+from shards import create_schema  # noqa: E402
+
+PATHS = ('/expenses', '/budgets', '/api/v1/categories')
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    served_by = []
+
+    with app.app_context():
+        create_schema()
+        user = User(username='replicabench', email='replicabench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        db.session.remove()
+        if primary_path:
+            db.engines[None].dispose()
+            for replica_path in replica_paths:
+                shutil.copyfile(primary_path, replica_path)
+        for key, engine in db.engines.items():
+            event.listen(engine, 'before_cursor_execute',
+                         lambda *_, key=key: served_by.append(key or 'primary'))
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'replicabench@example.com', 'password': 'benchmark'})
+
+    def reads(path):
+        served_by.clear()
+        client.get(path)
+        return set(served_by)
+
+    def replicas(engines):
+        return {key for key in engines if key.startswith('replica_')}
+
+    failures = []
+    used = set()
+    for path in PATHS * 2:
+        engines = reads(path)
+        print(f'{path:<22} served by {", ".join(sorted(engines))}')
+        if len(replicas(engines)) != 1:
+            failures.append(f'{path} read from {sorted(replicas(engines)) or "no replica"}, not one replica')
+        used |= replicas(engines)
+    if 'replica_1' in used:
+        failures.append('unreachable replica was not skipped')
+    if replica_paths and used != {'replica_0', 'replica_2'}:
+        failures.append(f'requests were not spread over both healthy replicas: {sorted(used)}')
+
+    client.post('/expense/add', data={
+        'amount': '12.50', 'currency': 'USD', 'category': 'food', 'date': date.today().isoformat(), 'description': 'pinned',
+    })
+    engines = reads('/expenses')
+    print(f'{"after write":<22} served by {", ".join(sorted(engines))}')
+    if engines != {'primary'}:
+        failures.append('read right after a write did not go to the primary')
+
+    time.sleep(app.config['REPLICA_PIN_SECONDS'] + 0.1)
+    engines = reads('/expenses')
+    print(f'{"after pin expiry":<22} served by {", ".join(sorted(engines))}')
+    if len(replicas(engines)) != 1 or 'replica_1' in engines:
+        failures.append('reads did not return to one healthy replica after the pin expired')
+
+    shutil.rmtree(_tmp, ignore_errors=True)
+    if failures:
+        print('FAILURES:')
+        for failure in failures:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('Replica routing behaves as expected.')
+
+
+if __name__ == '__main__':
+    main()
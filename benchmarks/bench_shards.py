@@ -0,0 +1,175 @@
+"""Exercise user sharding, online moves and rebalancing against local SQLite files.
+
+Usage:
+    python benchmarks/bench_shards.py
+
+Creates a directory database and three shard files. Users register, log in
+and add expenses and budgets through the routes; each user's rows must be
+on their shard alone, and the directory database must hold no user data.
+One user is then moved to another shard: their writes must be refused with
+a 503 while reads keep working during the move, and afterwards the target
+must hold exactly the rows (ids included) the source held, while the source
+holds none. Draining a shard with rebalancing must move that shard's users
+only. Finally, the fraction of users the hash ring reassigns when a fourth
+shard is added is reported; it should be about a quarter. Exits non-zero if
+any check fails.
+"""
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "directory.db")}'
+os.environ['DATABASE_SHARD_URLS'] = ','.join(f'sqlite:///{os.path.join(_tmp, f"shard{index}.db")}' for index in range(3))
+
+from sqlalchemy import inspect, select  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import ShardDirectory  # noqa: E402
+from shards import GLOBAL_TABLES, HashRing, _owner_filter, misplaced_users, move_users, sharded_tables  # noqa: E402
+
+USERS = 12
+EXPENSES_PER_USER = 5
+RING_SAMPLE = 20000
+
+
+def register_and_fill(index):
+    client = app.test_client()
+    email = f'shard{index}@example.com'
+    client.post('/register', data={'username': f'shardbench{index}', 'email': email, 'password': 'benchmark',
+                                   'confirm_password': 'benchmark'})
+    client.post('/login', data={'email': email, 'password': 'benchmark'})
+    today = date.today()
+    for day in range(EXPENSES_PER_USER):
+        client.post('/expense/add', data={'amount': f'{index + 1}.{day:02d}', 'currency': 'USD', 'category': 'food',
+                                          'date': (today - timedelta(days=day)).isoformat(),
+                                          'description': f'User {index} expense {day}'})
+    client.post('/budgets', data={'category': 'food', 'limit_amount': '100', 'start_date': today.isoformat(),
+                                  'end_date': (today + timedelta(days=30)).isoformat()})
+    return client
+
+
+def directory():
+    with app.app_context():
+        return dict(db.session.execute(select(ShardDirectory.user_id, ShardDirectory.shard)).all())
+
+
+def user_id_of(index):
+    with app.app_context():
+        return db.session.execute(
+            select(ShardDirectory.user_id).where(ShardDirectory.email == f'shard{index}@example.com')
+        ).scalar()
+
+
+def user_rows(key, user_id):
+    """{table name: rows} the user owns on shard `key`."""
+    with app.app_context(), db.engines[key].connect() as connection:
+        return {
+            table.name: connection.execute(
+                select(table).where(_owner_filter(table, user_id)).order_by(*table.primary_key.columns)
+            ).all()
+            for table in sharded_tables()
+        }
+
+
+def placement_failures(shards):
+    failures = []
+    for user_id, shard in directory().items():
+        for key in shards:
+            expenses = len(user_rows(key, user_id)['expense'])
+            if key == shard and expenses != EXPENSES_PER_USER:
+                failures.append(f'user {user_id} has {expenses} expenses on their shard {key}')
+            elif key != shard and expenses:
+                failures.append(f'user {user_id} has {expenses} expenses on {key}, not their shard {shard}')
+    return failures
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    failures = []
+    with app.app_context():
+        shards = sorted(key for key in db.engines if key and key.startswith('shard_'))
+        directory_tables = set(inspect(db.engine).get_table_names())
+    if directory_tables - GLOBAL_TABLES:
+        failures.append(f'the directory database holds {sorted(directory_tables - GLOBAL_TABLES)}')
+
+    clients = {}
+    for index in range(USERS):
+        clients[index] = register_and_fill(index)
+    placed = directory()
+    if len(placed) != USERS:
+        failures.append(f'{len(placed)} of {USERS} registrations reached the directory')
+    print('users per shard: ' + ', '.join(f'{key} {list(placed.values()).count(key)}' for key in shards))
+    failures += placement_failures(shards)
+    if clients[0].get('/dashboard').status_code != 200 or clients[0].get('/api/v1/expenses').status_code != 200:
+        failures.append('a logged-in user cannot read their pages')
+
+    # Move a user up from the first shard. On SQLite a move down would raise the target's id counter into
+    # the source's range, so the next write there could collide with an id still on the source (see shards.py)
+    index = next(index for index in clients if placed[user_id_of(index)] == shards[0])
+    user_id, client = user_id_of(index), clients[index]
+    source, target = shards[0], shards[1]
+    before = user_rows(source, user_id)
+    during = {}
+
+    def wait(seconds):
+        if 'write' not in during:
+            during['write'] = client.post('/expense/add', data={'amount': '9.99', 'currency': 'USD',
+                                                                'category': 'food', 'date': date.today().isoformat()})
+            during['read'] = client.get('/expenses')
+
+    with app.app_context():
+        moved = move_users([(user_id, target)], sleep=wait)[user_id]
+    if during['write'].status_code != 503 or 'Retry-After' not in during['write'].headers:
+        failures.append(f'a write during the move answered {during["write"].status_code}, expected 503')
+    if during['read'].status_code != 200:
+        failures.append(f'a read during the move answered {during["read"].status_code}')
+    after = user_rows(target, user_id)
+    if moved is None or after != before:
+        failures.append(f'the moved user\'s rows differ on {target} (moved: {moved})')
+    if any(user_rows(source, user_id).values()):
+        failures.append(f'the moved user\'s rows are still on {source}')
+    client.post('/expense/add', data={'amount': '1.00', 'currency': 'USD', 'category': 'food',
+                                      'date': date.today().isoformat()})
+    if len(user_rows(target, user_id)['expense']) != EXPENSES_PER_USER + 1:
+        failures.append('a write after the move did not land on the new shard')
+    else:
+        print(f'moved user {user_id} from {source} to {target}: {moved} rows, ids preserved')
+
+    # Drain the last shard
+    drained = shards[-1]
+    placed = directory()
+    with app.app_context():
+        # The user moved by hand above is off their ring shard already
+        already = {user for user, _, _ in misplaced_users()}
+        misplaced = misplaced_users(exclude=[drained])
+        on_drained = {user for user, shard in placed.items() if shard == drained}
+        moving = {user for user, _, _ in misplaced}
+        if not on_drained <= moving or moving - on_drained - already:
+            failures.append(f'draining {drained} would move users that are not on it')
+        results = move_users([(user, shard) for user, _, shard in misplaced], sleep=lambda seconds: None)
+    if any(rows is None for rows in results.values()) or drained in directory().values():
+        failures.append(f'{drained} still has users after draining it')
+    for user, _, _ in misplaced:
+        if any(user_rows(drained, user).values()):
+            failures.append(f'user {user} left rows on the drained {drained}')
+    print(f'drained {drained}: moved {len(misplaced)} users')
+
+    # Consistent hashing: a new shard takes about 1/N of the users, all from the others
+    ring, grown = HashRing(shards), HashRing(shards + ['shard_3'])
+    reassigned = [user for user in range(1, RING_SAMPLE + 1) if ring.shard_for(user) != grown.shard_for(user)]
+    fraction = len(reassigned) / RING_SAMPLE
+    print(f'adding a 4th shard reassigns {fraction:.1%} of {RING_SAMPLE} users')
+    if any(grown.shard_for(user) != 'shard_3' for user in reassigned) or not 0.15 < fraction < 0.35:
+        failures.append(f'adding a shard reassigned {fraction:.1%} of users, or moved users between old shards')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: users stay on one shard, move online without losing rows and rebalance by the ring')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Cold-start regression check for the production boot path.
+
+Usage:
+    python benchmarks/bench_startup.py --save-baseline
+    python benchmarks/bench_startup.py            # compare
+    python benchmarks/bench_startup.py --max-ms 1500
+
+Boots the app in fresh interpreters with APP_ENV=production against an
+empty SQLite file and reports the fastest run per phase. The run exits
+non-zero when the total boot time regresses past the stored baseline
+(benchmarks/baselines/startup.json) or the --max-ms budget. That a
+production boot runs no DDL and defers NumPy is checked by
+tests/test_startup.py.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startup import cold_start_profile  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'startup.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start regression check.')
+    parser.add_argument('--runs', type=int, default=5, help='cold boots; the fastest is kept')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed total-time regression (fraction)')
+    parser.add_argument('--max-ms', type=float, default=None, help='absolute budget for the total boot time')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'startup.db')
+        env = {'APP_ENV': 'production', 'DATABASE_URL': f'sqlite:///{db_path}', 'LOG_LEVEL': 'WARNING'}
+        os.environ.pop('AUTO_CREATE_SCHEMA', None)
+        profiles = [cold_start_profile(env) for _ in range(max(args.runs, 1))]
+
+    best = min(profiles, key=lambda profile: profile['total'])
+    for name, seconds in best['phases']:
+        print(f'{name:<20} {seconds * 1000:>9.1f} ms')
+    total_ms = round(best['total'] * 1000, 1)
+    print(f'{"total":<20} {total_ms:>9.1f} ms')
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        failures.append(f'total {total_ms}ms > budget {args.max_ms}ms')
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w') as baseline_file:
+            json.dump({'total_ms': total_ms, 'phases_ms': {name: round(s * 1000, 1) for name, s in best['phases']}},
+                      baseline_file, indent=2, sort_keys=True)
+        print(f'Baseline saved to {BASELINE_PATH}')
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+        if total_ms > baseline['total_ms'] * (1 + args.threshold):
+            failures.append(f'total {total_ms}ms > baseline {baseline["total_ms"]}ms')
+
+    if failures:
+        print('REGRESSIONS:')
+        for failure in failures:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
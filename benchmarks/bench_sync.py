@@ -0,0 +1,156 @@
+"""Check /api/v1/sync: a replayed client must match the database.
+
+Usage:
+    python benchmarks/bench_sync.py
+
+Runs against a throwaway in-memory SQLite database. A simulated client
+pulls a full snapshot in batches, then the app is changed through its
+routes (single edits, bulk edits, budgets, reminders, goals) and the client
+pulls only the delta. After each pull the client's copy must equal the
+database; the delta must be a small fraction of the snapshot's bytes.
+Finally the log is pruned and a stale cursor must be told to start over.
+Exits non-zero on any mismatch.
+"""
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from app import app, db  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from models import Budget, Expense, Goal, Reminder, User  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from sync import SYNCED_MODELS, prune_changes, row_to_dict  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+EXPENSE_COUNT = 20000
+BATCH = 1000
+
+
+def seed(user_id):
+    rng = random.Random(3)
+    today = date.today()
+    amounts = [rng.randint(100, 30000) for _ in range(EXPENSE_COUNT)]
+    db.session.execute(Expense.__table__.insert(), [
+        {'user_id': user_id, 'amount_minor': amount_minor, 'currency': 'USD', 'home_amount_minor': amount_minor,
+         'category': rng.choice(CATEGORIES), 'date': today - timedelta(days=rng.randrange(700)),
+         'description': f'Expense {index}'}
+        for index, amount_minor in enumerate(amounts)
+    ])
+    for index in range(20):
+        db.session.add(Budget(user_id=user_id, category=CATEGORIES[index % len(CATEGORIES)], limit_minor=50000,
+                              start_date=today - timedelta(days=30 * index), end_date=today - timedelta(days=30 * index - 29)))
+        db.session.add(Reminder(user_id=user_id, bill_name=f'Bill {index}', due_date=today + timedelta(days=index),
+                                amount=10.0 + index))
+        db.session.add(Goal(user_id=user_id, name=f'Goal {index}', target_minor=100000, current_minor=index * 1000,
+                            due_date=today + timedelta(days=365)))
+    db.session.commit()
+    rebuild_rollups(user_id)
+
+
+def pull(client, replica, cursor):
+    """Apply batches until has_more is false; return (cursor, bytes, changes)."""
+    received = changes = 0
+    while True:
+        response = client.get('/api/v1/sync', query_string={'since': cursor or '', 'limit': BATCH})
+        if response.status_code != 200:
+            sys.exit(f'sync returned {response.status_code}: {response.get_data(as_text=True)}')
+        received += len(response.get_data())
+        body = response.get_json()
+        for change in body['changes']:
+            changes += 1
+            if change['op'] == 'delete':
+                replica.pop((change['entity'], change['id']), None)
+            else:
+                replica[(change['entity'], change['id'])] = change['data']
+        cursor = body['cursor']
+        if not body['has_more']:
+            return cursor, received, changes
+
+
+def database_state(user_id):
+    with app.app_context():
+        return {
+            (name, row.id): json.loads(json.dumps(row_to_dict(row)))
+            for name, model in SYNCED_MODELS.items()
+            for row in model.query.filter_by(user_id=user_id)
+        }
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    failures = []
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='syncbench', email='syncbench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        seed(user_id)
+        expense_ids = [expense_id for expense_id, in db.session.query(Expense.id).order_by(Expense.id).limit(300)]
+        reminder_id = db.session.query(Reminder.id).filter_by(user_id=user_id).first()[0]
+        goal_id = db.session.query(Goal.id).filter_by(user_id=user_id).first()[0]
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'syncbench@example.com', 'password': 'benchmark'})
+    replica = {}
+
+    started = time.perf_counter()
+    cursor, snapshot_bytes, snapshot_changes = pull(client, replica, None)
+    elapsed = time.perf_counter() - started
+    print(f'snapshot: {snapshot_changes} rows, {snapshot_bytes / 1024:.0f} KiB in {elapsed:.2f}s')
+    if replica != database_state(user_id):
+        failures.append('the snapshot differs from the database')
+    stale_cursor = cursor
+
+    today = date.today().isoformat()
+    client.post('/expense/add', data={'amount': '12.50', 'currency': 'USD', 'category': 'food',
+                                      'date': today, 'description': 'sync check'})
+    client.post(f'/expense/edit/{expense_ids[0]}', data={'amount': '99.99', 'currency': 'USD', 'category': 'travel',
+                                                          'date': today, 'description': 'edited'})
+    client.post(f'/expense/delete/{expense_ids[1]}')
+    client.post('/expenses/bulk', data={'action': 'recategorize', 'scope': 'selected', 'new_category': 'other',
+                                        'ids': expense_ids[2:150]})
+    client.post('/expenses/bulk', data={'action': 'delete', 'scope': 'selected', 'ids': expense_ids[150:200]})
+    client.post('/expenses/bulk', data={'action': 'shift', 'scope': 'selected', 'days': '3',
+                                        'ids': expense_ids[200:300]})
+    client.post('/budgets', data={'category': 'food', 'limit_amount': '300', 'start_date': today, 'end_date': today})
+    client.post(f'/reminder/delete/{reminder_id}')
+    client.post(f'/goal/delete/{goal_id}')
+
+    cursor, delta_bytes, delta_changes = pull(client, replica, cursor)
+    print(f'delta:    {delta_changes} rows, {delta_bytes / 1024:.1f} KiB '
+          f'({delta_bytes / snapshot_bytes:.1%} of the snapshot)')
+    if replica != database_state(user_id):
+        failures.append('the replayed delta differs from the database')
+    if delta_changes > 400:
+        failures.append(f'the delta sent {delta_changes} rows for about 300 changed ones')
+
+    _, idle_bytes, idle_changes = pull(client, replica, cursor)
+    if idle_changes:
+        failures.append(f'an up-to-date cursor received {idle_changes} changes')
+
+    with app.app_context():
+        pruned = prune_changes(datetime.now() + timedelta(seconds=1))
+    print(f'pruned {pruned} change log entries')
+    if client.get('/api/v1/sync', query_string={'since': stale_cursor}).status_code != 410:
+        failures.append('a cursor behind the pruned log was not told to start over')
+    if client.get('/api/v1/sync', query_string={'since': cursor}).status_code != 200:
+        failures.append('an up-to-date cursor was rejected after pruning')
+    if client.get('/api/v1/sync', query_string={'since': 'garbage'}).status_code != 400:
+        failures.append('a malformed cursor was accepted')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: snapshot and delta replay match the database')
+
+
+if __name__ == '__main__':
+    main()
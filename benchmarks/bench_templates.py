@@ -0,0 +1,117 @@
+"""Measure template compile and render time with the template caches.
+
+Usage:
+    python benchmarks/bench_templates.py
+
+Runs against a throwaway in-memory SQLite database. Compares a cold
+template load with and without the Jinja bytecode cache, then renders the
+heavy pages with the fragment cache off and on. Exits non-zero if the
+cached pages differ from the uncached ones or a write does not show up.
+"""
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['JINJA_BYTECODE_CACHE_DIR'] = tempfile.mkdtemp(prefix='jinja-bench-')
+
+from app import app, db  # noqa: E402
+from forms import EXPENSE_CATEGORIES  # noqa: E402
+from models import Budget, Expense, User  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from templating import warm_templates  # noqa: E402
+
+CATEGORIES = [value for value, _ in EXPENSE_CATEGORIES[1:]]
+PAGES = ('/dashboard', '/analytics', '/budgets')
+ROUNDS = 20
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="[^"]*"')
+
+
+def seed(user_id):
+    rng = random.Random(9)
+    today = date.today()
+    amounts = [rng.randint(100, 30000) for _ in range(5000)]
+    db.session.execute(Expense.__table__.insert(), [
+        {'user_id': user_id, 'amount_minor': amount_minor, 'currency': 'USD', 'home_amount_minor': amount_minor,
+         'category': rng.choice(CATEGORIES), 'date': today - timedelta(days=rng.randrange(400)),
+         'description': f'Expense {index}'}
+        for index, amount_minor in enumerate(amounts)
+    ])
+    for index in range(40):
+        start = today - timedelta(days=index * 10)
+        db.session.add(Budget(user_id=user_id, category=CATEGORIES[index % len(CATEGORIES)],
+                              limit_minor=100000, start_date=start, end_date=start + timedelta(days=30)))
+    db.session.commit()
+    rebuild_rollups(user_id)
+
+
+def cold_load_ms(bytecode_cache):
+    env = app.jinja_env.overlay(cache_size=400, bytecode_cache=bytecode_cache)
+    started = time.perf_counter()
+    for name in env.list_templates():
+        if name.endswith('.html'):
+            env.get_template(name)
+    return (time.perf_counter() - started) * 1000
+
+
+def render_ms(response):
+    return sum(float(match) for match in re.findall(r'render;dur=([\d.]+)', response.headers.get('Server-Timing', '')))
+
+
+def fetch(client, path):
+    response = client.get(path)
+    if response.status_code != 200:
+        sys.exit(f'{path} returned {response.status_code}')
+    return response
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['METRICS_DEBUG_HEADERS'] = True
+    failures = []
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='tplbench', email='tplbench@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.commit()
+        seed(user.id)
+
+        without = min(cold_load_ms(None) for _ in range(5))
+        warm_templates(app)
+        with_cache = min(cold_load_ms(app.jinja_env.bytecode_cache) for _ in range(5))
+        print(f'cold template load: {without:.1f} ms from source, {with_cache:.1f} ms from bytecode cache')
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'tplbench@example.com', 'password': 'benchmark'})
+    fragment_cache = app.jinja_env.fragment_cache
+
+    print(f'{"page":<12} {"uncached ms":>12} {"fragments ms":>13}')
+    for path in PAGES:
+        app.jinja_env.fragment_cache = None
+        plain = [fetch(client, path) for _ in range(ROUNDS)]
+        app.jinja_env.fragment_cache = fragment_cache
+        cached = [fetch(client, path) for _ in range(ROUNDS)]
+        # The first cached request fills the fragments
+        print(f'{path:<12} {min(map(render_ms, plain)):>12.2f} {min(map(render_ms, cached[1:])):>13.2f}')
+        if CSRF.sub('', plain[-1].get_data(as_text=True)) != CSRF.sub('', cached[-1].get_data(as_text=True)):
+            failures.append(f'{path} renders differently with fragment caching')
+
+    client.post('/expense/add', data={'amount': '123.45', 'currency': 'USD', 'category': 'food',
+                                      'date': date.today().isoformat(), 'description': 'fragment check'})
+    if 'fragment check' not in fetch(client, '/dashboard').get_data(as_text=True):
+        failures.append('a new expense did not invalidate the cached dashboard fragment')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+    print('OK: cached fragments match and are invalidated by writes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Compare gunicorn worker models under concurrent load.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/seed.py --users 20 --expenses 200000
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/bench_workers.py --clients 16 --seconds 20
+
+Starts gunicorn with gunicorn.conf.py once per worker class (sync, gthread
+and, when installed, gevent) on a free local port, logs in as several of
+the seeded users and has `--clients` threads request the run_routes.py
+route mix for `--seconds`. Reports throughput, p50/p95 latency and how long
+the first request of each client took, i.e. whether the warmup hook did
+its job. Exits non-zero if a server fails to start or any request fails.
+"""
+import argparse
+import http.cookiejar
+import importlib.util
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from run_routes import ROUTES, percentile  # noqa: E402
+
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]*)"')
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(worker_class, port, workers, threads):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_BIND=f'127.0.0.1:{port}',
+               GUNICORN_ACCESS_LOG='', LOG_LEVEL='warning')
+    if workers:
+        env['GUNICORN_WORKERS'] = str(workers)
+    if threads:
+        env['GUNICORN_THREADS'] = str(threads)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              cwd=PROJECT_DIR, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f'gunicorn ({worker_class}) exited with {server.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=2).close()
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit(f'gunicorn ({worker_class}) did not start within 60s')
+
+
+def logged_in_opener(base_url, email):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    with opener.open(f'{base_url}/login') as response:
+        token = CSRF.search(response.read().decode()).group(1)
+    data = urllib.parse.urlencode({'csrf_token': token, 'email': email, 'password': 'loadtest'}).encode()
+    with opener.open(f'{base_url}/login', data=data) as response:
+        if not response.url.endswith('/dashboard'):
+            sys.exit(f'could not log in as {email}; run benchmarks/seed.py first')
+    return opener
+
+
+def client_loop(opener, base_url, stop_at, latencies, errors):
+    paths = list(ROUTES.values())
+    index = 0
+    while time.monotonic() < stop_at:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            with opener.open(base_url + path, timeout=120) as response:
+                while response.read(65536):
+                    pass
+        except (urllib.error.URLError, ConnectionError) as exc:
+            errors.append(f'{path}: {exc}')
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+def run(worker_class, args):
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_server(worker_class, port, args.workers, args.threads)
+    try:
+        openers = [logged_in_opener(base_url, f'loaduser{index % args.users}@example.com')
+                   for index in range(args.clients)]
+        samples = [[] for _ in openers]
+        errors = []
+        stop_at = time.monotonic() + args.seconds
+        clients = [threading.Thread(target=client_loop, args=(opener, base_url, stop_at, latencies, errors))
+                   for opener, latencies in zip(openers, samples)]
+        started = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for sample in samples for latency in sample]
+    if not latencies:
+        sys.exit(f'{worker_class}: no request completed')
+    return {
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': percentile(latencies, 0.95),
+        'first_ms': max(sample[0] for sample in samples if sample),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare gunicorn worker models.')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client threads')
+    parser.add_argument('--seconds', type=float, default=20, help='load duration per worker class')
+    parser.add_argument('--users', type=int, default=10, help='seeded users to spread clients over')
+    parser.add_argument('--workers', type=int, help='GUNICORN_WORKERS (default: gunicorn.conf.py)')
+    parser.add_argument('--threads', type=int, help='GUNICORN_THREADS (default: gunicorn.conf.py)')
+    parser.add_argument('--worker-classes', nargs='*', default=list(WORKER_CLASSES), choices=WORKER_CLASSES)
+    args = parser.parse_args()
+
+    failures = []
+    print(f'{"worker class":<13} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"first ms":>9}')
+    for worker_class in args.worker_classes:
+        if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print(f'{worker_class:<13} skipped (gevent is not installed)')
+            continue
+        result = run(worker_class, args)
+        print(f'{worker_class:<13} {result["requests_per_s"]:>8.1f} {result["p50_ms"]:>9.1f} '
+              f'{result["p95_ms"]:>9.1f} {result["first_ms"]:>9.1f}')
+        if result['errors']:
+            failures.append(f'{worker_class}: {len(result["errors"])} failed requests, e.g. {result["errors"][0]}')
+
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
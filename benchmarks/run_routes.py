@@ -0,0 +1,166 @@
+"""Route-level load benchmark with JSON baselines.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/seed.py --users 20 --expenses 1000000
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/run_routes.py --save-baseline
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/run_routes.py   # compare
+
+    # The same against a local PostgreSQL
+    DATABASE_URL=postgresql://localhost/finance_bench python benchmarks/seed.py ...
+    DATABASE_URL=postgresql://localhost/finance_bench python benchmarks/run_routes.py ...
+
+Drives each route through the Flask test client as the seeded user with
+the most expenses and reports p50/p95/p99 latency, SQL statements per
+request and peak traced memory. Baselines are stored per database backend
+in benchmarks/baselines/<backend>.json; a run exits non-zero when p95
+latency or the query count regresses past the threshold.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, func  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import Expense  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+ROUTES = {
+    'dashboard': '/dashboard',
+    'analytics': '/analytics',
+    'expenses': '/expenses',
+    'expenses_search': '/expenses?search=grocery',
+    'budgets': '/budgets',
+    'export_csv': '/export/csv',
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def heaviest_user_id():
+    return db.session.query(Expense.user_id).group_by(Expense.user_id).order_by(
+        func.count(Expense.id).desc()
+    ).limit(1).scalar()
+
+
+def fetch(client, path):
+    """GET a path, draining streamed bodies chunk by chunk; return the status."""
+    response = client.get(path, buffered=False)
+    for _ in response.response:
+        pass
+    response.close()
+    return response.status_code
+
+
+def run_route(client, path, requests, warm_cache, query_counts):
+    cache = app.extensions['response_cache']
+    latencies, queries = [], []
+
+    client.get(path).close()  # warm up templates and connections
+    for _ in range(requests):
+        if not warm_cache:
+            cache.backend.clear()
+        query_counts.clear()
+        started = time.perf_counter()
+        status = fetch(client, path)
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(len(query_counts))
+        if status != 200:
+            sys.exit(f'{path} returned {status}')
+
+    # Peak memory is measured on one extra request; tracing slows everything
+    # down too much to leave it on for the latency samples.
+    if not warm_cache:
+        cache.backend.clear()
+    tracemalloc.start()
+    fetch(client, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'queries': max(queries),
+        'peak_kib': peak // 1024,
+    }
+
+
+def compare(results, baseline, threshold):
+    failures = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            failures.append(f'{name}: p95 {result["p95_ms"]}ms > baseline {previous["p95_ms"]}ms')
+        if result['queries'] > previous['queries']:
+            failures.append(f'{name}: {result["queries"]} queries > baseline {previous["queries"]}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route-level load benchmark.')
+    parser.add_argument('--requests', type=int, default=30, help='requests per route')
+    parser.add_argument('--routes', nargs='*', default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument('--warm-cache', action='store_true', help='let the response cache serve repeat requests')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed p95 regression (fraction)')
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    query_counts = []
+
+    with app.app_context():
+        backend = db.engine.dialect.name
+        user_id = heaviest_user_id()
+        if user_id is None:
+            sys.exit('No expenses found; run benchmarks/seed.py first.')
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *_: query_counts.append(1))
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+    results = {}
+    print(f'backend={backend} user={user_id} requests={args.requests}')
+    print(f'{"route":<18} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KiB":>9}')
+    for name in args.routes:
+        result = run_route(client, ROUTES[name], args.requests, args.warm_cache, query_counts)
+        results[name] = result
+        print(f'{name:<18} {result["p50_ms"]:>9} {result["p95_ms"]:>9} {result["p99_ms"]:>9} '
+              f'{result["queries"]:>8} {result["peak_kib"]:>9}')
+
+    baseline_path = os.path.join(BASELINE_DIR, f'{backend}.json')
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f'Baseline saved to {baseline_path}')
+        return
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            failures = compare(results, json.load(baseline_file), args.threshold)
+        if failures:
+            print('REGRESSIONS:')
+            for failure in failures:
+                print(f'  {failure}')
+            sys.exit(1)
+        print('No regressions against baseline.')
+
+
+if __name__ == '__main__':
+    main()
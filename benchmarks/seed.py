@@ -0,0 +1,151 @@
+"""Generate realistic synthetic data for load testing.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/seed.py --users 20 --expenses 1000000
+
+Expenses are spread over users with a Zipf-like skew (a few heavy users own
+most rows), categories follow a fixed popularity curve and dates lean
+towards the recent past. Every user also gets budgets, goals and reminders.
+Rows are written with executemany in large batches, then the spending
+rollups are rebuilt.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db  # noqa: E402
+from budget_engine import reconcile_budgets  # noqa: E402
+from models import Budget, Expense, Goal, Reminder, User  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+CATEGORY_WEIGHTS = {
+    'food': 30, 'transport': 18, 'shopping': 14, 'utilities': 10, 'entertainment': 9,
+    'healthcare': 6, 'other': 6, 'travel': 4, 'education': 3,
+}
+DESCRIPTIONS = {
+    'food': ['Corner Grocery', 'Coffee House', 'Pizza Place', 'Farmers Market', 'Sushi Bar'],
+    'transport': ['City Transit', 'Gas Station', 'Ride Share', 'Parking Garage'],
+    'shopping': ['Online Store', 'Department Store', 'Hardware Store', 'Bookshop'],
+    'utilities': ['Power & Light Co', 'Water Utility', 'Internet Provider', 'Mobile Carrier'],
+    'entertainment': ['Cinema Plaza', 'Streaming Service', 'Concert Tickets', 'Arcade'],
+    'healthcare': ['Pharmacy', 'Dental Clinic', 'Family Doctor'],
+    'other': ['Gift', 'Donation', 'Misc'],
+    'travel': ['Airline', 'Hotel', 'Car Rental'],
+    'education': ['Online Course', 'Textbooks', 'Tuition'],
+}
+AMOUNT_RANGES = {
+    'food': (3, 120), 'transport': (2, 90), 'shopping': (5, 400), 'utilities': (30, 250),
+    'entertainment': (5, 150), 'healthcare': (10, 600), 'other': (1, 200), 'travel': (50, 1500),
+    'education': (20, 900),
+}
+BATCH = 20000
+
+
+def user_weights(count, skew):
+    weights = [1 / (rank ** skew) for rank in range(1, count + 1)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+def random_date(rng, today, years):
+    # Exponential lean towards recent dates, capped at `years` of history
+    days = min(int(rng.expovariate(1 / (years * 365 / 3))), years * 365 - 1)
+    return today - timedelta(days=days)
+
+
+def seed(users, expenses, years=5, skew=1.1, seed_value=1):
+    rng = random.Random(seed_value)
+    today = date.today()
+    categories = list(CATEGORY_WEIGHTS)
+    category_weights = list(CATEGORY_WEIGHTS.values())
+
+    user_ids = []
+    for index in range(users):
+        user = User(username=f'loaduser{index}', email=f'loaduser{index}@example.com')
+        user.set_password('loadtest')
+        db.session.add(user)
+        db.session.flush()
+        user_ids.append(user.id)
+    db.session.commit()
+
+    shares = user_weights(users, skew)
+    per_user = [int(expenses * share) for share in shares]
+    per_user[0] += expenses - sum(per_user)
+
+    started = time.perf_counter()
+    for user_id, count in zip(user_ids, per_user):
+        remaining = count
+        while remaining > 0:
+            size = min(BATCH, remaining)
+            rows = []
+            for category in rng.choices(categories, category_weights, k=size):
+                low, high = AMOUNT_RANGES[category]
+                amount_minor = rng.randint(low * 100, high * 100)
+                rows.append({
+                    'user_id': user_id,
+                    'category': category,
+                    'amount_minor': amount_minor,
+                    'currency': 'USD',
+                    'home_amount_minor': amount_minor,
+                    'date': random_date(rng, today, years),
+                    'description': rng.choice(DESCRIPTIONS[category]),
+                })
+            db.session.execute(Expense.__table__.insert(), rows)
+            db.session.commit()
+            remaining -= size
+
+        for _ in range(rng.randint(5, 60)):
+            start = today.replace(day=1) - timedelta(days=rng.randrange(0, years * 365))
+            db.session.add(Budget(
+                user_id=user_id,
+                category=rng.choice(categories),
+                limit_minor=rng.choice([100, 200, 300, 500, 1000]) * 100,
+                start_date=start,
+                end_date=start + timedelta(days=rng.choice([6, 29, 89])),
+            ))
+        for index in range(rng.randint(1, 8)):
+            target = rng.choice([500, 1000, 5000, 20000])
+            db.session.add(Goal(
+                user_id=user_id,
+                name=f'Goal {index + 1}',
+                target_minor=target * 100,
+                current_minor=rng.randint(0, target * 100),
+                due_date=today + timedelta(days=rng.randrange(30, 1000)),
+            ))
+        for index in range(rng.randint(2, 15)):
+            db.session.add(Reminder(
+                user_id=user_id,
+                bill_name=rng.choice(DESCRIPTIONS['utilities']),
+                amount=round(rng.uniform(20, 300), 2),
+                due_date=today + timedelta(days=rng.randrange(-30, 90)),
+            ))
+        db.session.commit()
+
+    rebuild_rollups()
+    reconcile_budgets()
+    return user_ids, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--expenses', type=int, default=100000, help='total expenses across all users')
+    parser.add_argument('--years', type=int, default=5, help='years of history')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for rows per user')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        user_ids, elapsed = seed(args.users, args.expenses, args.years, args.skew, args.seed)
+    print(f'Seeded {len(user_ids)} users and {args.expenses} expenses in {elapsed:.1f}s '
+          f'(heaviest user id: {user_ids[0]})')
+
+
+if __name__ == '__main__':
+    main()
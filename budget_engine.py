@@ -0,0 +1,265 @@
+"""Budget evaluation and running totals.
+
+Every budget has a BudgetTotal row holding its spending so far and its
+limit in the owner's home currency (converted at the rate of the budget's
+start date). Expense writes adjust the totals in the same transaction as
+the write, through apply_budget_deltas(). This covers adds, edits (moving
+an expense between budget windows or categories counts against both
+budgets), deletes, bulk edits, imports and recurring expenses. Checking a
+budget is then a single row lookup, and evaluate_budgets() reads all of a
+user's budgets in one query.
+
+When spending reaches a higher threshold in ALERT_THRESHOLDS, the write
+also adds a Notification. The dashboard shows these unread notifications.
+If spending falls back below a threshold, the budget alerts again the next
+time it reaches it. A new budget starts at whatever its window already
+holds and does not alert for that.
+
+`flask reconcile-budgets` recomputes every total from the expense and
+archive tables and repairs any that drifted. Exchange-rate reconversion
+runs it for the users it touched.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, insert, select, update
+
+from app import db
+from archive import archive_cutoff
+from cache import bump_data_version
+from fx import MissingRate, convert_minor, home_currency as user_home_currency
+from models import ArchivedExpense, Budget, BudgetTotal, Expense, Notification, User
+from money import format_money, from_minor
+
+# Percent of a budget's limit that triggers an alert, lowest first
+ALERT_THRESHOLDS = (80, 100)
+DASHBOARD_NOTIFICATIONS = 5
+
+
+def _window_join(entity):
+    return and_(
+        entity.user_id == Budget.user_id,
+        entity.category == Budget.category,
+        entity.date >= Budget.start_date,
+        entity.date <= Budget.end_date,
+    )
+
+
+def _spent_by_budget(*where):
+    """{budget id: home-currency minor units spent} for the budgets matching `where`, archive included."""
+    spent = dict(db.session.query(Budget.id, db.func.sum(Expense.home_amount_minor)).join(
+        Expense, _window_join(Expense)
+    ).filter(*where).group_by(Budget.id).all())
+
+    cutoff = archive_cutoff()
+    if cutoff is not None:
+        archived = db.session.query(Budget.id, db.func.sum(ArchivedExpense.home_amount_minor)).join(
+            ArchivedExpense, _window_join(ArchivedExpense)
+        ).filter(*where, Budget.start_date < cutoff).group_by(Budget.id)
+        for budget_id, amount_minor in archived:
+            spent[budget_id] = (spent.get(budget_id) or 0) + amount_minor
+    return {budget_id: int(amount_minor or 0) for budget_id, amount_minor in spent.items()}
+
+
+def _home_limit(budget, home_currency):
+    if budget.currency == home_currency:
+        return budget.limit_minor
+    try:
+        return convert_minor(budget.limit_minor, budget.currency, home_currency, budget.start_date)
+    except MissingRate:
+        return budget.limit_minor
+
+
+def alert_level(spent_minor, limit_minor):
+    """The highest threshold in ALERT_THRESHOLDS that spending has reached, or 0."""
+    if limit_minor <= 0:
+        return 0
+    return max((threshold for threshold in ALERT_THRESHOLDS if spent_minor * 100 >= threshold * limit_minor), default=0)
+
+
+def _alert(user_id, budget_id, category, level, spent_minor, limit_minor, currency):
+    spent, limit = format_money(from_minor(spent_minor), currency), format_money(from_minor(limit_minor), currency)
+    if level >= 100:
+        message = f'Your {category} budget is used up: {spent} spent of {limit}.'
+    else:
+        message = f'You have used {level}% of your {category} budget: {spent} spent of {limit}.'
+    return dict(user_id=user_id, budget_id=budget_id, threshold=level, message=message, created_at=datetime.now())
+
+
+def track_budget(budget):
+    """Create the running total of a new budget from the expenses already in its window."""
+    db.session.flush()
+    spent_minor = _spent_by_budget(Budget.id == budget.id).get(budget.id, 0)
+    limit_minor = _home_limit(budget, user_home_currency(budget.user_id))
+    db.session.add(BudgetTotal(
+        budget_id=budget.id,
+        spent_minor=spent_minor,
+        limit_minor=limit_minor,
+        alert_level=alert_level(spent_minor, limit_minor),
+    ))
+
+
+def apply_budget_deltas(user_id, deltas):
+    """Add spending to the budgets it falls into: {(date, category): home_amount_minor}.
+
+    Negative amounts remove spending, so an edit passes the expense's old
+    (date, category) negated and its new one added. Costs one locked read
+    of the affected totals and one executemany UPDATE, plus one INSERT when
+    a threshold is reached, however many expenses changed.
+    """
+    by_category = defaultdict(list)
+    for (day, category), amount_minor in deltas.items():
+        if amount_minor:
+            by_category[category].append((day, amount_minor))
+    if not by_category:
+        return
+
+    days = [day for changes in by_category.values() for day, _ in changes]
+    rows = db.session.execute(
+        select(Budget.id, Budget.category, Budget.start_date, Budget.end_date,
+               BudgetTotal.spent_minor, BudgetTotal.limit_minor, BudgetTotal.alert_level)
+        .join(BudgetTotal, BudgetTotal.budget_id == Budget.id)
+        .where(
+            Budget.user_id == user_id,
+            Budget.category.in_(sorted(by_category)),
+            Budget.start_date <= max(days),
+            Budget.end_date >= min(days),
+        )
+        .order_by(Budget.id)
+        .with_for_update(of=BudgetTotal)
+    ).all()
+
+    updates, alerts = [], []
+    currency = None
+    for row in rows:
+        change = sum(
+            amount_minor for day, amount_minor in by_category[row.category] if row.start_date <= day <= row.end_date
+        )
+        if not change:
+            continue
+        spent_minor = row.spent_minor + change
+        level = alert_level(spent_minor, row.limit_minor)
+        updates.append(dict(total_id=row.id, change=change, level=level))
+        if level > row.alert_level:
+            currency = currency or user_home_currency(user_id)
+            alerts.append(_alert(user_id, row.id, row.category, level, spent_minor, row.limit_minor, currency))
+
+    if updates:
+        total = BudgetTotal.__table__
+        db.session.execute(
+            update(total).where(total.c.budget_id == bindparam('total_id')).values(
+                spent_minor=total.c.spent_minor + bindparam('change'),
+                alert_level=bindparam('level'),
+            ),
+            updates,
+        )
+    if alerts:
+        db.session.execute(insert(Notification), alerts)
+
+
+def expense_spend(expense, sign=1):
+    """The apply_budget_deltas() entry for adding (sign=1) or removing (sign=-1) an expense."""
+    return {(expense.date, expense.category): sign * expense.home_amount_minor}
+
+
+def reconcile_budgets(user_id=None):
+    """Recompute budget totals (for one user or everyone) and repair any that drifted; return how many.
+
+    Budgets without a total get one, without alerting. A repaired total
+    that reaches a higher threshold alerts as an expense write would.
+    """
+    where = [] if user_id is None else [Budget.user_id == user_id]
+    spent = _spent_by_budget(*where)
+    rows = db.session.query(Budget, BudgetTotal, User.home_currency).join(
+        User, User.id == Budget.user_id
+    ).outerjoin(
+        BudgetTotal, BudgetTotal.budget_id == Budget.id
+    ).filter(*where).order_by(Budget.id).all()
+
+    repaired, repaired_users = 0, set()
+    for budget, total, home_currency in rows:
+        spent_minor = spent.get(budget.id, 0)
+        limit_minor = _home_limit(budget, home_currency)
+        level = alert_level(spent_minor, limit_minor)
+        if total is None:
+            db.session.add(BudgetTotal(budget_id=budget.id, spent_minor=spent_minor, limit_minor=limit_minor,
+                                       alert_level=level))
+        elif (total.spent_minor, total.limit_minor, total.alert_level) != (spent_minor, limit_minor, level):
+            if level > total.alert_level:
+                db.session.add(Notification(**_alert(budget.user_id, budget.id, budget.category, level,
+                                                     spent_minor, limit_minor, home_currency)))
+            total.spent_minor, total.limit_minor, total.alert_level = spent_minor, limit_minor, level
+        else:
+            continue
+        repaired += 1
+        repaired_users.add(budget.user_id)
+
+    # Budget responses are cached per data version
+    for repaired_user_id in repaired_users:
+        bump_data_version(repaired_user_id)
+    db.session.commit()
+    return repaired
+
+
+def evaluate_budgets(user_id):
+    """Return a list of budget status dicts, newest budget first."""
+    rows = db.session.query(Budget, BudgetTotal).outerjoin(
+        BudgetTotal, BudgetTotal.budget_id == Budget.id
+    ).filter(
+        Budget.user_id == user_id
+    ).order_by(Budget.start_date.desc(), Budget.id.desc()).all()
+
+    # Budgets written outside the app (until `flask reconcile-budgets` runs) are summed on the fly
+    untracked = [budget.id for budget, total in rows if total is None]
+    if untracked:
+        spent = _spent_by_budget(Budget.id.in_(untracked))
+        home_currency = user_home_currency(user_id)
+
+    budgets_data = []
+    for budget, total in rows:
+        if total is not None:
+            spent_minor, limit_minor = total.spent_minor, total.limit_minor
+        else:
+            spent_minor, limit_minor = spent.get(budget.id, 0), _home_limit(budget, home_currency)
+        spent_amount = from_minor(spent_minor)
+        limit_amount = from_minor(limit_minor)
+        budgets_data.append({
+            'budget': budget,
+            'limit': limit_amount,
+            'spent': spent_amount,
+            'remaining': limit_amount - spent_amount,
+            'progress_percent': min(100, (spent_amount / limit_amount) * 100) if limit_amount > 0 else 0
+        })
+    return budgets_data
+
+
+def unread_notifications(user_id, limit=DASHBOARD_NOTIFICATIONS):
+    """The user's newest unread notifications."""
+    return Notification.query.filter_by(user_id=user_id, read_at=None).order_by(
+        Notification.id.desc()
+    ).limit(limit).all()
+
+
+def dismiss_notifications(user_id, notification_id=None):
+    """Mark one of the user's notifications read, or all of them when no id is given."""
+    query = update(Notification).where(Notification.user_id == user_id, Notification.read_at.is_(None))
+    if notification_id is not None:
+        query = query.where(Notification.id == notification_id)
+    db.session.execute(query.values(read_at=datetime.now()), execution_options={'synchronize_session': False})
+    db.session.commit()
+
+
+def budget_status_to_dict(status):
+    """JSON-serialisable form of one evaluate_budgets() entry."""
+    budget = status['budget']
+    return {
+        'id': budget.id,
+        'category': budget.category,
+        'limit_amount': budget.limit_amount,
+        'currency': budget.currency,
+        'start_date': budget.start_date.isoformat(),
+        'end_date': budget.end_date.isoformat(),
+        'spent': round(status['spent'], 2),
+        'remaining': round(status['remaining'], 2),
+        'progress_percent': round(status['progress_percent'], 2),
+    }
@@ -0,0 +1,152 @@
+"""Versioned per-user response cache.
+
+Each user row carries a data_version that every write route bumps in the
+same transaction as the write. Cache keys embed that version, so a write
+makes all of the user's previous entries unreachable at once and stale
+data is never served; old entries simply age out of the LRU.
+
+The default backend is a bounded in-process LRU with a TTL. Setting
+CACHE_BACKEND=redis shares entries between gunicorn workers (requires the
+optional `redis` package).
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from app import db
+from models import User
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry time to live."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisCache:
+    """Shared backend storing pickled values in Redis with a TTL."""
+
+    def __init__(self, url, ttl=300, prefix='finance:'):
+        import redis  # optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        # gthread workers serve requests on several threads; += on an int is not atomic
+        self.counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        value = self.backend.get(key)
+        if value is not None:
+            with self.counter_lock:
+                self.hits += 1
+            return value
+        with self.counter_lock:
+            self.misses += 1
+        value = compute()
+        self.backend.set(key, value)
+        return value
+
+    def metrics_lines(self):
+        with self.counter_lock:
+            hits, misses = self.hits, self.misses
+        return [
+            '# HELP app_cache_hits_total Response cache hits.',
+            '# TYPE app_cache_hits_total counter',
+            f'app_cache_hits_total {hits}',
+            '# HELP app_cache_misses_total Response cache misses.',
+            '# TYPE app_cache_misses_total counter',
+            f'app_cache_misses_total {misses}',
+        ]
+
+
+def init_cache(app):
+    app.config.setdefault('CACHE_BACKEND', 'memory')
+    app.config.setdefault('CACHE_TTL', 300)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+
+    if app.config['CACHE_BACKEND'] == 'redis':
+        backend = RedisCache(app.config['CACHE_REDIS_URL'], ttl=app.config['CACHE_TTL'])
+    else:
+        backend = LRUCache(max_entries=app.config['CACHE_MAX_ENTRIES'], ttl=app.config['CACHE_TTL'])
+
+    app.extensions['response_cache'] = ResponseCache(backend)
+    return app.extensions['response_cache']
+
+
+def get_data_version(user_id):
+    return db.session.execute(select(User.data_version).where(User.id == user_id)).scalar() or 0
+
+
+def bump_data_version(user_id):
+    """Invalidate every cached entry of a user; call inside the write's transaction."""
+    db.session.execute(
+        update(User).where(User.id == user_id).values(data_version=User.data_version + 1),
+        execution_options={'synchronize_session': False},
+    )
+
+
+def cached_for_user(name, user_id, compute):
+    """Return compute() for this user, reusing it until their data changes.
+
+    The version is read before computing so a write that lands mid-compute
+    can only ever cause a newer result to be stored under an older key.
+    """
+    version = get_data_version(user_id)
+    cache = current_app.extensions['response_cache']
+    return cache.get_or_compute(f'{name}:{user_id}:{version}', compute)
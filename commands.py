@@ -0,0 +1,218 @@
+import time
+
+import click
+
+
+def _user_shards(user_id):
+    """each_shard(), or just the user's shard when a user id is given."""
+    from shards import each_shard, select_user_shard, use_shard
+    if user_id is None:
+        yield from each_shard()
+        return
+    if not select_user_shard(user_id):
+        raise click.ClickException(f'User {user_id} is not in the shard directory.')
+    try:
+        yield
+    finally:
+        use_shard(None)
+
+
+def _reconvert_each_shard(since=None, currencies=None):
+    from fx import reconvert_expenses
+    from shards import each_shard
+    updated = missing = 0
+    for _ in each_shard():
+        shard_updated, shard_missing = reconvert_expenses(since=since, currencies=currencies)
+        updated += shard_updated
+        missing += shard_missing
+    return updated, missing
+
+
+def register_commands(app):
+    """Register maintenance CLI commands (run with `flask <command>`)."""
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild this user\'s rollups.')
+    def rebuild_rollups_command(user_id):
+        """Backfill/rebuild the monthly spending rollups from raw expenses."""
+        from rollups import rebuild_rollups
+        for _ in _user_shards(user_id):
+            rebuild_rollups(user_id)
+        click.echo('Rollups rebuilt.')
+
+    @app.cli.command('reconcile-budgets')
+    @click.option('--user-id', type=int, default=None, help='Only reconcile this user\'s budgets.')
+    def reconcile_budgets_command(user_id):
+        """Recompute budget running totals from raw expenses and repair any drift."""
+        from budget_engine import reconcile_budgets
+        repaired = sum(reconcile_budgets(user_id) for _ in _user_shards(user_id))
+        click.echo(f'Repaired {repaired} budget totals.')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Re-index all expense descriptions for full-text search."""
+        from search import rebuild_search_index
+        from shards import each_shard
+        for _ in each_shard():
+            rebuild_search_index()
+        click.echo('Search index rebuilt.')
+
+    @app.cli.command('run-recurring')
+    @click.option('--date', 'run_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Materialize as of this date (default: today).')
+    def run_recurring_command(run_date):
+        """Create due recurring expenses and advance recurring reminders."""
+        from datetime import date
+        from recurring import advance_reminders, materialize_recurring_expenses
+        from shards import each_shard
+        today = run_date.date() if run_date else date.today()
+        created = advanced = 0
+        for _ in each_shard():
+            created += materialize_recurring_expenses(today)
+            advanced += advance_reminders(today)
+        click.echo(f'Created {created} expenses; advanced {advanced} reminders.')
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables and the search index (production boots skip this)."""
+        from startup import init_database
+        init_database(app)
+        click.echo('Database initialized.')
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Alter tables created by older versions to match the models (see migrations.py)."""
+        from migrations import upgrade_database
+        for url, applied in upgrade_database().items():
+            click.echo(f'{url}: {", ".join(applied) if applied else "up to date"}')
+
+    @app.cli.command('startup-profile')
+    @click.option('--runs', type=int, default=3, show_default=True, help='Cold boots to time; the fastest is shown.')
+    def startup_profile_command(runs):
+        """Time a cold boot of the app, per phase, in fresh interpreters."""
+        from startup import cold_start_profile
+        profiles = [cold_start_profile() for _ in range(max(runs, 1))]
+        best = min(profiles, key=lambda profile: profile['total'])
+        for name, seconds in best['phases']:
+            click.echo(f'{name:<20} {seconds * 1000:>9.1f} ms')
+        click.echo(f'{"total":<20} {best["total"] * 1000:>9.1f} ms')
+        if best['heavy_modules']:
+            click.echo(f'Deferred modules imported at boot: {", ".join(best["heavy_modules"])}')
+
+    @app.cli.command('load-rates')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--reconvert/--no-reconvert', default=True, show_default=True,
+                  help='Recompute home amounts of expenses on or after the earliest loaded date.')
+    def load_rates_command(path, reconvert):
+        """Load daily exchange rates from a CSV with date,currency,rate columns."""
+        from fx import load_rates, parse_rates_csv
+        with open(path, newline='', encoding='utf-8-sig') as stream:
+            try:
+                loaded, earliest = load_rates(parse_rates_csv(stream))
+            except ValueError as exc:
+                raise click.ClickException(str(exc))
+        click.echo(f'Loaded {loaded} rates.')
+        if reconvert and earliest:
+            # Let every worker's rate cache see the load first, so nothing converted with the old rates is missed
+            time.sleep(app.config['FX_RATES_CHECK_SECONDS'])
+            updated, missing = _reconvert_each_shard(since=min(earliest.values()))
+            click.echo(f'Reconverted {updated} expenses; {missing} still lack a rate.')
+
+    @app.cli.command('reconvert-expenses')
+    @click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Only expenses on or after this date.')
+    @click.option('--currency', 'currencies', multiple=True, help='Only expenses in this currency (repeatable).')
+    def reconvert_expenses_command(since, currencies):
+        """Recompute stored home-currency amounts after rates were corrected."""
+        updated, missing = _reconvert_each_shard(
+            since=since.date() if since else None,
+            currencies=[code.upper() for code in currencies],
+        )
+        click.echo(f'Reconverted {updated} expenses; {missing} still lack a rate.')
+
+    @app.cli.command('archive-expenses')
+    @click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Archive expenses dated before this (default: ARCHIVE_HORIZON_DAYS ago).')
+    @click.option('--batch-size', type=int, default=None, help='Expenses moved per transaction.')
+    def archive_expenses_command(before, batch_size):
+        """Move old expenses to the archive table; safe to interrupt and re-run."""
+        from archive import ARCHIVE_BATCH_SIZE, archive_expenses, default_cutoff
+        cutoff = before.date() if before else default_cutoff()
+        moved = archive_expenses(cutoff, batch_size=batch_size or ARCHIVE_BATCH_SIZE)
+        click.echo(f'Archived {moved} expenses dated before {cutoff.isoformat()}.')
+
+    @app.cli.command('warm-templates')
+    def warm_templates_command():
+        """Compile all templates into the Jinja bytecode cache."""
+        from templating import warm_templates
+        count = warm_templates(app)
+        click.echo(f'Compiled {count} templates.')
+
+    @app.cli.command('run-jobs')
+    @click.option('--workers', type=int, default=None, help='Report processes (default: JOBS_WORKERS).')
+    @click.option('--until-idle', is_flag=True, help='Exit once the queue is empty instead of polling forever.')
+    def run_jobs_command(workers, until_idle):
+        """Run queued report jobs (statements, exports) in a process pool."""
+        import signal
+        import threading
+        from jobs import run_jobs
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            count = run_jobs(workers=workers, until_idle=until_idle, stop=stop)
+        except KeyboardInterrupt:
+            return
+        click.echo(f'Ran {count} jobs.')
+
+    @app.cli.command('prune-changes')
+    @click.option('--days', type=int, default=None, help='Keep this many days of changes (default: SYNC_RETENTION_DAYS).')
+    def prune_changes_command(days):
+        """Delete old sync change log entries; clients behind them resync from scratch."""
+        from datetime import date, datetime, timedelta
+        from shards import each_shard
+        from sync import prune_changes
+        days = app.config['SYNC_RETENTION_DAYS'] if days is None else days
+        before = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+        pruned = sum(prune_changes(before) for _ in each_shard())
+        click.echo(f'Pruned {pruned} change log entries older than {before.date().isoformat()}.')
+
+    @app.cli.command('move-user')
+    @click.argument('user_id', type=int)
+    @click.argument('shard')
+    def move_user_command(user_id, shard):
+        """Move a user's data to another shard (e.g. shard_2) while the app keeps serving."""
+        from shards import move_users
+        try:
+            moved = move_users([(user_id, shard)])[user_id]
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+        if moved is None:
+            raise click.ClickException(f'User {user_id} was not moved; see the log for why.')
+        click.echo(f'Moved {moved} rows of user {user_id} to {shard}.')
+
+    @app.cli.command('rebalance-shards')
+    @click.option('--exclude', multiple=True, help='Drain this shard (repeatable), e.g. before retiring it.')
+    @click.option('--limit', type=int, default=None, help='Move at most this many users.')
+    @click.option('--batch-size', type=int, default=100, show_default=True, help='Users marked moving at once.')
+    @click.option('--dry-run', is_flag=True, help='Only list the users that would move.')
+    def rebalance_shards_command(exclude, limit, batch_size, dry_run):
+        """Move users whose shard differs from the hash ring's choice (after adding or draining a shard)."""
+        from shards import misplaced_users, move_users
+        try:
+            misplaced = misplaced_users(exclude=exclude)[:limit]
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+        if dry_run:
+            for user_id, current, target in misplaced:
+                click.echo(f'{user_id}: {current} -> {target}')
+            click.echo(f'{len(misplaced)} users would move.')
+            return
+        moved = failed = 0
+        for start in range(0, len(misplaced), batch_size):
+            batch = misplaced[start:start + batch_size]
+            results = move_users([(user_id, target) for user_id, _, target in batch])
+            failed += sum(1 for rows in results.values() if rows is None)
+            moved += sum(1 for rows in results.values() if rows is not None)
+        click.echo(f'Moved {moved} users.')
+        if failed:
+            raise click.ClickException(f'{failed} users were not moved; see the log for why.')
@@ -0,0 +1,125 @@
+"""Named SQLAlchemy engine profiles per database backend.
+
+DB_PROFILE picks how engines are built:
+
+- "auto" (default): "sqlite-wal" for SQLite URLs, "postgres-pool" for
+  PostgreSQL, "legacy" for anything else.
+- "legacy": the old fixed options (pool_recycle=300, pool_pre_ping=True).
+- "sqlite-wal": WAL journal, synchronous=NORMAL, a busy timeout, a larger
+  page cache and mmap I/O, applied as PRAGMAs on every new connection so
+  concurrent gunicorn workers queue on the write lock instead of failing
+  with "database is locked".
+- "postgres-pool": a connection pool sized to the threads of one worker
+  process, a server-side statement_timeout, and pre-ping that can be
+  switched off (DB_PRE_PING=0) behind a pooler that already health-checks
+  connections.
+
+The same profile is applied to the primary and every replica bind.
+"""
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+PROFILES = ('legacy', 'sqlite-wal', 'postgres-pool')
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def resolve_profile(url, name=None):
+    """Concrete profile name for a database URL; `name` defaults to DB_PROFILE."""
+    name = (name or os.environ.get('DB_PROFILE') or 'auto').lower()
+    if name != 'auto':
+        if name not in PROFILES:
+            raise ValueError(f'Unknown DB_PROFILE {name!r}; expected auto or one of {", ".join(PROFILES)}')
+        return name
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return 'sqlite-wal'
+    if backend == 'postgresql':
+        return 'postgres-pool'
+    return 'legacy'
+
+
+def engine_options(url, name=None):
+    """SQLAlchemy create_engine() keyword arguments for a URL under a profile."""
+    profile = resolve_profile(url, name)
+    if profile == 'sqlite-wal':
+        # Pre-ping is pointless for a local file
+        return {
+            'pool_recycle': 300,
+            'pool_pre_ping': False,
+            'connect_args': {'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000},
+        }
+    if profile == 'postgres-pool':
+        # One pool per worker process: enough connections for its threads
+        # plus a streaming export, with the same again as burst overflow
+        threads = _env_int('GUNICORN_THREADS', 1)
+        pool_size = _env_int('DB_POOL_SIZE', threads + 2)
+        statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 30000)
+        options = {
+            'pool_size': pool_size,
+            'max_overflow': _env_int('DB_MAX_OVERFLOW', pool_size),
+            'pool_timeout': _env_int('DB_POOL_TIMEOUT', 10),
+            'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+            'pool_pre_ping': _env_flag('DB_PRE_PING', True),
+            'connect_args': {},
+        }
+        if statement_timeout:
+            options['connect_args']['options'] = f'-c statement_timeout={statement_timeout}'
+        return options
+    return {'pool_recycle': 300, 'pool_pre_ping': True, 'connect_args': {}}
+
+
+def sqlite_pragmas(url, name=None):
+    """PRAGMAs to run on each new connection (empty outside the sqlite-wal profile)."""
+    if resolve_profile(url, name) != 'sqlite-wal':
+        return {}
+    pragmas = {
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'synchronous': 'NORMAL',
+        # Negative cache_size is in KiB
+        'cache_size': -_env_int('SQLITE_CACHE_SIZE_KIB', 64000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'temp_store': 'MEMORY',
+    }
+    if make_url(url).database not in (None, '', ':memory:'):
+        pragmas = {'journal_mode': 'WAL', **pragmas}
+    return pragmas
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run `pragmas` on every new DBAPI connection of `engine`."""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def init_engine_profiles(app, engines):
+    """Attach connect-time PRAGMAs to SQLite engines; call before first use."""
+    name = app.config.get('DB_PROFILE')
+    for key, engine in engines.items():
+        url = engine.url.render_as_string(hide_password=False)
+        apply_sqlite_pragmas(engine, sqlite_pragmas(url, name))
+        logger.info('Engine %s uses the %s profile', key or 'primary', resolve_profile(url, name))
@@ -0,0 +1,187 @@
+"""Primary/replica session routing.
+
+DATABASE_REPLICA_URLS (comma separated) adds one SQLAlchemy bind per read
+replica, named replica_0, replica_1, ... Statements still go to the
+primary unless the current request opted in with @replica_reads (GET and
+HEAD only) or route_reads_to_replica(); each of those requests picks one
+replica round-robin, skipping any replica whose periodic SELECT 1 health
+check failed, and reads everything from it (g.db_replica), so the counts
+and lists on a page never come from replicas that lag by different
+amounts.
+
+Anything that writes -- a flush, or an INSERT/UPDATE/DELETE executed
+through the session -- sends the rest of the request to the primary. After
+such a request commits, the user's Flask session is pinned to the primary
+for REPLICA_PIN_SECONDS so the next pages read their own writes despite
+replication lag.
+
+To try it locally, point DATABASE_REPLICA_URLS at the same SQLite file as
+DATABASE_URL (or a copy of it), or at a second local Postgres instance
+streaming from the first.
+
+DATABASE_SHARD_URLS likewise adds binds named shard_0, shard_1, ... When
+they are configured, statements on per-user tables go to the shard that
+the session has selected. See shards.py.
+"""
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica_'
+SHARD_PREFIX = 'shard_'
+_PIN_KEY = '_primary_until'
+
+
+def _numbered_binds(prefix, urls):
+    return {
+        f'{prefix}{index}': url.strip()
+        for index, url in enumerate(part for part in (urls or '').split(',') if part.strip())
+    }
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URLs."""
+    return _numbered_binds(REPLICA_PREFIX, urls)
+
+
+def shard_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of shard URLs."""
+    return _numbered_binds(SHARD_PREFIX, urls)
+
+
+class ReplicaHealth:
+    """Round-robin replica picker with a cached SELECT 1 health check per replica."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.checked = {}  # bind key -> (healthy, checked_at)
+        self.routed = 0
+        self.fallbacks = 0
+
+    def is_healthy(self, key, engine, interval):
+        now = time.monotonic()
+        with self.lock:
+            healthy, checked_at = self.checked.get(key, (True, None))
+        if checked_at is not None and now - checked_at < interval:
+            return healthy
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            healthy = True
+        except Exception:
+            logger.warning('Read replica %s failed its health check', key, exc_info=True)
+            healthy = False
+        with self.lock:
+            self.checked[key] = (healthy, now)
+        return healthy
+
+    def pick(self, engines, interval):
+        keys = sorted(key for key in engines if isinstance(key, str) and key.startswith(REPLICA_PREFIX))
+        if not keys:
+            return None
+        start = next(self.counter)
+        for offset in range(len(keys)):
+            key = keys[(start + offset) % len(keys)]
+            if self.is_healthy(key, engines[key], interval):
+                self.routed += 1
+                return engines[key]
+        self.fallbacks += 1
+        return None
+
+    def metrics_lines(self):
+        return [
+            '# HELP app_replica_reads_total Requests whose reads were routed to a read replica.',
+            '# TYPE app_replica_reads_total counter',
+            f'app_replica_reads_total {self.routed}',
+            '# HELP app_replica_fallbacks_total Replica reads sent to the primary because no replica was healthy.',
+            '# TYPE app_replica_fallbacks_total counter',
+            f'app_replica_fallbacks_total {self.fallbacks}',
+        ]
+
+
+def _primary_pinned():
+    return flask_session.get(_PIN_KEY, 0) > time.time()
+
+
+def _wants_replica():
+    if not has_request_context() or not g.get('db_use_replica') or g.get('db_wrote'):
+        return False
+    return not _primary_pinned()
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends per-user tables to their shard and opted-in reads to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        router = current_app.extensions.get('shard_router') if bind is None else None
+        if router is not None:
+            shard = router.engine_for(self, mapper, clause)
+            if shard is not None:
+                return shard
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._flushing or not _wants_replica():
+            return engine
+        engines = self._db.engines
+        if engine is not engines.get(None):
+            return engine  # models with their own bind_key are left alone
+        health = current_app.extensions.get('replica_health')
+        if health is None:
+            return engine
+        if 'db_replica' not in g:
+            # None (no healthy replica) keeps the whole request on the primary
+            g.db_replica = health.pick(engines, current_app.config['REPLICA_HEALTH_INTERVAL'])
+        return g.db_replica if g.db_replica is not None else engine
+
+
+def _mark_write():
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _detect_write_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _detect_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        _mark_write()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_after_write(session):
+    if has_request_context() and g.get('db_wrote'):
+        flask_session[_PIN_KEY] = time.time() + current_app.config['REPLICA_PIN_SECONDS']
+
+
+def route_reads_to_replica():
+    """Let the rest of this request read from a replica (safe methods only)."""
+    if request.method in ('GET', 'HEAD'):
+        g.db_use_replica = True
+
+
+def replica_reads(view):
+    """View decorator: serve the view's reads from a replica when possible."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        route_reads_to_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_replicas(app):
+    app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+    app.config.setdefault('REPLICA_HEALTH_INTERVAL', 10)
+    app.extensions['replica_health'] = ReplicaHealth()
+    return app.extensions['replica_health']
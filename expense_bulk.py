@@ -0,0 +1,167 @@
+"""Set-based bulk edits of a user's expenses.
+
+Expenses are selected by id list or by the /expenses filter conditions and
+changed with a single UPDATE or DELETE whose WHERE clause always begins with
+the owner's user_id, so ids belonging to someone else simply match nothing.
+Rollup and budget deltas come from one grouped read of the same selection
+taken just before the write; the write is capped at the highest id that
+read saw, so an expense inserted in between is neither changed nor
+miscounted. Rollups, budget totals, the user's data version and the sync
+change log (from the ids the write returns) are updated in the same
+transaction.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import bindparam, delete, select, update
+
+from app import db
+from budget_engine import apply_budget_deltas
+from cache import bump_data_version
+from fx import convert_minor
+from models import Expense
+from rollups import apply_rollup_deltas
+from sync import DELETE, record_changes
+
+MAX_SHIFT_DAYS = 3650
+
+_SYNC = {'synchronize_session': False}
+
+
+def selection_conditions(user_id, ids=None, conditions=()):
+    """WHERE clauses selecting a user's expenses by id list and/or filter conditions."""
+    where = [Expense.user_id == user_id]
+    if ids is not None:
+        where.append(Expense.id.in_(sorted(set(ids))))
+    where.extend(conditions)
+    return where
+
+
+def _snapshot(where):
+    """Return ({(date, category): [home_amount_minor, count]}, highest id) for the selection."""
+    rows = db.session.execute(
+        select(
+            Expense.date,
+            Expense.category,
+            db.func.sum(Expense.home_amount_minor),
+            db.func.count(Expense.id),
+            db.func.max(Expense.id),
+        ).where(*where).group_by(Expense.date, Expense.category)
+    ).all()
+    groups = {(day, category): [int(total or 0), count] for day, category, total, count, _ in rows}
+    return groups, max((max_id for *_, max_id in rows), default=None)
+
+
+def _add(deltas, day, category, amount_minor, count):
+    bucket = deltas[(day, category)]
+    bucket[0] += amount_minor
+    bucket[1] += count
+
+
+def _finish(user_id, deltas):
+    monthly = defaultdict(lambda: [0, 0])
+    for (day, category), (amount_minor, count) in deltas.items():
+        bucket = monthly[(day.year, day.month, category)]
+        bucket[0] += amount_minor
+        bucket[1] += count
+    apply_rollup_deltas(user_id, {key: value for key, value in monthly.items() if value != [0, 0]})
+    apply_budget_deltas(user_id, {key: amount_minor for key, (amount_minor, _) in deltas.items()})
+    bump_data_version(user_id)
+    db.session.commit()
+
+
+def bulk_delete(user_id, where):
+    """Delete the selected expenses; return the number deleted."""
+    groups, max_id = _snapshot(where)
+    if max_id is None:
+        return 0
+
+    ids = db.session.execute(
+        delete(Expense).where(*where, Expense.id <= max_id).returning(Expense.id), execution_options=_SYNC
+    ).scalars().all()
+    record_changes(user_id, 'expense', ids, DELETE)
+    deltas = defaultdict(lambda: [0, 0])
+    for (day, category), (total, count) in groups.items():
+        _add(deltas, day, category, -total, -count)
+    _finish(user_id, deltas)
+    return len(ids)
+
+
+def bulk_recategorize(user_id, where, category):
+    """Move the selected expenses to `category`; return the number changed."""
+    where = [*where, Expense.category != category]
+    groups, max_id = _snapshot(where)
+    if max_id is None:
+        return 0
+
+    ids = db.session.execute(
+        update(Expense).where(*where, Expense.id <= max_id).values(category=category).returning(Expense.id),
+        execution_options=_SYNC,
+    ).scalars().all()
+    record_changes(user_id, 'expense', ids)
+    deltas = defaultdict(lambda: [0, 0])
+    for (day, old_category), (total, count) in groups.items():
+        _add(deltas, day, old_category, -total, -count)
+        _add(deltas, day, category, total, count)
+    _finish(user_id, deltas)
+    return len(ids)
+
+
+def _shifted_date(days):
+    if db.session.get_bind(Expense).dialect.name == 'sqlite':
+        return db.func.date(Expense.date, f'{days:+d} days')
+    # PostgreSQL: date + integer is a date
+    return Expense.date + days
+
+
+def bulk_shift_dates(user_id, where, days, home_currency):
+    """Move the selected expenses `days` days; return the number changed.
+
+    Foreign-currency expenses are reconverted at the rate of their new
+    date. Raises MissingRate, before anything is written, if a rate is
+    missing.
+    """
+    if days == 0:
+        return 0
+    groups, max_id = _snapshot(where)
+    if max_id is None:
+        return 0
+    where = [*where, Expense.id <= max_id]
+    offset = timedelta(days=days)
+
+    foreign = db.session.execute(
+        select(Expense.id, Expense.date, Expense.category, Expense.amount_minor, Expense.currency,
+               Expense.home_amount_minor)
+        .where(*where, Expense.currency != home_currency)
+    ).all()
+    reconverted = [
+        (row, convert_minor(row.amount_minor, row.currency, home_currency, row.date + offset))
+        for row in foreign
+    ]
+
+    ids = db.session.execute(
+        update(Expense).where(*where).values(date=_shifted_date(days)).returning(Expense.id),
+        execution_options=_SYNC,
+    ).scalars().all()
+    record_changes(user_id, 'expense', ids)
+    changes = [
+        {'expense_id': row.id, 'home_minor': home_minor}
+        for row, home_minor in reconverted if home_minor != row.home_amount_minor
+    ]
+    if changes:
+        expense = Expense.__table__
+        db.session.execute(
+            update(expense).where(
+                expense.c.user_id == user_id, expense.c.id == bindparam('expense_id')
+            ).values(home_amount_minor=bindparam('home_minor')),
+            changes,
+        )
+
+    deltas = defaultdict(lambda: [0, 0])
+    for (day, category), (total, count) in groups.items():
+        _add(deltas, day, category, -total, -count)
+        _add(deltas, day + offset, category, total, count)
+    for row, home_minor in reconverted:
+        _add(deltas, row.date + offset, row.category, home_minor - row.home_amount_minor, 0)
+    _finish(user_id, deltas)
+    return len(ids)
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+from app import db
+from archive import reaches_archive, with_archive
+from models import ArchivedExpense, Expense
+from money import to_minor
+from search import description_search_condition
+
+FILTER_FIELDS = ('category', 'date_from', 'date_to', 'min_amount', 'max_amount', 'search')
+
+
+def expense_filter_conditions(user_id, args, entity=Expense):
+    """Translate the /expenses filter query args into SQL conditions.
+
+    Returns (conditions, values): the WHERE clauses to apply on top of the
+    filter on `user_id`, and the successfully parsed values keyed by the matching
+    ExpenseFilterForm field name. Unparseable values are ignored. Amount
+    bounds apply to the home-currency amount. Pass entity=ArchivedExpense
+    for conditions on the archive table.
+    """
+    conditions = []
+    values = {}
+
+    category = args.get('category', '')
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    min_amount = args.get('min_amount', '')
+    max_amount = args.get('max_amount', '')
+    search = args.get('search', '')
+
+    if category:
+        conditions.append(entity.category == category)
+        values['category'] = category
+
+    if date_from:
+        try:
+            date_from_parsed = datetime.strptime(date_from, '%Y-%m-%d').date()
+            conditions.append(entity.date >= date_from_parsed)
+            values['date_from'] = date_from_parsed
+        except ValueError:
+            pass
+
+    if date_to:
+        try:
+            date_to_parsed = datetime.strptime(date_to, '%Y-%m-%d').date()
+            conditions.append(entity.date <= date_to_parsed)
+            values['date_to'] = date_to_parsed
+        except ValueError:
+            pass
+
+    if min_amount:
+        try:
+            min_val = float(min_amount)
+            conditions.append(entity.home_amount_minor >= to_minor(min_val))
+            values['min_amount'] = min_val
+        except ValueError:
+            pass
+
+    if max_amount:
+        try:
+            max_val = float(max_amount)
+            conditions.append(entity.home_amount_minor <= to_minor(max_val))
+            values['max_amount'] = max_val
+        except ValueError:
+            pass
+
+    if search:
+        conditions.append(description_search_condition(search, user_id, entity))
+        values['search'] = search
+
+    return conditions, values
+
+
+def archived_filter_conditions(user_id, args, values):
+    """Archive-side conditions for the same args, or None when the range stays in the hot table."""
+    if not reaches_archive(values.get('date_from')):
+        return None
+    return expense_filter_conditions(user_id, args, ArchivedExpense)[0]
+
+
+def filtered_expenses(user_id, args):
+    """Return (entity, query, values) for the user's expenses matching the filter args.
+
+    The archive is only read when the filtered date range reaches before
+    the archive cutoff; sort and paginate on the returned entity's columns.
+    """
+    conditions, values = expense_filter_conditions(user_id, args)
+    archived = archived_filter_conditions(user_id, args, values)
+    if archived is None:
+        return Expense, Expense.query.filter(Expense.user_id == user_id, *conditions), values
+    entity = with_archive(
+        [Expense.user_id == user_id, *conditions],
+        [ArchivedExpense.user_id == user_id, *archived],
+    )
+    return entity, db.session.query(entity), values
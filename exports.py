@@ -0,0 +1,85 @@
+"""Streaming CSV export of a user's expenses.
+
+Rows are pulled from a server-side cursor in chunks of EXPORT_CHUNK_SIZE and
+encoded as they arrive, so memory use stays flat regardless of how many
+expenses the export covers.
+"""
+import csv
+import io
+import zlib
+
+from sqlalchemy import func, select, union_all
+
+from app import db
+from models import ArchivedExpense, Expense
+from money import from_minor
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_HEADER = ['Date', 'Category', 'Amount', 'Currency', 'Home Amount', 'Description']
+
+
+def _export_select(entity, user_id, conditions):
+    return select(
+        entity.date, entity.category, entity.amount_minor, entity.currency,
+        entity.home_amount_minor, entity.description
+    ).where(entity.user_id == user_id, *conditions)
+
+
+def export_rows(user_id, conditions=(), archived_conditions=None):
+    """Stream (date, category, amount_minor, currency, home_amount_minor, description) tuples, newest first.
+
+    Archived expenses are included when `archived_conditions` is given.
+    """
+    stmt = _export_select(Expense, user_id, conditions)
+    if archived_conditions is None:
+        stmt = stmt.order_by(Expense.date.desc())
+    else:
+        union = union_all(stmt, _export_select(ArchivedExpense, user_id, archived_conditions)).subquery()
+        stmt = select(union).order_by(union.c.date.desc())
+    return db.session.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+
+
+def export_count(user_id, conditions=(), archived_conditions=None):
+    """Number of rows export_rows() yields for the same arguments."""
+    total = db.session.execute(
+        select(func.count()).select_from(Expense).where(Expense.user_id == user_id, *conditions)
+    ).scalar()
+    if archived_conditions is not None:
+        total += db.session.execute(
+            select(func.count()).select_from(ArchivedExpense).where(ArchivedExpense.user_id == user_id, *archived_conditions)
+        ).scalar()
+    return total
+
+
+def iter_csv(rows, compress=False):
+    """Yield encoded CSV chunks (optionally gzip-compressed) for export rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # wbits=31 selects the gzip container format
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(EXPORT_HEADER)
+    for index, (expense_date, category, amount_minor, currency, home_amount_minor, description) in enumerate(rows, 1):
+        writer.writerow([
+            expense_date.strftime('%Y-%m-%d'),
+            category.capitalize(),
+            f'{from_minor(amount_minor):.2f}',
+            currency,
+            f'{from_minor(home_amount_minor):.2f}',
+            description or ''
+        ])
+        if index % EXPORT_CHUNK_SIZE == 0:
+            chunk = drain()
+            if chunk:
+                yield chunk
+
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    yield chunk
@@ -0,0 +1,256 @@
+"""Spending forecasts and anomaly detection over columnar expense history.
+
+A user's expenses are loaded once as parallel NumPy arrays (epoch days,
+amounts, category codes) and every statistic is computed with array
+operations: monthly totals via bincount, rolling averages via cumulative
+sums, per-category medians/MADs via one lexsort, and least-squares trends
+for all categories in a single polyfit call. Nothing iterates over rows in
+Python, so a million-row history is dominated by the database fetch.
+"""
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func, literal, select, union_all
+
+from app import db
+from archive import reaches_archive
+from models import ArchivedExpense, Expense
+from money import MINOR_PER_UNIT
+
+ROLLING_WINDOWS = (3, 6, 12)
+TREND_MONTHS = 12
+MIN_TREND_MONTHS = 3
+# Modified z-score cut-off recommended by Iglewicz & Hoaglin
+ANOMALY_THRESHOLD = 3.5
+MIN_CATEGORY_SAMPLES = 10
+ANOMALY_LOOKBACK_DAYS = 90
+MAX_ANOMALIES = 20
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class ExpenseHistory:
+    """A user's expenses as parallel arrays; `codes` index into `categories`.
+
+    Amounts are in the user's home currency.
+    """
+
+    def __init__(self, ids, days, amounts, codes, categories):
+        self.ids = ids
+        self.days = days
+        self.amounts = amounts
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @property
+    def months(self):
+        """Month index (months since 1970-01) of every expense."""
+        return self.days.astype('datetime64[M]').astype(np.int64)
+
+
+def _epoch_days(column):
+    # Let the database turn dates into day numbers so no date objects are
+    # built per row; other backends fall back to parsing in Python.
+    dialect = db.session.get_bind(Expense).dialect.name
+    if dialect == 'sqlite':
+        return func.julianday(column) - 2440587.5
+    if dialect == 'postgresql':
+        return column - literal(date(1970, 1, 1))
+    return None
+
+
+def _history_select(entity, user_id):
+    day_expr = _epoch_days(entity.date)
+    return select(
+        entity.id, entity.date if day_expr is None else day_expr, entity.home_amount_minor, entity.category
+    ).where(entity.user_id == user_id)
+
+
+def load_history(user_id):
+    """Load all of a user's expenses, archived ones included."""
+    day_expr = _epoch_days(Expense.date)
+    stmt = _history_select(Expense, user_id)
+    if reaches_archive(None):
+        stmt = union_all(stmt, _history_select(ArchivedExpense, user_id))
+    rows = db.session.execute(stmt).all()
+    if not rows:
+        return ExpenseHistory(np.empty(0, np.int64), np.empty(0, 'datetime64[D]'),
+                              np.empty(0, np.float64), np.empty(0, np.intp), [])
+
+    count = len(rows)
+    ids, days, amounts, categories = zip(*rows)
+    if day_expr is None:
+        days = np.array(days, dtype='datetime64[D]')
+    else:
+        days = EPOCH + np.rint(np.fromiter(days, np.float64, count)).astype(np.int64)
+    names, codes = np.unique(np.array(categories), return_inverse=True)
+    return ExpenseHistory(
+        np.fromiter(ids, np.int64, count),
+        days,
+        np.fromiter(amounts, np.float64, count) / MINOR_PER_UNIT,
+        codes,
+        names.tolist(),
+    )
+
+
+def monthly_matrix(history, first_month, last_month):
+    """Spend per category (rows) and month (columns) for an inclusive month range."""
+    span = last_month - first_month + 1
+    months = history.months
+    mask = (months >= first_month) & (months <= last_month)
+    flat = history.codes[mask] * span + (months[mask] - first_month)
+    totals = np.bincount(flat, weights=history.amounts[mask], minlength=len(history.categories) * span)
+    return totals.reshape(len(history.categories), span)
+
+
+def rolling_average(matrix, window):
+    """Trailing mean over `window` columns, shortened where history is shorter."""
+    columns = matrix.shape[1]
+    cumulative = np.concatenate([np.zeros((matrix.shape[0], 1)), np.cumsum(matrix, axis=1)], axis=1)
+    end = np.arange(1, columns + 1)
+    start = np.maximum(end - window, 0)
+    return (cumulative[:, end] - cumulative[:, start]) / (end - start)
+
+
+def _group_medians(values, codes, group_count):
+    """Median of `values` within each code; NaN for empty groups."""
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    counts = np.bincount(codes, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+    present = counts > 0
+    low = np.where(present, starts + (counts - 1) // 2, 0)
+    high = np.where(present, starts + counts // 2, 0)
+    return np.where(present, (ordered[low] + ordered[high]) / 2, np.nan)
+
+
+def detect_anomalies(history, since, threshold=ANOMALY_THRESHOLD, limit=MAX_ANOMALIES):
+    """Flag expenses since a date that are unusually large for their category.
+
+    Uses the modified z-score 0.6745 * (x - median) / MAD per category, with
+    the mean absolute deviation standing in where the MAD is zero. The plain
+    z-score is reported alongside for reference.
+    """
+    group_count = len(history.categories)
+    if not len(history):
+        return []
+    amounts, codes = history.amounts, history.codes
+
+    counts = np.bincount(codes, minlength=group_count)
+    medians = _group_medians(amounts, codes, group_count)
+    deviation = np.abs(amounts - medians[codes])
+    mad = _group_medians(deviation, codes, group_count)
+    mean_deviation = np.bincount(codes, weights=deviation, minlength=group_count) / np.maximum(counts, 1)
+    scale = np.where(mad > 0, mad / 0.6745, mean_deviation * 1.253314)
+
+    means = np.bincount(codes, weights=amounts, minlength=group_count) / np.maximum(counts, 1)
+    variance = np.bincount(codes, weights=(amounts - means[codes]) ** 2, minlength=group_count) / np.maximum(counts, 1)
+    std = np.sqrt(variance)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = (amounts - medians[codes]) / scale[codes]
+        zscores = (amounts - means[codes]) / std[codes]
+    flagged = np.flatnonzero(
+        (history.days >= np.datetime64(since, 'D'))
+        & (counts[codes] >= MIN_CATEGORY_SAMPLES)
+        & np.isfinite(scores)
+        & (scores > threshold)
+    )
+    flagged = flagged[np.argsort(-scores[flagged], kind='stable')[:limit]]
+
+    return [{
+        'id': int(history.ids[index]),
+        'date': str(history.days[index]),
+        'category': history.categories[codes[index]],
+        'amount': round(float(amounts[index]), 2),
+        'category_median': round(float(medians[codes[index]]), 2),
+        'score': round(float(scores[index]), 2),
+        'zscore': round(float(zscores[index]), 2) if np.isfinite(zscores[index]) else None,
+    } for index in flagged]
+
+
+def _projections(matrix, today):
+    """Month-end projection per category for the last column of `matrix`.
+
+    The current month's spend so far is extended by a baseline monthly
+    estimate for the days left: a seasonal estimate (trailing 12-month
+    average scaled by the category's index for this calendar month) once a
+    year of history exists, else a linear trend over recent months, else
+    the month's own run rate.
+    """
+    to_date = matrix[:, -1]
+    complete = matrix[:, :-1]
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    remaining = (days_in_month - today.day) / days_in_month
+    run_rate = to_date * days_in_month / today.day
+    months_available = complete.shape[1]
+
+    if months_available >= 12:
+        same_month = complete[:, months_available - 12::-12]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = same_month.mean(axis=1) / complete.mean(axis=1)
+        index = np.where(np.isfinite(index), index, 1.0)
+        baseline = complete[:, -12:].mean(axis=1) * index
+        method = 'seasonal'
+    elif months_available >= MIN_TREND_MONTHS:
+        recent = complete[:, -TREND_MONTHS:]
+        slope, intercept = np.polyfit(np.arange(recent.shape[1]), recent.T, 1)
+        baseline = np.maximum(intercept + slope * recent.shape[1], 0)
+        method = 'trend'
+    else:
+        return run_rate, 'run_rate'
+    return to_date + baseline * remaining, method
+
+
+def build_forecast(history, today=None):
+    """Forecast and anomaly summary for a loaded history, as plain JSON-able values."""
+    today = today or date.today()
+    current_month = (today.year - 1970) * 12 + today.month - 1
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    summary = {
+        'as_of': today.isoformat(),
+        'days_elapsed': today.day,
+        'days_in_month': days_in_month,
+        'expense_count': len(history),
+        'method': None,
+        'total': {'to_date': 0.0, 'projected': 0.0, 'rolling': {str(w): 0.0 for w in ROLLING_WINDOWS}},
+        'categories': [],
+        'anomalies': [],
+    }
+    if not len(history):
+        return summary
+
+    first_month = min(int(history.months.min()), current_month)
+    matrix = monthly_matrix(history, first_month, current_month)
+    projected, method = _projections(matrix, today)
+
+    complete = matrix[:, :-1]
+    rolling = {}
+    for window in ROLLING_WINDOWS:
+        if complete.shape[1]:
+            rolling[str(window)] = rolling_average(complete, window)[:, -1]
+        else:
+            rolling[str(window)] = np.zeros(matrix.shape[0])
+
+    order = np.argsort(-projected, kind='stable')
+    summary['method'] = method
+    summary['total'] = {
+        'to_date': round(float(matrix[:, -1].sum()), 2),
+        'projected': round(float(projected.sum()), 2),
+        'rolling': {window: round(float(values.sum()), 2) for window, values in rolling.items()},
+    }
+    summary['categories'] = [{
+        'category': history.categories[code],
+        'to_date': round(float(matrix[code, -1]), 2),
+        'projected': round(float(projected[code]), 2),
+        'rolling': {window: round(float(values[code]), 2) for window, values in rolling.items()},
+    } for code in order if projected[code] > 0 or any(values[code] > 0 for values in rolling.values())]
+    summary['anomalies'] = detect_anomalies(history, today - timedelta(days=ANOMALY_LOOKBACK_DAYS))
+    return summary
+
+
+def user_forecast(user_id, today=None):
+    return build_forecast(load_history(user_id), today)
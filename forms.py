@@ -1,7 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, FloatField, DateField, SelectField, TextAreaField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange
-from models import User
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, SubmitField, FloatField, DateField, SelectField, TextAreaField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange, Optional, StopValidation
+from shards import find_user
+from recurrence import FREQUENCY_CHOICES
+from money import CURRENCY_CHOICES
 
 
 class LoginForm(FlaskForm):
@@ -18,12 +21,12 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
     
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
+        user = find_user(username=username.data)
         if user:
             raise ValidationError('Username already taken. Please choose a different one.')
     
     def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
+        user = find_user(email=email.data)
         if user:
             raise ValidationError('Email already registered. Please use a different email.')
 
@@ -44,12 +47,59 @@ EXPENSE_CATEGORIES = [
 
 class ExpenseForm(FlaskForm):
     amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01, message='Amount must be greater than 0')])
+    currency = SelectField('Currency', choices=CURRENCY_CHOICES, validators=[DataRequired()])
     category = SelectField('Category', choices=EXPENSE_CATEGORIES[1:], validators=[DataRequired()])
     date = DateField('Date', validators=[DataRequired()])
     description = TextAreaField('Description (Optional)', validators=[Length(max=255)])
     submit = SubmitField('Save Expense')
 
 
+BULK_ACTIONS = [
+    ('recategorize', 'Change category'),
+    ('shift', 'Shift date'),
+    ('delete', 'Delete'),
+]
+
+
+def _required_for_action(action, message):
+    """Field validator: the field must be filled in when the form's action is `action`.
+
+    Goes before Optional(), which would otherwise end validation of an
+    empty field before any other check runs.
+    """
+    def check(form, field):
+        if form.action.data == action and not (field.raw_data and field.raw_data[0].strip()):
+            field.errors[:] = []
+            raise StopValidation(message)
+    return check
+
+
+class BulkExpenseForm(FlaskForm):
+    action = SelectField('Action', choices=BULK_ACTIONS, validators=[DataRequired()])
+    scope = SelectField('Apply To', choices=[('selected', 'Selected expenses'), ('filter', 'All matching expenses')], default='selected')
+    # Only used by "recategorize"; validate_new_category checks it then
+    new_category = SelectField('New Category', choices=EXPENSE_CATEGORIES[1:], validate_choice=False)
+    days = IntegerField('Shift By (Days)', validators=[
+        _required_for_action('shift', 'Enter a non-zero number of days to shift by.'),
+        Optional(), NumberRange(min=-3650, max=3650),
+    ])
+    submit = SubmitField('Apply')
+
+    def validate_new_category(self, new_category):
+        if self.action.data == 'recategorize' and new_category.data not in dict(EXPENSE_CATEGORIES[1:]):
+            raise ValidationError('Choose the category to move the expenses to.')
+
+    def validate_days(self, days):
+        if self.action.data == 'shift' and not days.data:
+            raise ValidationError('Enter a non-zero number of days to shift by.')
+
+
+class ImportForm(FlaskForm):
+    file = FileField('CSV or OFX File', validators=[FileRequired(), FileAllowed(['csv', 'ofx', 'qfx'], 'Upload a .csv, .ofx or .qfx file.')])
+    skip_duplicates = BooleanField('Skip expenses that already exist', default=True)
+    submit = SubmitField('Import')
+
+
 class ExpenseFilterForm(FlaskForm):
     category = SelectField('Category', choices=EXPENSE_CATEGORIES)
     date_from = DateField('From Date', validators=[])
@@ -62,7 +112,7 @@ class ExpenseFilterForm(FlaskForm):
 
 class BudgetForm(FlaskForm):
     category = SelectField('Category', choices=EXPENSE_CATEGORIES[1:], validators=[DataRequired()])
-    limit_amount = FloatField('Limit Amount ($)', validators=[DataRequired(), NumberRange(min=0.01, message='Limit must be greater than 0')])
+    limit_amount = FloatField('Limit Amount', validators=[DataRequired(), NumberRange(min=0.01, message='Limit must be greater than 0')])
     start_date = DateField('Start Date', format='%Y-%m-%d', validators=[DataRequired()])
     end_date = DateField('End Date', format='%Y-%m-%d', validators=[DataRequired()])
     submit = SubmitField('Set Budget')
@@ -79,12 +129,59 @@ class ReminderForm(FlaskForm):
     bill_name = StringField('Bill Name', validators=[DataRequired(), Length(min=1, max=100)])
     due_date = DateField('Due Date', validators=[DataRequired()])
     amount = FloatField('Amount ($)', validators=[DataRequired(), NumberRange(min=0.01, message='Amount must be greater than 0')])
+    frequency = SelectField('Repeats', choices=[('', 'One time')] + FREQUENCY_CHOICES)
+    repeat_interval = IntegerField('Every', default=1, validators=[DataRequired(), NumberRange(min=1, max=365)])
+    end_date = DateField('Ends On (Optional)', validators=[Optional()])
     submit = SubmitField('Save Reminder')
 
+    def validate_end_date(self, end_date):
+        if self.due_date.data and end_date.data and end_date.data < self.due_date.data:
+            raise ValidationError('End date must be after the due date.')
+
+
+class RecurringExpenseForm(FlaskForm):
+    amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01, message='Amount must be greater than 0')])
+    currency = SelectField('Currency', choices=CURRENCY_CHOICES, validators=[DataRequired()])
+    category = SelectField('Category', choices=EXPENSE_CATEGORIES[1:], validators=[DataRequired()])
+    description = StringField('Description (Optional)', validators=[Length(max=255)])
+    frequency = SelectField('Repeats', choices=FREQUENCY_CHOICES, validators=[DataRequired()])
+    repeat_interval = IntegerField('Every', default=1, validators=[DataRequired(), NumberRange(min=1, max=365)])
+    start_date = DateField('First Date', validators=[DataRequired()])
+    end_date = DateField('Ends On (Optional)', validators=[Optional()])
+    submit = SubmitField('Save Recurring Expense')
+
+    def validate_end_date(self, end_date):
+        if self.start_date.data and end_date.data and end_date.data < self.start_date.data:
+            raise ValidationError('End date must be after the first date.')
+
 
 class GoalForm(FlaskForm):
     name = StringField('Goal Name', validators=[DataRequired(), Length(min=1, max=100)])
-    target_amount = FloatField('Target Amount ($)', validators=[DataRequired(), NumberRange(min=0.01, message='Amount must be greater than 0')])
-    current_amount = FloatField('Current Amount ($)', validators=[DataRequired(), NumberRange(min=0)])
+    target_amount = FloatField('Target Amount', validators=[DataRequired(), NumberRange(min=0.01, message='Amount must be greater than 0')])
+    current_amount = FloatField('Current Amount', validators=[DataRequired(), NumberRange(min=0)])
+    currency = SelectField('Currency', choices=CURRENCY_CHOICES, validators=[DataRequired()])
     due_date = DateField('Target Date', validators=[DataRequired()])
     submit = SubmitField('Save Goal')
+
+
+class StatementForm(FlaskForm):
+    # Choices (recent months as YYYY-MM) are filled in by the view
+    month = SelectField('Month', validators=[DataRequired()])
+    format = SelectField('Format', choices=[('html', 'Printable page (HTML)'), ('csv', 'Spreadsheet (CSV)')], default='html')
+    submit = SubmitField('Generate Statement')
+
+
+class ExportJobForm(FlaskForm):
+    gzip = BooleanField('Compress (gzip)')
+    submit = SubmitField('Export in Background')
+
+
+class DismissNotificationForm(FlaskForm):
+    # Empty: dismiss all of the user's unread notifications
+    notification_id = IntegerField(validators=[Optional()])
+    submit = SubmitField('Dismiss')
+
+
+class LogoutEverywhereForm(FlaskForm):
+    # Only carries the CSRF token
+    submit = SubmitField('Log out everywhere')
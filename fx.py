@@ -0,0 +1,249 @@
+"""Exchange rates and home-currency conversion.
+
+Daily rates live in the exchange_rate table, quoted as units of a currency
+per one unit of FX_BASE_CURRENCY; converting between any two currencies
+goes through that base. Rates are loaded from CSV files with
+`flask load-rates` and looked up through a per-process cache that holds
+every currency's rates as date-sorted arrays, so a lookup is a bisect
+rather than a query. The latest rate on or before an expense's date is
+used, which covers weekends and holidays.
+
+Every stored rate carries the time it was loaded. Each process's cache
+reads the newest loaded_at (one index lookup) at most once every
+FX_RATES_CHECK_SECONDS and reloads when it moved, so a load reaches every
+gunicorn worker within that interval; `flask load-rates` waits out the
+interval before it reconverts, so expenses written with the old rates in
+the meantime are reconverted too.
+
+Expenses store their home-currency amount at write time. When rates are
+corrected, `flask reconvert-expenses` recomputes the stored amounts and
+rebuilds the affected users' rollups and budget totals. Archived expenses
+keep the amounts they were archived with.
+"""
+import csv
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+from app import db
+from models import Expense, ExchangeRate, User
+from money import CURRENCY_CODES
+
+RATE_LOAD_BATCH_SIZE = 5000
+RECONVERT_BATCH_SIZE = 5000
+
+
+class MissingRate(LookupError):
+    def __init__(self, currency, day):
+        super().__init__(f'No {currency} exchange rate on or before {day.isoformat()}.')
+        self.currency = currency
+        self.day = day
+
+
+class RateCache:
+    """Every stored rate, as {currency: (sorted date ordinals, rates)}."""
+
+    def __init__(self, base_currency, check_seconds=1):
+        self.base_currency = base_currency
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.series = None
+        self.version = None
+        self.checked_at = 0.0
+
+    def _load(self):
+        series = defaultdict(lambda: ([], []))
+        rows = db.session.execute(
+            select(ExchangeRate.currency, ExchangeRate.date, ExchangeRate.rate)
+            .order_by(ExchangeRate.currency, ExchangeRate.date)
+        )
+        for currency, day, rate in rows:
+            ordinals, rates = series[currency]
+            ordinals.append(day.toordinal())
+            rates.append(Decimal(rate))
+        return dict(series)
+
+    def _current_series(self):
+        with self.lock:
+            if self.series is None or time.monotonic() - self.checked_at >= self.check_seconds:
+                version = db.session.execute(select(func.max(ExchangeRate.loaded_at))).scalar()
+                if self.series is None or version != self.version:
+                    self.series = self._load()
+                    self.version = version
+                self.checked_at = time.monotonic()
+            return self.series
+
+    def invalidate(self):
+        with self.lock:
+            self.series = None
+
+    def rate(self, currency, day):
+        """Units of `currency` per base unit in effect on `day`."""
+        if currency == self.base_currency:
+            return Decimal(1)
+        ordinals, rates = self._current_series().get(currency, ((), ()))
+        index = bisect_right(ordinals, day.toordinal()) - 1
+        if index < 0:
+            raise MissingRate(currency, day)
+        return rates[index]
+
+
+def init_fx(app):
+    app.config.setdefault('FX_BASE_CURRENCY', 'USD')
+    app.config.setdefault('FX_RATES_CHECK_SECONDS', 1)
+    app.extensions['fx_rates'] = RateCache(app.config['FX_BASE_CURRENCY'],
+                                           check_seconds=app.config['FX_RATES_CHECK_SECONDS'])
+    return app.extensions['fx_rates']
+
+
+def rate_cache():
+    return current_app.extensions['fx_rates']
+
+
+def convert_minor(amount_minor, from_currency, to_currency, day):
+    """Convert integer minor units between currencies at the rate of `day`.
+
+    Raises MissingRate when either currency has no rate on or before `day`.
+    """
+    if from_currency == to_currency:
+        return amount_minor
+    rates = rate_cache()
+    factor = rates.rate(to_currency, day) / rates.rate(from_currency, day)
+    return int((Decimal(amount_minor) * factor).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+
+
+def home_currency(user_id):
+    return db.session.execute(select(User.home_currency).where(User.id == user_id)).scalar()
+
+
+def parse_rates_csv(text_stream):
+    """Yield (line, currency, date, rate) from a CSV with date,currency,rate columns.
+
+    Raises ValueError naming the first bad line.
+    """
+    reader = csv.DictReader(text_stream)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = {'date', 'currency', 'rate'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f'Rate file is missing column(s): {", ".join(sorted(missing))}')
+    for row in reader:
+        currency = (row['currency'] or '').strip().upper()
+        if currency not in CURRENCY_CODES:
+            raise ValueError(f'Line {reader.line_num}: unknown currency "{currency}".')
+        try:
+            day = date.fromisoformat((row['date'] or '').strip())
+            rate = Decimal((row['rate'] or '').strip())
+        except (ValueError, InvalidOperation):
+            raise ValueError(f'Line {reader.line_num}: invalid date or rate.')
+        if not (rate.is_finite() and rate > 0):
+            raise ValueError(f'Line {reader.line_num}: rate must be positive.')
+        yield reader.line_num, currency, day, rate
+
+
+def load_rates(rows, batch_size=RATE_LOAD_BATCH_SIZE):
+    """Upsert (line, currency, date, rate) rows in batches; return (count, earliest date per currency).
+
+    Existing rates for the same currency and date are replaced. The
+    earliest dates tell the caller which expenses may need reconverting.
+    """
+    loaded = 0
+    earliest = {}
+    batch = {}
+
+    def flush():
+        by_currency = defaultdict(set)
+        for currency, day in batch:
+            by_currency[currency].add(day)
+        for currency, days in by_currency.items():
+            db.session.execute(delete(ExchangeRate).where(
+                ExchangeRate.currency == currency, ExchangeRate.date.in_(days),
+            ))
+        db.session.execute(insert(ExchangeRate), [
+            {'currency': currency, 'date': day, 'rate': rate} for (currency, day), rate in batch.items()
+        ])
+        db.session.commit()
+
+    for _, currency, day, rate in rows:
+        batch[(currency, day)] = rate
+        earliest[currency] = min(day, earliest.get(currency, day))
+        if len(batch) >= batch_size:
+            loaded += len(batch)
+            flush()
+            batch = {}
+    if batch:
+        loaded += len(batch)
+        flush()
+
+    rate_cache().invalidate()
+    return loaded, earliest
+
+
+def reconvert_expenses(since=None, currencies=None, batch_size=RECONVERT_BATCH_SIZE):
+    """Recompute home_amount_minor for foreign-currency expenses; return (updated, missing).
+
+    Walks the expense table by primary key in batches, writes only rows
+    whose amount changed, then rebuilds rollups (which also invalidates
+    the response cache) and reconciles budget totals for every user that
+    had a change. Rows still
+    lacking a rate are left as they are and counted in `missing`.
+    """
+    from budget_engine import reconcile_budgets
+    from rollups import rebuild_rollups
+    from sync import record_changes
+
+    conditions = [Expense.currency != User.home_currency]
+    if since is not None:
+        conditions.append(Expense.date >= since)
+    if currencies:
+        conditions.append(Expense.currency.in_(currencies))
+
+    expense = Expense.__table__
+    set_home_amount = update(expense).where(expense.c.id == bindparam('expense_id')).values(
+        home_amount_minor=bindparam('home_minor')
+    )
+    updated = missing = 0
+    changed_users = set()
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Expense.id, Expense.user_id, Expense.date, Expense.amount_minor, Expense.currency,
+                   Expense.home_amount_minor, User.home_currency)
+            .join(User, User.id == Expense.user_id)
+            .where(Expense.id > last_id, *conditions)
+            .order_by(Expense.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        changes = []
+        changed_ids = defaultdict(list)
+        for row in rows:
+            try:
+                home_minor = convert_minor(row.amount_minor, row.currency, row.home_currency, row.date)
+            except MissingRate:
+                missing += 1
+                continue
+            if home_minor != row.home_amount_minor:
+                changes.append({'expense_id': row.id, 'home_minor': home_minor})
+                changed_ids[row.user_id].append(row.id)
+        if changes:
+            db.session.execute(set_home_amount, changes)
+            updated += len(changes)
+            for user_id, ids in changed_ids.items():
+                record_changes(user_id, 'expense', ids)
+            changed_users.update(changed_ids)
+        db.session.commit()
+
+    for user_id in sorted(changed_users):
+        rebuild_rollups(user_id)
+        reconcile_budgets(user_id)
+    return updated, missing
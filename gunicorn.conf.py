@@ -0,0 +1,122 @@
+"""Gunicorn settings for production: `gunicorn -c gunicorn.conf.py app:app`.
+
+Every setting is read from the environment so one file serves all deploys:
+
+- GUNICORN_WORKER_CLASS: "gthread" (default), "sync" or "gevent". gthread
+  lets a slow request (a large CSV export) occupy one thread instead of a
+  whole worker. gevent needs the `gevent` package (and `psycogreen` for
+  PostgreSQL) and is never preloaded, since it must patch the standard
+  library before the app is imported.
+- GUNICORN_WORKERS: processes; defaults to one per CPU for gthread/gevent
+  and 2 x CPUs + 1 for sync.
+- GUNICORN_THREADS: threads per gthread worker (default 4). db_profiles.py
+  sizes the PostgreSQL pool from the same variable.
+- GUNICORN_PRELOAD: import the app once in the master and fork it
+  (default on). Engines are disposed after fork so workers never share
+  the master's sockets.
+- GUNICORN_MAX_REQUESTS / GUNICORN_MAX_REQUESTS_JITTER: recycle workers
+  after roughly this many requests, staggered so they do not all restart
+  at once.
+- GUNICORN_INIT_DB: upgrade old tables, then create missing tables and
+  the search index in the master before serving, for deploys that start
+  gunicorn without start.sh (which runs `flask upgrade-db` and
+  `flask init-db` itself).
+- GUNICORN_RUN_JOBS: start `flask run-jobs` next to the web workers so
+  statements and large exports run in their own process pool (default on).
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Set before the app is preloaded: app.py reads APP_ENV at import and
+# db_profiles.py sizes the pool per worker from GUNICORN_THREADS
+os.environ.setdefault('APP_ENV', 'production')
+
+cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = _env_int('GUNICORN_WORKERS', 2 * cpus + 1 if worker_class == 'sync' else cpus)
+threads = _env_int('GUNICORN_THREADS', 4) if worker_class == 'gthread' else 1
+os.environ['GUNICORN_THREADS'] = str(threads)
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 1000)
+preload_app = _env_flag('GUNICORN_PRELOAD', True) and worker_class != 'gevent'
+
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10)
+# Long enough for a streamed export of a large history
+timeout = _env_int('GUNICORN_TIMEOUT', 120)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def on_starting(server):
+    if _env_flag('GUNICORN_INIT_DB', False):
+        from app import app
+        from migrations import upgrade_database
+        from startup import init_database
+        with app.app_context():
+            upgrade_database()
+        init_database(app)
+        server.log.info('Database initialized')
+
+
+_job_runner = None
+
+
+def when_ready(server):
+    global _job_runner
+    if _env_flag('GUNICORN_RUN_JOBS', True):
+        _job_runner = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run-jobs'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        server.log.info('Started the report job runner (pid %s)', _job_runner.pid)
+    if preload_app:
+        # Templates compiled here are inherited by every forked worker
+        from app import app
+        from templating import warm_templates
+        with app.app_context():
+            server.log.info('Compiled %d templates before forking', warm_templates(app))
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Connections opened in the master must not be shared across processes
+        from app import app, db
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    from app import app
+    from startup import warm_up
+    warm_up(app, connections=threads)
+    worker.log.info('Worker %s warmed up', worker.pid)
+
+
+def on_exit(server):
+    if _job_runner is not None:
+        # The runner finishes the jobs it has started before exiting
+        _job_runner.terminate()
+        try:
+            _job_runner.wait(timeout=graceful_timeout)
+        except subprocess.TimeoutExpired:
+            _job_runner.kill()
@@ -0,0 +1,179 @@
+"""Cached Flask-Login user loader.
+
+Every authenticated request used to load the full User row before the
+route ran. The loader now returns a CachedUser -- id, username, email
+and home currency, which is all the routes and templates read from
+current_user -- out of a bounded TTL'd LRU (or Redis when
+CACHE_BACKEND=redis, so every worker sees the same entries), and only
+loads the row on a miss.
+
+The session stores the user id together with the user's session_version
+("42:3"), and the cached entry carries the version it was loaded at; a
+session whose version does not match is checked against the row once and
+refused when it is out of date. Logging out only ends the current session.
+end_sessions() bumps the version, which also ends the user's other
+sessions, copies of the cookie and remember-me cookies ("log out
+everywhere").
+
+Entries are dropped when a User row is updated or deleted through the ORM
+or with an ORM-enabled delete(User), both at flush and again after commit
+so a concurrent miss cannot re-cache the old row, and by end_sessions().
+The process that made the change refuses the session on its next request.
+With the per-process backend other workers notice when their entry
+expires, which is why its TTL is kept short; with CACHE_BACKEND=redis they
+share the invalidated entry and notice at once.
+"""
+import threading
+
+from flask import current_app, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import object_session
+
+from app import db, login_manager
+from cache import LRUCache, RedisCache
+from models import User
+from shards import select_user_shard
+
+_PENDING_KEY = 'identity_cache_invalidate'
+
+
+class CachedUser(UserMixin):
+    """Detached, picklable stand-in for User as seen through current_user."""
+
+    def __init__(self, id, username, email, home_currency, session_version):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.home_currency = home_currency
+        self.session_version = session_version
+
+    def get_id(self):
+        return f'{self.id}:{self.session_version}'
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class IdentityCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, user_id, session_version):
+        key = str(user_id)
+        user = self.backend.get(key)
+        if user is not None and user.session_version == session_version:
+            with self.counter_lock:
+                self.hits += 1
+            return user
+        # A miss, or a version mismatch: the session or the entry is out of date
+        with self.counter_lock:
+            self.misses += 1
+        row = db.session.execute(
+            select(User.id, User.username, User.email, User.home_currency, User.session_version)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        user = CachedUser(row.id, row.username, row.email, row.home_currency, row.session_version)
+        self.backend.set(key, user)
+        return user if user.session_version == session_version else None
+
+    def invalidate(self, user_id):
+        self.backend.delete(str(user_id))
+
+    def metrics_lines(self):
+        with self.counter_lock:
+            hits, misses = self.hits, self.misses
+        return [
+            '# HELP app_identity_cache_hits_total User loader cache hits.',
+            '# TYPE app_identity_cache_hits_total counter',
+            f'app_identity_cache_hits_total {hits}',
+            '# HELP app_identity_cache_misses_total User loader cache misses.',
+            '# TYPE app_identity_cache_misses_total counter',
+            f'app_identity_cache_misses_total {misses}',
+        ]
+
+
+def init_identity_cache(app):
+    app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+    app.config.setdefault('IDENTITY_CACHE_MAX_ENTRIES', 4096)
+
+    ttl = app.config['IDENTITY_CACHE_TTL']
+    if app.config.get('CACHE_BACKEND') == 'redis':
+        backend = RedisCache(app.config['CACHE_REDIS_URL'], ttl=ttl, prefix='finance:user:')
+    else:
+        backend = LRUCache(max_entries=app.config['IDENTITY_CACHE_MAX_ENTRIES'], ttl=ttl)
+
+    app.extensions['identity_cache'] = IdentityCache(backend)
+    login_manager.user_loader(load_user)
+    return app.extensions['identity_cache']
+
+
+def load_user(session_id):
+    # Sessions from before session_version was added carry the bare id
+    user_id, _, session_version = str(session_id).partition(':')
+    try:
+        user_id, session_version = int(user_id), int(session_version or 0)
+    except ValueError:
+        return None
+    # Routes the rest of the request to the user's shard (no-op without sharding)
+    if not select_user_shard(user_id):
+        return None
+    return current_app.extensions['identity_cache'].load(user_id, session_version)
+
+
+def end_sessions(user_id):
+    """Log the user out everywhere: every session and remember-me cookie stops working; commits."""
+    db.session.execute(
+        update(User).where(User.id == user_id).values(session_version=User.session_version + 1),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    current_app.extensions['identity_cache'].invalidate(user_id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    cache = current_app.extensions.get('identity_cache') if has_app_context() else None
+    if cache is None:
+        return
+    cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_KEY, set()).add(target.id)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _user_bulk_deleted(orm_execute_state):
+    # delete(User) skips the mapper events above; drop the entries of the rows it matches
+    if not orm_execute_state.is_delete or orm_execute_state.bind_mapper is not User.__mapper__:
+        return
+    cache = current_app.extensions.get('identity_cache') if has_app_context() else None
+    if cache is None:
+        return
+    matching = select(User.id)
+    if orm_execute_state.statement.whereclause is not None:
+        matching = matching.where(orm_execute_state.statement.whereclause)
+    user_ids = set(orm_execute_state.session.execute(matching).scalars())
+    for user_id in user_ids:
+        cache.invalidate(user_id)
+    orm_execute_state.session.info.setdefault(_PENDING_KEY, set()).update(user_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed(session):
+    user_ids = session.info.pop(_PENDING_KEY, None)
+    cache = current_app.extensions.get('identity_cache') if has_app_context() else None
+    if user_ids and cache is not None:
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
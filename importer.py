@@ -0,0 +1,279 @@
+"""Bulk import of expenses from CSV or OFX uploads.
+
+Uploads are parsed as a stream and validated in chunks against the same
+rules as ExpenseForm. Each valid chunk is written with a single executemany
+INSERT and committed, so an import of N rows costs N / IMPORT_BATCH_SIZE
+transactions no matter how large the file is. An optional Currency column
+selects each row's currency (default: the user's home currency); rows are
+converted to the home currency with the cached exchange rates.
+
+On SQLite a chunk goes straight to the driver's executemany, without
+RETURNING or the per-row search trigger. One writer's rows are numbered
+consecutively, so last_insert_rowid() gives the id range, and the search
+index and sync change log are filled from that range with one INSERT ...
+SELECT each. Duplicate detection loads the stored rows of each date once
+per import rather than once per chunk.
+"""
+import csv
+import re
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import select, text, union_all
+
+from app import db
+from archive import reaches_archive
+from budget_engine import apply_budget_deltas
+from cache import bump_data_version
+from forms import EXPENSE_CATEGORIES
+from fx import MissingRate, convert_minor, home_currency as user_home_currency
+from models import ArchivedExpense, Expense
+from money import CURRENCY_CODES, to_minor
+from rollups import apply_rollup_deltas
+from search import deferred_indexing
+from sync import record_changes
+
+IMPORT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 500
+
+CATEGORY_LOOKUP = {}
+for _value, _label in EXPENSE_CATEGORIES[1:]:
+    CATEGORY_LOOKUP[_value] = _value
+    CATEGORY_LOOKUP[_label.lower()] = _value
+
+DATE_FORMATS = ('%m/%d/%Y', '%d.%m.%Y', '%Y%m%d')
+
+_OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.IGNORECASE | re.DOTALL)
+_OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def parse_csv(text_stream):
+    """Yield (line number, raw row dict) from a CSV with a header row.
+
+    Headers are matched case-insensitively, so files produced by the CSV
+    export (Date, Category, Amount, Description) import unchanged.
+    """
+    reader = csv.DictReader(text_stream)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        yield reader.line_num, {
+            'date': row.get('date'),
+            'category': row.get('category'),
+            'amount': row.get('amount') or '',
+            'currency': row.get('currency'),
+            'description': row.get('description'),
+        }
+
+
+def parse_ofx(text_stream, chunk_size=64 * 1024):
+    """Yield (transaction number, raw row dict) for the debits in an OFX/QFX file.
+
+    OFX carries no category, so imported transactions are filed as "other".
+    Credits (positive amounts) are yielded with amount None so the caller
+    can count them as skipped.
+    """
+    buffer = ''
+    number = 0
+    while True:
+        chunk = text_stream.read(chunk_size)
+        buffer += chunk
+        last_end = 0
+        for match in _OFX_TRANSACTION.finditer(buffer):
+            last_end = match.end()
+            number += 1
+            fields = {name.upper(): value.strip() for name, value in _OFX_FIELD.findall(match.group(1))}
+            amount = fields.get('TRNAMT', '')
+            name, memo = fields.get('NAME', ''), fields.get('MEMO', '')
+            description = f'{name} - {memo}' if name and memo and memo != name else (name or memo)
+            yield number, {
+                'date': fields.get('DTPOSTED', '')[:8],
+                'category': 'other',
+                'amount': None if amount and not amount.startswith('-') else amount.lstrip('-'),
+                'description': description,
+            }
+        buffer = buffer[last_end:]
+        if not chunk:
+            break
+
+
+def validate_row(raw):
+    """Apply the ExpenseForm rules to a raw row; return (values, error)."""
+    raw_date = (raw.get('date') or '').strip()
+    parsed_date = _parse_date(raw_date)
+    if parsed_date is None:
+        return None, f'Invalid date "{raw_date}".'
+
+    raw_amount = (raw.get('amount') or '').strip().replace('$', '').replace(',', '')
+    try:
+        amount_minor = to_minor(raw_amount)
+    except ValueError:
+        return None, f'Invalid amount "{raw_amount}".'
+    if amount_minor < 1:
+        return None, 'Amount must be greater than 0'
+
+    currency = (raw.get('currency') or '').strip().upper() or None
+    if currency is not None and currency not in CURRENCY_CODES:
+        return None, f'Unknown currency "{currency}".'
+
+    raw_category = (raw.get('category') or '').strip().lower()
+    category = CATEGORY_LOOKUP.get(raw_category)
+    if category is None:
+        return None, f'Unknown category "{raw_category}".'
+
+    description = (raw.get('description') or '').strip()
+    if len(description) > 255:
+        return None, 'Description must be at most 255 characters.'
+
+    return {'date': parsed_date, 'amount_minor': amount_minor, 'currency': currency,
+            'category': category, 'description': description}, None
+
+
+def import_expenses(user_id, rows, skip_duplicates=True):
+    """Validate and insert parsed rows in batches; return an ImportResult."""
+    result = ImportResult()
+    batch = []
+    home_currency = user_home_currency(user_id)
+    # Duplicate keys of the dates loaded so far, plus every row inserted by this import
+    seen = _SeenRows() if skip_duplicates else None
+
+    for line, raw in rows:
+        if raw.get('amount') is None:
+            result.skipped += 1
+            continue
+        values, error = validate_row(raw)
+        if error:
+            result.add_error(line, error)
+            continue
+        values['currency'] = values['currency'] or home_currency
+        try:
+            values['home_amount_minor'] = convert_minor(
+                values['amount_minor'], values['currency'], home_currency, values['date']
+            )
+        except MissingRate as missing:
+            result.add_error(line, str(missing))
+            continue
+        batch.append(values)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _insert_batch(user_id, batch, result, seen)
+            batch = []
+
+    if batch:
+        _insert_batch(user_id, batch, result, seen)
+    return result
+
+
+def _duplicate_key(values):
+    return (values['date'], values['amount_minor'], values['currency'], values['category'], values['description'] or '')
+
+
+def _duplicate_columns(entity):
+    return entity.date, entity.amount_minor, entity.currency, entity.category, entity.description
+
+
+class _SeenRows:
+    def __init__(self):
+        self.keys = set()
+        self.dates = set()
+
+    def load(self, user_id, dates):
+        """Add the duplicate keys of the user's stored rows on `dates` not loaded yet."""
+        dates = dates - self.dates
+        if not dates:
+            return
+        existing = select(*_duplicate_columns(Expense)).where(Expense.user_id == user_id, Expense.date.in_(dates))
+        if reaches_archive(min(dates)):
+            existing = union_all(existing, select(*_duplicate_columns(ArchivedExpense)).where(
+                ArchivedExpense.user_id == user_id, ArchivedExpense.date.in_(dates),
+            ))
+        self.keys.update(
+            (row_date, amount_minor, currency, category, description or '')
+            for row_date, amount_minor, currency, category, description
+            in db.session.connection(bind_arguments={'mapper': Expense}).execute(existing)
+        )
+        self.dates |= dates
+
+
+_SQLITE_INSERT = (
+    'INSERT INTO expense (user_id, date, category, amount_minor, currency, home_amount_minor, description) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+
+
+def _insert_expenses(connection, batch):
+    """Insert the rows with one executemany; return their ids."""
+    expense = Expense.__table__
+    if connection.dialect.name != 'sqlite':
+        return connection.execute(expense.insert().returning(expense.c.id), batch).scalars().all()
+    # SQLAlchemy stores SQLite dates as ISO strings; skipping its per-row bind processing halves the cost
+    rows = [
+        (values['user_id'], values['date'].isoformat(), values['category'], values['amount_minor'],
+         values['currency'], values['home_amount_minor'], values['description'])
+        for values in batch
+    ]
+    with deferred_indexing(connection) as indexed:
+        connection.exec_driver_sql(_SQLITE_INSERT, rows)
+        last_id = connection.execute(text('SELECT last_insert_rowid()')).scalar()
+        indexed.append((last_id - len(batch) + 1, last_id))
+    return range(last_id - len(batch) + 1, last_id + 1)
+
+
+def _insert_batch(user_id, batch, result, seen):
+    if seen is not None:
+        seen.load(user_id, {values['date'] for values in batch})
+        unique = []
+        for values in batch:
+            key = _duplicate_key(values)
+            if key in seen.keys:
+                result.duplicates += 1
+                continue
+            seen.keys.add(key)
+            unique.append(values)
+        batch = unique
+
+    if not batch:
+        return
+
+    deltas = defaultdict(lambda: [0, 0])
+    spend = defaultdict(int)
+    for values in batch:
+        values['user_id'] = user_id
+        bucket = deltas[(values['date'].year, values['date'].month, values['category'])]
+        bucket[0] += values['home_amount_minor']
+        bucket[1] += 1
+        spend[(values['date'], values['category'])] += values['home_amount_minor']
+
+    ids = _insert_expenses(db.session.connection(bind_arguments={'mapper': Expense}), batch)
+    record_changes(user_id, 'expense', ids)
+    apply_rollup_deltas(user_id, deltas)
+    apply_budget_deltas(user_id, spend)
+    bump_data_version(user_id)
+    db.session.commit()
+    result.inserted += len(batch)
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,235 @@
+"""Background jobs for heavy reports.
+
+Work that would hold a web worker for seconds, such as a full-history CSV
+export or a monthly statement, is queued as a row in the `job` table
+instead. `flask run-jobs` runs next to the web server (gunicorn.conf.py
+starts it). It polls the table and hands each job to a pool of
+JOBS_WORKERS processes. Results are written to JOBS_RESULT_DIR and served
+by /reports/<id>/download.
+
+Runners claim a job with a conditional UPDATE (queued -> running), so two
+runners never take the same one. A running job refreshes heartbeat_at
+whenever it reports progress. If its runner dies, the heartbeat goes stale
+after JOBS_STALE_SECONDS and the job is queued again. A user may have at
+most JOBS_MAX_ACTIVE_PER_USER jobs queued or running at once. Finished
+jobs and their files are deleted after JOBS_RETENTION_DAYS.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app, url_for
+from sqlalchemy import delete, func, select, update
+
+from app import db
+from models import Job, User
+from reports import REPORT_KINDS
+from shards import each_shard, use_shard
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED = 'queued', 'running', 'done', 'failed'
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+# Minimum seconds between progress writes of one job
+PROGRESS_INTERVAL = 1.0
+SWEEP_INTERVAL = 60
+
+
+class JobLimitReached(Exception):
+    """The user already has JOBS_MAX_ACTIVE_PER_USER jobs queued or running."""
+
+
+def init_jobs(app):
+    app.config.setdefault('JOBS_WORKERS', 2)
+    app.config.setdefault('JOBS_MAX_ACTIVE_PER_USER', 2)
+    app.config.setdefault('JOBS_RESULT_DIR', os.path.join(app.instance_path, 'job_results'))
+    app.config.setdefault('JOBS_POLL_SECONDS', 1.0)
+    app.config.setdefault('JOBS_STALE_SECONDS', 300)
+    app.config.setdefault('JOBS_RETENTION_DAYS', 7)
+
+
+def result_path(job_id):
+    return os.path.join(current_app.config['JOBS_RESULT_DIR'], f'job-{job_id}')
+
+
+def enqueue_job(user_id, kind, params):
+    """Queue a report job for the user and return it; may raise JobLimitReached."""
+    if kind not in REPORT_KINDS:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    # Serializes concurrent enqueues by the same user so the limit holds
+    db.session.execute(select(User.id).where(User.id == user_id).with_for_update())
+    active = db.session.execute(
+        select(func.count(Job.id)).where(Job.user_id == user_id, Job.status.in_(ACTIVE_STATUSES))
+    ).scalar()
+    limit = current_app.config['JOBS_MAX_ACTIVE_PER_USER']
+    if active >= limit:
+        db.session.rollback()
+        raise JobLimitReached(f'You already have {active} reports in progress; wait for one to finish.')
+    job = Job(user_id=user_id, kind=kind, params=json.dumps(params, sort_keys=True))
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def job_to_dict(job):
+    """JSON-serialisable status of a job, with its download URL once done."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'download_url': url_for('download_report', id=job.id) if job.status == JOB_DONE else None,
+    }
+
+
+def claim_job(job_id):
+    """Mark a queued job running; False when another runner claimed it first."""
+    now = datetime.now()
+    result = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == JOB_QUEUED)
+        .values(status=JOB_RUNNING, progress=0, started_at=now, heartbeat_at=now),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _finish(job_id, **values):
+    db.session.execute(
+        update(Job).where(Job.id == job_id).values(finished_at=datetime.now(), **values),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+
+
+def run_job(job_id):
+    """Build a claimed job's report; return True on success. Runs in a pool process."""
+    job = db.session.get(Job, job_id)
+    user_id, kind, params = job.user_id, job.kind, json.loads(job.params)
+    db.session.commit()
+
+    last_write = 0.0
+
+    def progress(done, total):
+        nonlocal last_write
+        if time.monotonic() - last_write < PROGRESS_INTERVAL:
+            return
+        last_write = time.monotonic()
+        # Own short transaction: the builder's session may be mid-stream
+        with db.session.get_bind(Job).begin() as connection:
+            connection.execute(update(Job).where(Job.id == job_id).values(
+                progress=min(99, done * 100 // total) if total else 0, heartbeat_at=datetime.now(),
+            ))
+
+    path = result_path(job_id)
+    partial = path + '.part'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        result_name, mimetype = REPORT_KINDS[kind](user_id, params, partial, progress)
+        os.replace(partial, path)
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed', job_id, kind)
+        if os.path.exists(partial):
+            os.remove(partial)
+        _finish(job_id, status=JOB_FAILED, error=str(exc)[:255] or type(exc).__name__)
+        return False
+    _finish(job_id, status=JOB_DONE, progress=100, result_name=result_name, mimetype=mimetype)
+    return True
+
+
+def requeue_stale_jobs():
+    """Queue running jobs whose runner stopped reporting again; return how many."""
+    stale_before = datetime.now() - timedelta(seconds=current_app.config['JOBS_STALE_SECONDS'])
+    result = db.session.execute(
+        update(Job).where(Job.status == JOB_RUNNING, Job.heartbeat_at < stale_before).values(status=JOB_QUEUED),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_old_jobs():
+    """Delete finished jobs past JOBS_RETENTION_DAYS and their files; return how many."""
+    finished_before = datetime.now() - timedelta(days=current_app.config['JOBS_RETENTION_DAYS'])
+    ids = db.session.execute(
+        select(Job.id).where(Job.status.in_((JOB_DONE, JOB_FAILED)), Job.finished_at < finished_before)
+    ).scalars().all()
+    for job_id in ids:
+        if os.path.exists(result_path(job_id)):
+            os.remove(result_path(job_id))
+    if ids:
+        db.session.execute(delete(Job).where(Job.id.in_(ids)), execution_options={'synchronize_session': False})
+    db.session.commit()
+    return len(ids)
+
+
+def _init_pool_process():
+    # Connections inherited from the runner must not be shared across processes
+    from app import app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def _run_in_pool(job_id, shard=None):
+    from app import app
+    with app.app_context():
+        use_shard(shard)
+        return run_job(job_id)
+
+
+def run_jobs(workers=None, until_idle=False, stop=None):
+    """Dispatch queued jobs to a process pool; return how many ran.
+
+    Runs until `stop` (a threading.Event) is set or, with until_idle, until
+    the queue is empty and nothing is running. With sharding, every shard's
+    queue is polled and swept in turn.
+    """
+    workers = workers or current_app.config['JOBS_WORKERS']
+    poll = current_app.config['JOBS_POLL_SECONDS']
+    running = set()
+    started = 0
+    last_sweep = 0.0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_process) as pool:
+        while stop is None or not stop.is_set():
+            if time.monotonic() - last_sweep > SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                for shard in each_shard():
+                    if requeue_stale_jobs():
+                        logger.warning('Requeued jobs whose runner stopped responding')
+                    purge_old_jobs()
+
+            for future in [future for future in running if future.done()]:
+                running.discard(future)
+                if future.exception() is not None:
+                    logger.error('Job process crashed', exc_info=future.exception())
+
+            queued = []
+            for shard in each_shard():
+                if len(running) >= workers:
+                    continue
+                job_ids = db.session.execute(
+                    select(Job.id).where(Job.status == JOB_QUEUED).order_by(Job.id).limit(workers - len(running))
+                ).scalars().all()
+                db.session.commit()
+                queued += job_ids
+                for job_id in job_ids:
+                    if claim_job(job_id):
+                        running.add(pool.submit(_run_in_pool, job_id, shard))
+                        started += 1
+
+            if until_idle and not running and not queued:
+                break
+            if running:
+                wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            elif not queued:
+                time.sleep(poll)
+    return started
@@ -0,0 +1,220 @@
+"""Per-request SQL instrumentation and a Prometheus /metrics endpoint.
+
+SQLAlchemy cursor events count every statement a request issues and time
+it, and Flask's template signals time every render_template() call. At the
+end of the request the totals are folded into per-endpoint (and
+per-template) histograms, which /metrics renders in the Prometheus text
+format. Metrics live in process memory, so each gunicorn worker reports its
+own series. Outside development /metrics answers 404 unless METRICS_TOKEN
+is set, and then it requires that token as a bearer token.
+"""
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.db_time = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.query_count = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.slowest_query = defaultdict(float)
+        self.render_time = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.responses = defaultdict(int)
+        self.collectors = {}
+
+    def add_collector(self, name, collect):
+        """Register a callable returning extra exposition lines for /metrics."""
+        self.collectors[name] = collect
+
+    def record(self, endpoint, status, latency, stats):
+        with self.lock:
+            self.request_latency[endpoint].observe(latency)
+            self.db_time[endpoint].observe(stats.db_time)
+            self.query_count[endpoint].observe(stats.query_count)
+            self.slowest_query[endpoint] = max(self.slowest_query[endpoint], stats.slowest_time)
+            self.responses[(endpoint, status)] += 1
+            for template, seconds in stats.render_times:
+                self.render_time[template].observe(seconds)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            _render_histogram(lines, 'app_request_duration_seconds', 'Request latency by endpoint.', self.request_latency)
+            _render_histogram(lines, 'app_db_duration_seconds', 'Database time per request by endpoint.', self.db_time)
+            _render_histogram(lines, 'app_db_queries_per_request', 'SQL statements per request by endpoint.', self.query_count)
+            _render_histogram(lines, 'app_template_render_seconds', 'Template render time by template.', self.render_time, label='template')
+
+            lines.append('# HELP app_db_slowest_query_seconds Slowest single statement seen per endpoint.')
+            lines.append('# TYPE app_db_slowest_query_seconds gauge')
+            for endpoint, seconds in sorted(self.slowest_query.items()):
+                lines.append(f'app_db_slowest_query_seconds{{endpoint="{endpoint}"}} {seconds:.6f}')
+
+            lines.append('# HELP app_requests_total Responses by endpoint and status code.')
+            lines.append('# TYPE app_requests_total counter')
+            for (endpoint, status), count in sorted(self.responses.items()):
+                lines.append(f'app_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+        for collect in self.collectors.values():
+            lines.extend(collect())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.render_started = []
+        self.render_times = []
+
+
+registry = MetricsRegistry()
+
+
+def init_metrics(app):
+    """Attach query hooks to the app's engines (primary and replicas) and register /metrics.
+
+    Must be called inside an application context.
+    """
+    app.config.setdefault('METRICS_DEBUG_HEADERS', False)
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    app.config.setdefault('SLOW_QUERY_SECONDS', 0.5)
+
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def current_request_stats():
+    """Return the RequestStats of the active request, if instrumented."""
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        if current_app.config.get('APP_ENV', 'development') != 'development':
+            abort(404)
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        abort(403)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = current_request_stats()
+    if stats is None:
+        return
+
+    stats.query_count += 1
+    stats.db_time += elapsed
+    if elapsed > stats.slowest_time:
+        stats.slowest_time = elapsed
+        stats.slowest_statement = statement
+    if elapsed >= current_app.config['SLOW_QUERY_SECONDS']:
+        logger.warning('Slow query (%.3fs) in %s: %s', elapsed, request.endpoint, statement)
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started and context.execution_context is not None:
+        started.pop()
+
+
+def _start_render(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None:
+        stats.render_started.append(time.perf_counter())
+
+
+def _finish_render(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None and stats.render_started:
+        stats.render_times.append((template.name or 'string', time.perf_counter() - stats.render_started.pop()))
+
+
+def _start_request():
+    g.request_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+
+    latency = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unknown'
+    registry.record(endpoint, response.status_code, latency, stats)
+    logger.debug(
+        '%s: %d queries, %.1fms in db, slowest %.1fms: %s',
+        endpoint, stats.query_count, stats.db_time * 1000, stats.slowest_time * 1000, stats.slowest_statement,
+    )
+    for template, seconds in stats.render_times:
+        logger.debug('%s: rendered %s in %.1fms', endpoint, template, seconds * 1000)
+
+    if current_app.debug or current_app.config['METRICS_DEBUG_HEADERS']:
+        response.headers['X-Query-Count'] = str(stats.query_count)
+        render = ''.join(
+            f'render;dur={seconds * 1000:.1f};desc="{template}", ' for template, seconds in stats.render_times
+        )
+        response.headers['Server-Timing'] = (
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.query_count} queries", '
+            f'{render}total;dur={latency * 1000:.1f}'
+        )
+    return response
+
+
+def _render_histogram(lines, name, help_text, histograms, label='endpoint'):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for value, histogram in sorted(histograms.items()):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.total:.6f}')
+        lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
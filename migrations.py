@@ -0,0 +1,228 @@
+"""In-place upgrades for databases created before a model change.
+
+db.create_all() only creates missing tables; it never alters one that
+already exists. `flask upgrade-db` runs every step below, in order, on the
+primary and on each shard. A step looks at the live schema before touching
+it, so a step that has already run, or a table the database does not hold,
+is skipped and the command can be re-run safely.
+
+Steps:
+
+user-data-version
+    user.data_version, bumped by every write to the user's data and part of
+    every response cache key (see cache.py). Existing users start at 0.
+
+reminder-recurrence
+    reminder.frequency, repeat_interval, end_date and the indexed next_due
+    that /reminders, the dashboard and `flask run-recurring` query by
+    range (see recurring.py). Existing reminders become one-offs, and their
+    next_due is backfilled with recurring.initial_next_due.
+
+money-minor-units
+    Amounts were Float columns before multi-currency support. Each becomes
+    a BIGINT of hundredths, rounded from the old value:
+
+        ALTER TABLE expense ADD COLUMN amount_minor BIGINT NOT NULL DEFAULT 0;
+        UPDATE expense SET amount_minor = CAST(ROUND(amount * 100) AS BIGINT);
+        ALTER TABLE expense DROP COLUMN amount;
+
+    for expense.amount, expense_rollup.total, budget.limit_amount,
+    recurring_expense.amount, goal.target_amount and goal.current_amount.
+    Every table that gains a currency column gets 'USD', and users get a USD
+    home currency. Old rows had no other currency, so
+    expense.home_amount_minor is a copy of amount_minor. The budget index
+    ix_expense_user_category_date is rebuilt to cover home_amount_minor.
+    Reminder amounts stay Float. Dropping a column needs SQLite 3.35 or
+    later.
+
+exchange-rate-loaded-at
+    exchange_rate.loaded_at, which the per-process rate caches poll to notice
+    newly loaded rates (see fx.py). Rates already stored get the epoch.
+
+expense-keyset-index
+    ix_expense_user_date_id on expense (user_id, date, id), which keyset
+    pagination of the /expenses list walks (see pagination.py). create_all
+    only adds it to new tables.
+
+user-session-version
+    user.session_version, carried in every session and bumped to log a user
+    out everywhere (see identity.py). Existing sessions carry no version and
+    count as 0, so nobody is signed out by the upgrade.
+"""
+import logging
+
+from sqlalchemy import BigInteger, Date, DateTime, Integer, String, bindparam, inspect, select, text, update
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# (table, Float column, minor-units column)
+_MONEY_COLUMNS = (
+    ('expense', 'amount', 'amount_minor'),
+    ('expense_rollup', 'total', 'total_minor'),
+    ('budget', 'limit_amount', 'limit_minor'),
+    ('recurring_expense', 'amount', 'amount_minor'),
+    ('goal', 'target_amount', 'target_minor'),
+    ('goal', 'current_amount', 'current_minor'),
+)
+_CURRENCY_TABLES = ('expense', 'budget', 'recurring_expense', 'goal')
+
+UPGRADES = []
+
+
+def upgrade(name):
+    """Register fn(connection) as the next upgrade step."""
+    def register(fn):
+        UPGRADES.append((name, fn))
+        return fn
+    return register
+
+
+def upgrade_engine(engine):
+    """Run every step on one engine, each in its own transaction; return the names of the steps that changed it."""
+    applied = []
+    for name, step in UPGRADES:
+        with engine.begin() as connection:
+            if step(connection):
+                applied.append(name)
+                logger.info('Applied schema upgrade %s to %s', name, engine.url.render_as_string(hide_password=True))
+    return applied
+
+
+def upgrade_database():
+    """Upgrade the primary and every shard; return {engine url: applied step names}."""
+    from shards import data_engines
+    engines = [db.engine] + [engine for engine in data_engines() if engine is not db.engine]
+    return {engine.url.render_as_string(hide_password=True): upgrade_engine(engine) for engine in engines}
+
+
+def _columns(connection, table):
+    inspector = inspect(connection)
+    if not inspector.has_table(table):
+        return None
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def _add_column(connection, table, column, type_, default=None):
+    """Add a NOT NULL column with `default`, or a nullable one without."""
+    quote = connection.dialect.identifier_preparer.quote
+    constraint = '' if default is None else f' NOT NULL DEFAULT {default}'
+    connection.execute(text(
+        f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} '
+        f'{type_.compile(dialect=connection.dialect)}{constraint}'
+    ))
+
+
+@upgrade('user-data-version')
+def _user_data_version(connection):
+    columns = _columns(connection, 'user')
+    if columns is None or 'data_version' in columns:
+        return False
+    _add_column(connection, 'user', 'data_version', Integer(), 0)
+    return True
+
+
+@upgrade('reminder-recurrence')
+def _reminder_recurrence(connection):
+    from models import Reminder
+    from recurring import initial_next_due
+
+    columns = _columns(connection, 'reminder')
+    if columns is None or 'next_due' in columns:
+        return False
+    if 'frequency' not in columns:
+        _add_column(connection, 'reminder', 'frequency', String(10))
+    if 'repeat_interval' not in columns:
+        _add_column(connection, 'reminder', 'repeat_interval', Integer(), 1)
+    if 'end_date' not in columns:
+        _add_column(connection, 'reminder', 'end_date', Date())
+    _add_column(connection, 'reminder', 'next_due', Date())
+
+    reminder = Reminder.__table__
+    rows = connection.execute(select(
+        reminder.c.id, reminder.c.due_date, reminder.c.frequency, reminder.c.repeat_interval, reminder.c.end_date,
+    )).all()
+    next_dues = [
+        {'reminder_id': row.id, 'next_due': initial_next_due(Reminder(
+            due_date=row.due_date, frequency=row.frequency,
+            repeat_interval=row.repeat_interval, end_date=row.end_date,
+        ))}
+        for row in rows
+    ]
+    if next_dues:
+        connection.execute(
+            update(reminder).where(reminder.c.id == bindparam('reminder_id')).values(next_due=bindparam('next_due')),
+            next_dues,
+        )
+    connection.execute(text('CREATE INDEX ix_reminder_next_due ON reminder (next_due)'))
+    return True
+
+
+@upgrade('money-minor-units')
+def _money_minor_units(connection):
+    quote = connection.dialect.identifier_preparer.quote
+    changed = False
+
+    columns = _columns(connection, 'user')
+    if columns is not None and 'home_currency' not in columns:
+        _add_column(connection, 'user', 'home_currency', String(3), "'USD'")
+        changed = True
+
+    for table in _CURRENCY_TABLES:
+        columns = _columns(connection, table)
+        if columns is not None and 'currency' not in columns:
+            _add_column(connection, table, 'currency', String(3), "'USD'")
+            changed = True
+
+    for table, old, new in _MONEY_COLUMNS:
+        columns = _columns(connection, table)
+        if columns is None or old not in columns or new in columns:
+            continue
+        _add_column(connection, table, new, BigInteger(), 0)
+        # Goal.current_amount was nullable
+        connection.execute(text(
+            f'UPDATE {quote(table)} SET {quote(new)} = CAST(ROUND(COALESCE({quote(old)}, 0) * 100) AS BIGINT)'
+        ))
+        connection.execute(text(f'ALTER TABLE {quote(table)} DROP COLUMN {quote(old)}'))
+        changed = True
+
+    columns = _columns(connection, 'expense')
+    if columns is not None and 'home_amount_minor' not in columns:
+        _add_column(connection, 'expense', 'home_amount_minor', BigInteger(), 0)
+        connection.execute(text('UPDATE expense SET home_amount_minor = amount_minor'))
+        connection.execute(text('DROP INDEX IF EXISTS ix_expense_user_category_date'))
+        connection.execute(text(
+            'CREATE INDEX ix_expense_user_category_date ON expense (user_id, category, date, home_amount_minor)'
+        ))
+        changed = True
+    return changed
+
+
+@upgrade('exchange-rate-loaded-at')
+def _exchange_rate_loaded_at(connection):
+    columns = _columns(connection, 'exchange_rate')
+    if columns is None or 'loaded_at' in columns:
+        return False
+    _add_column(connection, 'exchange_rate', 'loaded_at', DateTime(), "'1970-01-01 00:00:00'")
+    connection.execute(text('CREATE INDEX ix_exchange_rate_loaded_at ON exchange_rate (loaded_at)'))
+    return True
+
+
+@upgrade('expense-keyset-index')
+def _expense_keyset_index(connection):
+    if _columns(connection, 'expense') is None:
+        return False
+    if any(index['name'] == 'ix_expense_user_date_id' for index in inspect(connection).get_indexes('expense')):
+        return False
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_expense_user_date_id ON expense (user_id, date, id)'))
+    return True
+
+
+@upgrade('user-session-version')
+def _user_session_version(connection):
+    columns = _columns(connection, 'user')
+    if columns is None or 'session_version' in columns:
+        return False
+    _add_column(connection, 'user', 'session_version', Integer(), 0)
+    return True
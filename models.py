@@ -1,12 +1,10 @@
-from datetime import date
-from app import db, login_manager
+from datetime import date, datetime
+from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from money import DEFAULT_CURRENCY, from_minor
 
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+# The Flask-Login user loader lives in identity.py (cached lookups)
 
 
 class User(UserMixin, db.Model):
@@ -14,12 +12,24 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(64), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(256))
+    # Bumped by every write to the user's data; keys the response cache
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Currency every expense is converted into for totals, budgets and analytics
+    home_currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY, server_default=DEFAULT_CURRENCY)
+    # Part of every session's user id; bumping it ends all of the user's sessions (see identity.py)
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships - consistent definition in parent model
     expenses = db.relationship('Expense', backref='user', lazy=True, cascade='all, delete-orphan')
     budgets = db.relationship('Budget', backref='user', lazy=True, cascade='all, delete-orphan')
     reminders = db.relationship('Reminder', backref='user', lazy=True, cascade='all, delete-orphan')
     goals = db.relationship('Goal', backref='user', lazy=True, cascade='all, delete-orphan')
+    recurring_expenses = db.relationship('RecurringExpense', backref='user', lazy=True, cascade='all, delete-orphan')
+    expense_rollups = db.relationship('ExpenseRollup', backref='user', lazy=True, cascade='all, delete-orphan')
+    archived_expenses = db.relationship('ArchivedExpense', backref='user', lazy=True, cascade='all, delete-orphan')
+    jobs = db.relationship('Job', backref='user', lazy=True, cascade='all, delete-orphan')
+    changes = db.relationship('ChangeLog', backref='user', lazy=True, cascade='all, delete-orphan')
+    notifications = db.relationship('Notification', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -27,32 +37,132 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def get_id(self):
+        return f'{self.id}:{self.session_version or 0}'
+    
     def __repr__(self):
         return f'<User {self.username}>'
 
 
 class Expense(db.Model):
+    __table_args__ = (
+        # Serves (and covers) the per-budget category/date window sum in budget_engine
+        db.Index('ix_expense_user_category_date', 'user_id', 'category', 'date', 'home_amount_minor'),
+        # Serves keyset pagination of the /expenses list ordered by (date, id)
+        db.Index('ix_expense_user_date_id', 'user_id', 'date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, nullable=False)
+    # Amount in hundredths of `currency`
+    amount_minor = db.Column(db.BigInteger, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY, server_default=DEFAULT_CURRENCY)
+    # amount_minor converted to the owner's home currency at the rate of
+    # `date` when written (see fx.py); every aggregate sums this column
+    home_amount_minor = db.Column(db.BigInteger, nullable=False)
     category = db.Column(db.String(100), nullable=False, index=True)
     date = db.Column(db.Date, nullable=False, default=date.today, index=True)
     description = db.Column(db.String(255))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
+    @property
+    def amount(self):
+        return from_minor(self.amount_minor)
+    
+    @property
+    def home_amount(self):
+        return from_minor(self.home_amount_minor)
+    
+    def __repr__(self):
+        return f'<Expense {self.amount} {self.currency} - {self.category}>'
+
+
+class ArchivedExpense(db.Model):
+    """An expense moved out of the hot table by archive.py; same columns, read-only."""
+    __tablename__ = 'expense_archive'
+    __table_args__ = (
+        db.Index('ix_expense_archive_user_date_id', 'user_id', 'date', 'id'),
+        db.Index('ix_expense_archive_user_category_date', 'user_id', 'category', 'date', 'home_amount_minor'),
+    )
+
+    # Keeps the id it had in the expense table
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    amount_minor = db.Column(db.BigInteger, nullable=False)
+    currency = db.Column(db.String(3), nullable=False)
+    home_amount_minor = db.Column(db.BigInteger, nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    description = db.Column(db.String(255))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    @property
+    def amount(self):
+        return from_minor(self.amount_minor)
+
+    @property
+    def home_amount(self):
+        return from_minor(self.home_amount_minor)
+
     def __repr__(self):
-        return f'<Expense {self.amount} - {self.category}>'
+        return f'<ArchivedExpense {self.amount} {self.currency} - {self.category}>'
+
+
+class ArchiveState(db.Model):
+    """Single row: expenses dated before `cutoff` may be in expense_archive."""
+    id = db.Column(db.Integer, primary_key=True)
+    cutoff = db.Column(db.Date)
+    published_at = db.Column(db.DateTime)
+
+
+class ExpenseRollup(db.Model):
+    """Running sum/count of a user's expenses per (year, month, category)."""
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'year', 'month', 'category', name='uq_expense_rollup_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    # Sum of home_amount_minor
+    total_minor = db.Column(db.BigInteger, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ExpenseRollup {self.year}-{self.month:02d} {self.category}: {from_minor(self.total_minor)}>'
 
 
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     category = db.Column(db.String(64), nullable=False, index=True)
-    limit_amount = db.Column(db.Float, nullable=False)
+    limit_minor = db.Column(db.BigInteger, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY, server_default=DEFAULT_CURRENCY)
     start_date = db.Column(db.Date, nullable=False, index=True)
     end_date = db.Column(db.Date, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    total = db.relationship('BudgetTotal', backref='budget', uselist=False, cascade='all, delete-orphan')
+    notifications = db.relationship('Notification', backref='budget', lazy=True, cascade='all, delete-orphan')
+
+    @property
+    def limit_amount(self):
+        return from_minor(self.limit_minor)
 
     def __repr__(self):
-        return f'<Budget {self.category} - {self.limit_amount}>'
+        return f'<Budget {self.category} - {self.limit_amount} {self.currency}>'
+
+
+class BudgetTotal(db.Model):
+    """Running spend of one budget, adjusted by every expense write; see budget_engine.py."""
+    budget_id = db.Column(db.Integer, db.ForeignKey('budget.id'), primary_key=True)
+    # Sum of home_amount_minor over the expenses in the budget's category and window
+    spent_minor = db.Column(db.BigInteger, nullable=False, default=0)
+    # The budget's limit in the owner's home currency
+    limit_minor = db.Column(db.BigInteger, nullable=False)
+    # Highest alert threshold (percent) reached so far, 0 for none
+    alert_level = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<BudgetTotal {self.budget_id}: {from_minor(self.spent_minor)} of {from_minor(self.limit_minor)}>'
 
 
 class Reminder(db.Model):
@@ -61,18 +171,175 @@ class Reminder(db.Model):
     due_date = db.Column(db.Date, nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Optional recurrence; due_date is the first occurrence
+    frequency = db.Column(db.String(10))
+    repeat_interval = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    end_date = db.Column(db.Date)
+    # Next occurrence not yet passed (NULL once the rule has ended); indexed
+    # so "what is due in the next N days" is a single range query
+    next_due = db.Column(db.Date, index=True)
     
     def __repr__(self):
         return f'<Reminder {self.bill_name}: ${self.amount}>'
 
 
+class RecurringExpense(db.Model):
+    """Template that the recurring job materializes into Expense rows."""
+    id = db.Column(db.Integer, primary_key=True)
+    amount_minor = db.Column(db.BigInteger, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY, server_default=DEFAULT_CURRENCY)
+    category = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.String(255))
+    frequency = db.Column(db.String(10), nullable=False)
+    repeat_interval = db.Column(db.Integer, nullable=False, default=1)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date)
+    # Next occurrence not yet materialized (NULL once the rule has ended)
+    next_due = db.Column(db.Date, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    @property
+    def amount(self):
+        return from_minor(self.amount_minor)
+
+    def __repr__(self):
+        return f'<RecurringExpense {self.category} {self.amount} {self.currency} {self.frequency}>'
+
+
 class Goal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    target_amount = db.Column(db.Float, nullable=False)
-    current_amount = db.Column(db.Float, default=0)
+    target_minor = db.Column(db.BigInteger, nullable=False)
+    current_minor = db.Column(db.BigInteger, nullable=False, default=0)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY, server_default=DEFAULT_CURRENCY)
     due_date = db.Column(db.Date, nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
+    @property
+    def target_amount(self):
+        return from_minor(self.target_minor)
+    
+    @property
+    def current_amount(self):
+        return from_minor(self.current_minor)
+    
     def __repr__(self):
         return f'<Goal {self.name}: ${self.current_amount}/${self.target_amount}>'
+
+
+class ExchangeRate(db.Model):
+    """Units of `currency` per one unit of FX_BASE_CURRENCY on `date`."""
+    __table_args__ = (
+        # Also serves the date-ordered load into the in-memory rate cache
+        db.UniqueConstraint('currency', 'date', name='uq_exchange_rate_currency_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    currency = db.Column(db.String(3), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    rate = db.Column(db.Numeric(20, 10), nullable=False)
+    # Polled by every process's rate cache to notice a new load (see fx.py)
+    loaded_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+    def __repr__(self):
+        return f'<ExchangeRate {self.date} {self.currency} {self.rate}>'
+
+
+class Job(db.Model):
+    """A background report run by jobs.py; the result file lives in JOBS_RESULT_DIR."""
+    __table_args__ = (
+        # The runner's "oldest queued job" poll and the stale-job sweep
+        db.Index('ix_job_status_id', 'status', 'id'),
+        db.Index('ix_job_user_created', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # A key of reports.REPORT_KINDS
+    kind = db.Column(db.String(32), nullable=False)
+    # JSON-encoded builder arguments
+    params = db.Column(db.Text, nullable=False, default='{}')
+    # queued -> running -> done | failed
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255))
+    # Download filename and type of the finished result
+    result_name = db.Column(db.String(255))
+    mimetype = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    # Refreshed with progress; a running job with an old heartbeat lost its runner
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+
+class ChangeLog(db.Model):
+    """A created, changed or deleted row of a synced model; see sync.py."""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        # Serves the per-user (version, id) cursor scan of /api/v1/sync
+        db.Index('ix_change_log_user_version_id', 'user_id', 'version', 'id'),
+        db.Index('ix_change_log_changed_at', 'changed_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # The owner's data_version as bumped by the writing transaction
+    version = db.Column(db.Integer, nullable=False)
+    # A key of sync.SYNCED_MODELS and that row's id
+    entity = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # "upsert" or "delete"
+    op = db.Column(db.String(8), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f'<ChangeLog {self.version}.{self.id} {self.op} {self.entity} {self.entity_id}>'
+
+
+class SyncFloor(db.Model):
+    """Position of the newest change_log entry pruned for a user; older sync cursors must start over."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    change_id = db.Column(db.Integer, nullable=False)
+
+
+class Notification(db.Model):
+    """An alert for the user's dashboard, written in the same transaction as the change that caused it."""
+    __table_args__ = (
+        # Serves the dashboard's newest-unread lookup
+        db.Index('ix_notification_user_read_id', 'user_id', 'read_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    budget_id = db.Column(db.Integer, db.ForeignKey('budget.id'), index=True)
+    # Percent of the budget's limit that was reached
+    threshold = db.Column(db.Integer, nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    read_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Notification {self.id} {self.message!r}>'
+
+
+class ShardDirectory(db.Model):
+    """Which shard holds a user's rows; kept in the directory database when sharding is on, see shards.py."""
+    __tablename__ = 'shard_directory'
+
+    # User ids are allocated here so they are unique across shards
+    user_id = db.Column(db.Integer, primary_key=True)
+    shard = db.Column(db.String(32), nullable=False, index=True)
+    # Login and registration look users up here before their shard is known
+    username = db.Column(db.String(64), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    # Set while the user is being copied to that shard; their writes are refused meanwhile
+    moving_to = db.Column(db.String(32))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<ShardDirectory {self.user_id} {self.shard}>'
@@ -0,0 +1,51 @@
+"""Money helpers.
+
+Amounts are stored as exact integers in hundredths of a currency unit
+("minor units") so sums never drift. A fixed scale of 100 is used for
+every currency; zero-decimal currencies such as JPY simply carry two
+trailing zeros.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+MINOR_PER_UNIT = 100
+DEFAULT_CURRENCY = 'USD'
+
+CURRENCY_CHOICES = [
+    ('USD', 'USD - US Dollar'),
+    ('EUR', 'EUR - Euro'),
+    ('GBP', 'GBP - British Pound'),
+    ('INR', 'INR - Indian Rupee'),
+    ('JPY', 'JPY - Japanese Yen'),
+    ('CAD', 'CAD - Canadian Dollar'),
+    ('AUD', 'AUD - Australian Dollar'),
+    ('CHF', 'CHF - Swiss Franc'),
+    ('CNY', 'CNY - Chinese Yuan'),
+]
+CURRENCY_CODES = frozenset(code for code, _ in CURRENCY_CHOICES)
+
+
+def to_minor(amount):
+    """Convert a major-unit amount (float, str or Decimal) to integer minor units."""
+    try:
+        value = Decimal(str(amount).strip())
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount {amount!r}')
+    if not value.is_finite():
+        raise ValueError(f'Invalid amount {amount!r}')
+    return int((value * MINOR_PER_UNIT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor):
+    """Major-unit float of an integer minor-unit amount, for display and JSON."""
+    return int(minor or 0) / MINOR_PER_UNIT
+
+
+CURRENCY_SYMBOLS = {'USD': '$', 'EUR': '€', 'GBP': '£', 'INR': '₹', 'JPY': '¥'}
+
+
+def format_money(amount, currency=DEFAULT_CURRENCY):
+    """Template filter: "$12.50" for currencies with a symbol, else "12.50 CHF"."""
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    if symbol:
+        return f'{symbol}{amount:,.2f}'
+    return f'{amount:,.2f} {currency}'
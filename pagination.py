@@ -0,0 +1,107 @@
+"""Keyset (seek) pagination.
+
+Pages are addressed by an opaque cursor holding the sort key of the row at
+the page boundary instead of an OFFSET, so fetching page 1000 costs the same
+index range scan as page 1 and no COUNT(*) is needed to render navigation.
+"""
+import base64
+import binascii
+import json
+
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """One page of keyset-paginated results."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'k': [_to_json(value) for value in values], 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Return (key values, direction) for a cursor produced by encode_cursor."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        raw_values, direction = payload['k'], payload['d']
+        if direction not in ('next', 'prev') or len(raw_values) != len(columns):
+            raise InvalidCursor(token)
+        values = [_from_json(value, column) for value, column in zip(raw_values, columns)]
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+    return values, direction
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=10, with_total=False):
+    """Paginate `query` in descending order of `columns` (the last must be unique).
+
+    Raises InvalidCursor if `cursor` cannot be decoded.
+    """
+    total = query.order_by(None).count() if with_total else None
+    key = tuple_(*columns)
+
+    direction = 'next'
+    if cursor:
+        values, direction = decode_cursor(cursor, columns)
+        if direction == 'next':
+            query = query.filter(key < tuple(values))
+        else:
+            query = query.filter(key > tuple(values))
+
+    if direction == 'next':
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*[column.asc() for column in columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    def key_of(row):
+        return [getattr(row, column.key) for column in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if direction == 'next':
+            more_after, more_before = has_more, bool(cursor)
+        else:
+            more_after, more_before = True, has_more
+        if more_after:
+            next_cursor = encode_cursor(key_of(rows[-1]), 'next')
+        if more_before:
+            prev_cursor = encode_cursor(key_of(rows[0]), 'prev')
+
+    return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor, total=total)
+
+
+def _to_json(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _from_json(value, column):
+    python_type = column.type.python_type
+    if isinstance(value, str) and hasattr(python_type, 'fromisoformat'):
+        return python_type.fromisoformat(value)
+    return python_type(value)
@@ -0,0 +1,98 @@
+"""Recurrence rules for reminders and recurring expenses.
+
+A rule is an anchor date plus a frequency (daily/weekly/monthly/yearly),
+an interval and an optional end date. Occurrences are never stored; they
+are computed on demand for the requested window only. Jumping to the first
+occurrence inside a window is O(1), so expanding a rule that started years
+ago costs no more than expanding a new one.
+"""
+import calendar
+from datetime import timedelta
+
+FREQUENCY_CHOICES = [
+    ('daily', 'Daily'),
+    ('weekly', 'Weekly'),
+    ('monthly', 'Monthly'),
+    ('yearly', 'Yearly'),
+]
+FREQUENCY_LABELS = dict(FREQUENCY_CHOICES)
+FREQUENCY_UNITS = {'daily': 'day', 'weekly': 'week', 'monthly': 'month', 'yearly': 'year'}
+
+
+def frequency_label(frequency, interval):
+    """Human-readable rule, e.g. 'Monthly' or 'Every 2 weeks'."""
+    if not frequency:
+        return 'One time'
+    if not interval or interval == 1:
+        return FREQUENCY_LABELS[frequency]
+    return f'Every {interval} {FREQUENCY_UNITS[frequency]}s'
+
+
+def add_months(anchor, months):
+    """Shift a date by whole months, clamping the day to the month's length."""
+    month_index = anchor.month - 1 + months
+    year = anchor.year + month_index // 12
+    month = month_index % 12 + 1
+    return anchor.replace(year=year, month=month, day=min(anchor.day, calendar.monthrange(year, month)[1]))
+
+
+def nth_occurrence(anchor, frequency, interval, n):
+    """Return the n-th (0-based) occurrence of a rule."""
+    if frequency == 'daily':
+        return anchor + timedelta(days=n * interval)
+    if frequency == 'weekly':
+        return anchor + timedelta(weeks=n * interval)
+    if frequency == 'monthly':
+        return add_months(anchor, n * interval)
+    if frequency == 'yearly':
+        return add_months(anchor, 12 * n * interval)
+    raise ValueError(f'Unknown frequency: {frequency}')
+
+
+def first_index_on_or_after(anchor, frequency, interval, day):
+    """Return the index of the first occurrence falling on or after `day`."""
+    if day <= anchor:
+        return 0
+    if frequency in ('daily', 'weekly'):
+        step = interval * (7 if frequency == 'weekly' else 1)
+        return -(-(day - anchor).days // step)
+
+    step = interval * (12 if frequency == 'yearly' else 1)
+    months = (day.year - anchor.year) * 12 + day.month - anchor.month
+    n = max(months // step, 0)
+    while nth_occurrence(anchor, frequency, interval, n) < day:
+        n += 1
+    return n
+
+
+def iter_occurrences(anchor, frequency, interval, end_date, window_start, window_end):
+    """Yield the rule's occurrence dates inside [window_start, window_end].
+
+    A rule without a frequency is a one-off that occurs on its anchor date.
+    """
+    last = window_end if end_date is None else min(window_end, end_date)
+    if not frequency:
+        if window_start <= anchor <= last:
+            yield anchor
+        return
+
+    n = first_index_on_or_after(anchor, frequency, interval or 1, window_start)
+    while True:
+        occurrence = nth_occurrence(anchor, frequency, interval or 1, n)
+        if occurrence > last:
+            return
+        yield occurrence
+        n += 1
+
+
+def next_occurrence(anchor, frequency, interval, end_date, on_or_after):
+    """Return the first occurrence on or after a date, or None if the rule has ended."""
+    if not frequency:
+        return anchor if anchor >= on_or_after and (end_date is None or anchor <= end_date) else None
+    occurrence = nth_occurrence(
+        anchor, frequency, interval or 1,
+        first_index_on_or_after(anchor, frequency, interval or 1, on_or_after),
+    )
+    if end_date is not None and occurrence > end_date:
+        return None
+    return occurrence
@@ -0,0 +1,124 @@
+"""Lazy expansion and batch materialization of recurring items.
+
+Reminders and recurring-expense templates store a rule, never copies. Views
+expand occurrences for the requested window with generators, and the
+`flask run-recurring` job turns due recurring expenses into Expense rows.
+Materialization advances the template's next_due pointer in the same
+transaction as the inserts, so re-running the job is a no-op. A template
+whose occurrences cannot be converted to the owner's home currency yet
+(no exchange rate) is left due and retried on the next run.
+"""
+import heapq
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from app import db
+import rollups
+from budget_engine import apply_budget_deltas
+from cache import bump_data_version
+from fx import MissingRate, convert_minor
+from models import Expense, RecurringExpense, Reminder, User
+from recurrence import iter_occurrences, next_occurrence
+
+logger = logging.getLogger(__name__)
+
+MATERIALIZE_BATCH_SIZE = 100
+
+
+def rule_anchor(item):
+    return item.due_date if isinstance(item, Reminder) else item.start_date
+
+
+def initial_next_due(item):
+    anchor = rule_anchor(item)
+    return next_occurrence(anchor, item.frequency, item.repeat_interval, item.end_date, anchor)
+
+
+def iter_due(model, window_start, window_end, user_id=None):
+    """Yield (date, item) for every occurrence in the window, in date order.
+
+    Candidate rules come from one range query on the indexed next_due
+    column; each rule is then expanded lazily and the streams are merged.
+    """
+    query = model.query.filter(model.next_due.isnot(None), model.next_due <= window_end)
+    if user_id is not None:
+        query = query.filter(model.user_id == user_id)
+
+    streams = [_item_occurrences(item, window_start, window_end) for item in query]
+    for occurrence, _, item in heapq.merge(*streams, key=lambda entry: entry[:2]):
+        yield occurrence, item
+
+
+def _item_occurrences(item, window_start, window_end):
+    for occurrence in iter_occurrences(
+        rule_anchor(item), item.frequency, item.repeat_interval, item.end_date,
+        max(window_start, item.next_due), window_end,
+    ):
+        yield occurrence, item.id, item
+
+
+def materialize_recurring_expenses(today):
+    """Create Expense rows for every occurrence due up to `today`; return the count."""
+    created = 0
+    waiting = set()  # templates with no exchange rate yet, retried next run
+    while True:
+        due = db.session.query(RecurringExpense, User.home_currency).join(
+            User, User.id == RecurringExpense.user_id
+        ).filter(
+            RecurringExpense.next_due.isnot(None),
+            RecurringExpense.next_due <= today,
+            RecurringExpense.id.notin_(waiting),
+        ).order_by(RecurringExpense.id).limit(MATERIALIZE_BATCH_SIZE).with_for_update(
+            skip_locked=True, of=RecurringExpense
+        ).all()
+        if not due:
+            return created
+
+        for template, home_currency in due:
+            occurrences = list(iter_occurrences(
+                template.start_date, template.frequency, template.repeat_interval,
+                template.end_date, template.next_due, today,
+            ))
+            try:
+                home_amounts = [
+                    convert_minor(template.amount_minor, template.currency, home_currency, occurrence)
+                    for occurrence in occurrences
+                ]
+            except MissingRate as error:
+                logger.warning('Recurring expense %s postponed: %s', template.id, error)
+                waiting.add(template.id)
+                continue
+            spend = defaultdict(int)
+            for occurrence, home_amount_minor in zip(occurrences, home_amounts):
+                expense = Expense(
+                    amount_minor=template.amount_minor,
+                    currency=template.currency,
+                    home_amount_minor=home_amount_minor,
+                    category=template.category,
+                    date=occurrence,
+                    description=template.description,
+                    user_id=template.user_id,
+                )
+                db.session.add(expense)
+                rollups.record_expense(expense)
+                spend[(occurrence, template.category)] += home_amount_minor
+                created += 1
+            apply_budget_deltas(template.user_id, spend)
+            template.next_due = next_occurrence(
+                template.start_date, template.frequency, template.repeat_interval,
+                template.end_date, today + timedelta(days=1),
+            )
+            bump_data_version(template.user_id)
+        db.session.commit()
+
+
+def advance_reminders(today):
+    """Move reminders' next_due past occurrences that are already behind us."""
+    stale = Reminder.query.filter(Reminder.next_due.isnot(None), Reminder.next_due < today).all()
+    for reminder in stale:
+        reminder.next_due = next_occurrence(
+            reminder.due_date, reminder.frequency, reminder.repeat_interval, reminder.end_date, today
+        )
+    db.session.commit()
+    return len(stale)
@@ -0,0 +1,118 @@
+"""Report builders run as background jobs (see jobs.py).
+
+Each builder takes the owner's id, the job's params and a file path, writes
+the report to that path and returns (download filename, mimetype). It calls
+`progress(done, total)` as it goes so the job page can show how far along
+it is.
+
+Monthly statements are built from the same rollups and budget evaluation
+as the analytics page, plus the month's expenses streamed through the CSV
+export path. The HTML statement is a standalone, printable page; "Save as
+PDF" in the browser turns it into a PDF.
+"""
+import calendar
+import csv
+import io
+from datetime import date
+
+from flask import render_template
+
+import rollups
+from budget_engine import evaluate_budgets
+from expense_filters import archived_filter_conditions, expense_filter_conditions
+from exports import EXPORT_CHUNK_SIZE, export_count, export_rows, iter_csv
+from fx import home_currency
+from money import from_minor
+
+def _counted(rows, total, progress):
+    # Report progress once per export chunk rather than per row
+    for index, row in enumerate(rows, 1):
+        if index % EXPORT_CHUNK_SIZE == 0:
+            progress(index, total)
+        yield row
+
+
+def _filtered_rows(user_id, args):
+    conditions, values = expense_filter_conditions(user_id, args)
+    archived = archived_filter_conditions(user_id, args, values)
+    return export_count(user_id, conditions, archived), export_rows(user_id, conditions, archived)
+
+
+def build_export(user_id, params, path, progress):
+    """The /export/csv download for the filter args in `params` (plus gzip=1 to compress)."""
+    total, rows = _filtered_rows(user_id, params)
+    compress = bool(params.get('gzip'))
+    with open(path, 'wb') as out:
+        for chunk in iter_csv(_counted(rows, total, progress), compress=compress):
+            out.write(chunk)
+
+    filename = f'expenses_{date.today().strftime("%Y%m%d")}.csv'
+    if compress:
+        return filename + '.gz', 'application/gzip'
+    return filename, 'text/csv'
+
+
+def month_bounds(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def statement_context(user_id, year, month):
+    """Totals for one month: by category, against the previous month, and the budgets overlapping it."""
+    first, last = month_bounds(year, month)
+    previous = date(year - 1, 12, 1) if month == 1 else date(year, month - 1, 1)
+    budgets = [
+        status for status in evaluate_budgets(user_id)
+        if status['budget'].start_date <= last and status['budget'].end_date >= first
+    ]
+    return dict(
+        period_start=first,
+        period_end=last,
+        currency=home_currency(user_id),
+        category_totals=rollups.month_category_totals(user_id, year, month),
+        total=rollups.month_total(user_id, year, month),
+        previous_total=rollups.month_total(user_id, previous.year, previous.month),
+        budgets_data=budgets,
+    )
+
+
+def build_statement(user_id, params, path, progress):
+    """A monthly statement for params['year']/params['month'] as HTML or CSV."""
+    year, month = int(params['year']), int(params['month'])
+    context = statement_context(user_id, year, month)
+    first, last = month_bounds(year, month)
+    total, rows = _filtered_rows(user_id, {'date_from': first.isoformat(), 'date_to': last.isoformat()})
+    rows = _counted(rows, total, progress)
+    filename = f'statement_{year}_{month:02d}'
+
+    if params.get('format') == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Statement', first.strftime('%B %Y'), context['currency']])
+        writer.writerow(['Category', 'Total', 'Expenses'])
+        for category, amount, count in context['category_totals']:
+            writer.writerow([category.capitalize(), f'{amount:.2f}', count])
+        writer.writerow(['Total', f'{context["total"]:.2f}', sum(count for _, _, count in context['category_totals'])])
+        writer.writerow(['Previous month', f'{context["previous_total"]:.2f}', ''])
+        writer.writerow([])
+        with open(path, 'wb') as out:
+            out.write(buffer.getvalue().encode('utf-8'))
+            for chunk in iter_csv(rows):
+                out.write(chunk)
+        return filename + '.csv', 'text/csv'
+
+    expenses = (
+        {'date': expense_date, 'category': category, 'amount': from_minor(amount_minor), 'currency': currency,
+         'home_amount': from_minor(home_amount_minor), 'description': description}
+        for expense_date, category, amount_minor, currency, home_amount_minor, description in rows
+    )
+    html = render_template('statement.html', expenses=expenses, **context)
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(html)
+    return filename + '.html', 'text/html'
+
+
+# Job kind -> builder
+REPORT_KINDS = {
+    'export_csv': build_export,
+    'statement': build_statement,
+}
@@ -0,0 +1,167 @@
+"""Per-user monthly/category spending rollups.
+
+Every expense write adjusts the matching ExpenseRollup bucket in the same
+transaction, so the dashboard and analytics pages can read totals from a
+handful of small rows instead of scanning the expense table. Buckets hold
+integer home-currency minor units; the readers return major-unit floats.
+"""
+from sqlalchemy import delete, insert, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import ArchivedExpense, Expense, ExpenseRollup, User
+from money import from_minor
+
+# Dialects whose insert() has on_conflict_do_update
+_UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _add_to_buckets(rows):
+    """Add each row's total_minor/count to its (user, year, month, category) bucket, creating missing buckets.
+
+    One INSERT ... ON CONFLICT DO UPDATE, so two writers creating the same
+    bucket at once both land in it instead of one failing on the unique
+    constraint.
+    """
+    rollup = ExpenseRollup.__table__
+    upsert = _UPSERTS[db.session.get_bind(ExpenseRollup).dialect.name](rollup)
+    db.session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=['user_id', 'year', 'month', 'category'],
+            set_={
+                'total_minor': rollup.c.total_minor + upsert.excluded.total_minor,
+                'count': rollup.c.count + upsert.excluded.count,
+            },
+        ),
+        rows,
+    )
+
+
+def apply_expense_delta(user_id, expense_date, category, amount_minor, count):
+    """Add amount_minor/count to the rollup bucket an expense falls into."""
+    bucket = dict(user_id=user_id, year=expense_date.year, month=expense_date.month, category=category)
+    _add_to_buckets([dict(total_minor=amount_minor, count=count, **bucket)])
+    if count < 0:
+        # Drop buckets that no longer hold any expenses
+        db.session.execute(
+            delete(ExpenseRollup).filter_by(**bucket).where(ExpenseRollup.count <= 0)
+        )
+
+
+def apply_rollup_deltas(user_id, deltas):
+    """Apply many bucket deltas at once: {(year, month, category): (amount_minor, count)}.
+
+    Used by bulk writes; costs one executemany upsert regardless of how
+    many buckets are touched.
+    """
+    if not deltas:
+        return
+
+    _add_to_buckets([
+        dict(user_id=user_id, year=year, month=month, category=category, total_minor=amount_minor, count=count)
+        for (year, month, category), (amount_minor, count) in deltas.items()
+    ])
+    if any(count < 0 for _, count in deltas.values()):
+        rollup = ExpenseRollup.__table__
+        db.session.execute(
+            delete(rollup).where(rollup.c.user_id == user_id, rollup.c.count <= 0)
+        )
+
+
+def record_expense(expense):
+    apply_expense_delta(expense.user_id, expense.date, expense.category, expense.home_amount_minor, 1)
+
+
+def unrecord_expense(expense):
+    apply_expense_delta(expense.user_id, expense.date, expense.category, -expense.home_amount_minor, -1)
+
+
+def rebuild_rollups(user_id=None):
+    """Recompute rollups from the expense and archive tables (for one user or everyone)."""
+    branches = []
+    for entity in (Expense, ArchivedExpense):
+        branch = select(entity.user_id, entity.date, entity.category, entity.home_amount_minor)
+        if user_id is not None:
+            branch = branch.where(entity.user_id == user_id)
+        branches.append(branch)
+    expenses = union_all(*branches).subquery()
+
+    year = db.func.extract('year', expenses.c.date)
+    month = db.func.extract('month', expenses.c.date)
+    source = select(
+        expenses.c.user_id,
+        year,
+        month,
+        expenses.c.category,
+        db.func.sum(expenses.c.home_amount_minor),
+        db.func.count(),
+    ).group_by(expenses.c.user_id, year, month, expenses.c.category)
+
+    clear = delete(ExpenseRollup)
+    if user_id is not None:
+        clear = clear.where(ExpenseRollup.user_id == user_id)
+
+    users = update(User).values(data_version=User.data_version + 1)
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+
+    db.session.execute(clear)
+    db.session.execute(
+        insert(ExpenseRollup).from_select(
+            ['user_id', 'year', 'month', 'category', 'total_minor', 'count'], source
+        )
+    )
+    # Cached pages were derived from the old rollups
+    db.session.execute(users, execution_options={'synchronize_session': False})
+    db.session.commit()
+
+
+def user_totals(user_id):
+    """Return (total amount, expense count) across all of a user's expenses."""
+    total, count = db.session.query(
+        db.func.sum(ExpenseRollup.total_minor),
+        db.func.sum(ExpenseRollup.count),
+    ).filter(ExpenseRollup.user_id == user_id).one()
+    return from_minor(total), int(count or 0)
+
+
+def category_totals(user_id, limit=None):
+    """Return [(category, total)] ordered by total, largest first."""
+    total = db.func.sum(ExpenseRollup.total_minor)
+    query = db.session.query(ExpenseRollup.category, total).filter(
+        ExpenseRollup.user_id == user_id
+    ).group_by(ExpenseRollup.category).order_by(total.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return [(category, from_minor(total_minor)) for category, total_minor in query]
+
+
+def monthly_totals(user_id, since):
+    """Return [(year, month, total)] for every month from `since` onwards."""
+    month_index = ExpenseRollup.year * 12 + ExpenseRollup.month
+    rows = db.session.query(
+        ExpenseRollup.year,
+        ExpenseRollup.month,
+        db.func.sum(ExpenseRollup.total_minor),
+    ).filter(
+        ExpenseRollup.user_id == user_id,
+        month_index >= since.year * 12 + since.month,
+    ).group_by(ExpenseRollup.year, ExpenseRollup.month).order_by(
+        ExpenseRollup.year, ExpenseRollup.month
+    ).all()
+    return [(year, month, from_minor(total_minor)) for year, month, total_minor in rows]
+
+
+def month_category_totals(user_id, year, month):
+    """Return [(category, total, count)] for one month, largest total first."""
+    total = db.func.sum(ExpenseRollup.total_minor)
+    rows = db.session.query(ExpenseRollup.category, total, db.func.sum(ExpenseRollup.count)).filter_by(
+        user_id=user_id, year=year, month=month
+    ).group_by(ExpenseRollup.category).order_by(total.desc()).all()
+    return [(category, from_minor(total_minor), int(count)) for category, total_minor, count in rows]
+
+
+def month_total(user_id, year, month):
+    return from_minor(db.session.query(db.func.sum(ExpenseRollup.total_minor)).filter_by(
+        user_id=user_id, year=year, month=month
+    ).scalar())
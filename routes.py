@@ -1,19 +1,135 @@
+from collections import Counter
 from datetime import date, datetime, timedelta
 import json
-import csv
 import io
 
-from flask import render_template, redirect, url_for, flash, request, Response
+from flask import render_template, redirect, url_for, flash, request, Response, jsonify, send_file, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
+from flask_wtf.csrf import generate_csrf
 from app import db
-from models import User, Expense, Budget, Reminder, Goal
-from forms import LoginForm, RegistrationForm, ExpenseForm, ExpenseFilterForm, BudgetForm, ReminderForm, GoalForm
-from sqlalchemy import func, extract
+import rollups
+from budget_engine import apply_budget_deltas, budget_status_to_dict, dismiss_notifications, evaluate_budgets, expense_spend, track_budget, unread_notifications
+from expense_bulk import bulk_delete, bulk_recategorize, bulk_shift_dates, selection_conditions
+from expense_filters import FILTER_FIELDS, archived_filter_conditions, expense_filter_conditions, filtered_expenses
+from exports import export_rows, iter_csv
+from pagination import keyset_paginate, InvalidCursor
+from search import ranked_search
+from importer import import_expenses, parse_csv, parse_ofx
+from cache import bump_data_version, cached_for_user
+from db_routing import replica_reads
+from shards import find_user, place_user
+from identity import end_sessions
+from fx import MissingRate, convert_minor
+from jobs import JOB_DONE, JobLimitReached, enqueue_job, job_to_dict, result_path
+from money import format_money, to_minor
+from api import expense_to_dict
+from recurrence import frequency_label
+from recurring import initial_next_due, iter_due
+from models import User, Expense, ArchivedExpense, Budget, Reminder, RecurringExpense, Goal, Job
+from forms import LoginForm, RegistrationForm, ExpenseForm, ExpenseFilterForm, BulkExpenseForm, ImportForm, BudgetForm, ReminderForm, RecurringExpenseForm, GoalForm, StatementForm, ExportJobForm, DismissNotificationForm, LogoutEverywhereForm
+
+UPCOMING_DAYS = 30
+STATEMENT_MONTHS = 24
+
+
+def expense_amounts(form):
+    """(amount_minor, home_amount_minor) for a validated ExpenseForm; may raise MissingRate."""
+    amount_minor = to_minor(form.amount.data)
+    home_amount_minor = convert_minor(amount_minor, form.currency.data, current_user.home_currency, form.date.data)
+    return amount_minor, home_amount_minor
+
+
+def dashboard_context(user_id):
+    """Template context for the dashboard, built from plain (cacheable) values."""
+    expenses = Expense.query.filter_by(user_id=user_id).order_by(Expense.date.desc()).limit(10).all()
+    
+    total_expenses, expense_count = rollups.user_totals(user_id)
+    category_totals = rollups.category_totals(user_id, limit=3)
+    
+    today = date.today()
+    upcoming_bills = [{
+        'bill_name': reminder.bill_name,
+        'date': occurrence,
+        'amount': reminder.amount,
+    } for occurrence, reminder in iter_due(Reminder, today, today + timedelta(days=7), user_id)]
+    
+    return dict(expenses=[{
+                    'id': expense.id,
+                    'date': expense.date,
+                    'category': expense.category,
+                    'description': expense.description,
+                    'amount': expense.amount,
+                    'currency': expense.currency,
+                } for expense in expenses],
+                total_expenses=total_expenses,
+                expense_count=expense_count,
+                category_totals=[tuple(row) for row in category_totals],
+                upcoming_bills=upcoming_bills)
+
+
+def analytics_context(user_id):
+    """Template context for the analytics page, built from plain (cacheable) values."""
+    category_data = rollups.category_totals(user_id)
+    
+    category_labels = [cat.capitalize() for cat, _ in category_data]
+    category_amounts = [float(amt) for _, amt in category_data]
+    
+    today = datetime.now().date()
+    six_months_ago = today - timedelta(days=180)
+    
+    monthly_data = rollups.monthly_totals(user_id, since=six_months_ago)
+    
+    monthly_labels = []
+    monthly_amounts = []
+    for year, month, amount in monthly_data:
+        month_name = datetime(int(year), int(month), 1).strftime('%b %Y')
+        monthly_labels.append(month_name)
+        monthly_amounts.append(float(amount))
+    
+    total_expenses, expense_count = rollups.user_totals(user_id)
+    avg_expense = total_expenses / expense_count if expense_count > 0 else 0
+    
+    this_month_total = rollups.month_total(user_id, today.year, today.month)
+    
+    from forecast import user_forecast  # NumPy is only loaded once analytics is used
+    forecast = user_forecast(user_id, today)
+    anomaly_ids = [item['id'] for item in forecast['anomalies']]
+    descriptions = dict(db.session.query(Expense.id, Expense.description).filter(Expense.id.in_(anomaly_ids)).all()) if anomaly_ids else {}
+    archived_ids = set(anomaly_ids) - descriptions.keys()
+    if archived_ids:
+        descriptions.update(db.session.query(ArchivedExpense.id, ArchivedExpense.description).filter(ArchivedExpense.id.in_(archived_ids)).all())
+    for item in forecast['anomalies']:
+        item['description'] = descriptions.get(item['id'])
+    
+    return dict(category_labels=json.dumps(category_labels),
+                category_amounts=json.dumps(category_amounts),
+                monthly_labels=json.dumps(monthly_labels),
+                monthly_amounts=json.dumps(monthly_amounts),
+                total_expenses=total_expenses,
+                expense_count=expense_count,
+                avg_expense=avg_expense,
+                this_month_total=this_month_total,
+                forecast=forecast)
+
+
+def statement_month_choices(today):
+    """(YYYY-MM, label) for the last STATEMENT_MONTHS complete months, newest first."""
+    choices = []
+    year, month = today.year, today.month
+    for _ in range(STATEMENT_MONTHS):
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        choices.append((f'{year}-{month:02d}', date(year, month, 1).strftime('%B %Y')))
+    return choices
 
 
 def register_routes(app):
     """Register all application routes with the Flask app instance."""
     
+    app.add_template_global(frequency_label)
+    app.add_template_filter(format_money, 'money')
+    # For the POST forms in base.html, which render without a form object
+    app.add_template_global(generate_csrf, 'csrf_token')
+    
     @app.route('/')
     def index():
         if current_user.is_authenticated:
@@ -30,6 +146,7 @@ def register_routes(app):
         if form.validate_on_submit():
             user = User(username=form.username.data, email=form.email.data)
             user.set_password(form.password.data)
+            place_user(user)
             db.session.add(user)
             db.session.commit()
             flash('Registration successful! Please log in.', 'success')
@@ -45,7 +162,7 @@ def register_routes(app):
         
         form = LoginForm()
         if form.validate_on_submit():
-            user = User.query.filter_by(email=form.email.data).first()
+            user = find_user(email=form.email.data)
             if user and user.check_password(form.password.data):
                 login_user(user)
                 next_page = request.args.get('next')
@@ -65,142 +182,126 @@ def register_routes(app):
         return redirect(url_for('index'))
 
 
+    @app.route('/logout/everywhere', methods=['POST'])
+    @login_required
+    def logout_everywhere():
+        if not LogoutEverywhereForm().validate_on_submit():
+            return redirect(url_for('dashboard'))
+        # Also ends the user's sessions on other devices and their remember-me cookies
+        end_sessions(current_user.id)
+        logout_user()
+        flash('You have been logged out on every device.', 'info')
+        return redirect(url_for('index'))
+
+
     @app.route('/dashboard')
     @login_required
+    @replica_reads
     def dashboard():
-        expenses = Expense.query.filter_by(user_id=current_user.id).order_by(Expense.date.desc()).limit(10).all()
-        
-        total_expenses = db.session.query(db.func.sum(Expense.amount)).filter_by(user_id=current_user.id).scalar() or 0
-        expense_count = Expense.query.filter_by(user_id=current_user.id).count()
-        
-        category_totals = db.session.query(
-            Expense.category,
-            db.func.sum(Expense.amount)
-        ).filter_by(user_id=current_user.id).group_by(Expense.category).order_by(db.func.sum(Expense.amount).desc()).limit(3).all()
-        
-        return render_template('dashboard.html', 
-                               expenses=expenses, 
-                               total_expenses=total_expenses,
-                               expense_count=expense_count,
-                               category_totals=category_totals)
+        user_id = current_user.id
+        # Upcoming bills depend on the date, so the cache entry rolls over daily
+        context = cached_for_user(f'dashboard:{date.today()}', user_id, lambda: dashboard_context(user_id))
+        # Read outside the cache so a dismissed notification disappears at once
+        notifications = unread_notifications(user_id)
+        return render_template('dashboard.html', notifications=notifications,
+                               dismiss_form=DismissNotificationForm(formdata=None), **context)
+
+
+    @app.route('/notifications/dismiss', methods=['POST'])
+    @login_required
+    def dismiss_notification():
+        form = DismissNotificationForm()
+        if form.validate_on_submit():
+            dismiss_notifications(current_user.id, form.notification_id.data)
+        return redirect(url_for('dashboard'))
 
 
     @app.route('/analytics')
     @login_required
+    @replica_reads
     def analytics():
-        
-        category_data = db.session.query(
-            Expense.category,
-            db.func.sum(Expense.amount)
-        ).filter_by(user_id=current_user.id).group_by(Expense.category).all()
-        
-        category_labels = [cat.capitalize() for cat, _ in category_data]
-        category_amounts = [float(amt) for _, amt in category_data]
-        
-        today = datetime.now().date()
-        six_months_ago = today - timedelta(days=180)
-        
-        monthly_data = db.session.query(
-            db.func.extract('year', Expense.date).label('year'),
-            db.func.extract('month', Expense.date).label('month'),
-            db.func.sum(Expense.amount)
-        ).filter(
-            Expense.user_id == current_user.id,
-            Expense.date >= six_months_ago
-        ).group_by('year', 'month').order_by('year', 'month').all()
-        
-        monthly_labels = []
-        monthly_amounts = []
-        for year, month, amount in monthly_data:
-            month_name = datetime(int(year), int(month), 1).strftime('%b %Y')
-            monthly_labels.append(month_name)
-            monthly_amounts.append(float(amount))
-        
-        total_expenses = db.session.query(db.func.sum(Expense.amount)).filter_by(user_id=current_user.id).scalar() or 0
-        expense_count = Expense.query.filter_by(user_id=current_user.id).count()
-        avg_expense = total_expenses / expense_count if expense_count > 0 else 0
-        
-        first_day_of_month = today.replace(day=1)
-        this_month_total = db.session.query(db.func.sum(Expense.amount)).filter(
-            Expense.user_id == current_user.id,
-            Expense.date >= first_day_of_month
-        ).scalar() or 0
-        
-        return render_template('analytics.html',
-                               category_labels=json.dumps(category_labels),
-                               category_amounts=json.dumps(category_amounts),
-                               monthly_labels=json.dumps(monthly_labels),
-                               monthly_amounts=json.dumps(monthly_amounts),
-                               total_expenses=total_expenses,
-                               expense_count=expense_count,
-                               avg_expense=avg_expense,
-                               this_month_total=this_month_total)
+        user_id = current_user.id
+        context = cached_for_user(f'analytics:{date.today()}', user_id, lambda: analytics_context(user_id))
+        return render_template('analytics.html', **context)
 
 
     @app.route('/expenses')
     @login_required
+    @replica_reads
     def expenses():
-        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', '')
         form = ExpenseFilterForm()
         
-        query = Expense.query.filter_by(user_id=current_user.id)
-        
-        category = request.args.get('category', '')
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
-        min_amount = request.args.get('min_amount', '')
-        max_amount = request.args.get('max_amount', '')
-        search = request.args.get('search', '')
-        
-        if category:
-            query = query.filter(Expense.category == category)
-            form.category.data = category
-        
-        if date_from:
-            try:
-                date_from_parsed = datetime.strptime(date_from, '%Y-%m-%d').date()
-                query = query.filter(Expense.date >= date_from_parsed)
-                form.date_from.data = date_from_parsed
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                date_to_parsed = datetime.strptime(date_to, '%Y-%m-%d').date()
-                query = query.filter(Expense.date <= date_to_parsed)
-                form.date_to.data = date_to_parsed
-            except ValueError:
-                pass
-        
-        if min_amount:
-            try:
-                min_val = float(min_amount)
-                query = query.filter(Expense.amount >= min_val)
-                form.min_amount.data = min_val
-            except ValueError:
-                pass
-        
-        if max_amount:
-            try:
-                max_val = float(max_amount)
-                query = query.filter(Expense.amount <= max_val)
-                form.max_amount.data = max_val
-            except ValueError:
-                pass
+        entity, query, filter_values = filtered_expenses(current_user.id, request.args)
+        for field_name, value in filter_values.items():
+            getattr(form, field_name).data = value
         
-        if search:
-            query = query.filter(Expense.description.ilike(f'%{search}%'))
-            form.search.data = search
+        has_filters = any(request.args.get(name) for name in FILTER_FIELDS)
+        # Unfiltered totals come for free from the rollup table; filtered
+        # totals need a COUNT(*) and are only computed when asked for (?count=1)
+        with_total = has_filters and request.args.get('count', type=int) == 1
         
+        sort_columns = (entity.date, entity.id)
         try:
-            expenses_paginated = query.order_by(Expense.date.desc()).paginate(page=page, per_page=10, error_out=False)
-        except Exception as e:
-            flash('Invalid page number.', 'warning')
-            expenses_paginated = query.order_by(Expense.date.desc()).paginate(page=1, per_page=10, error_out=False)
+            expenses_page = keyset_paginate(query, sort_columns, cursor=cursor, per_page=10, with_total=with_total)
+        except InvalidCursor:
+            flash('Invalid page cursor.', 'warning')
+            expenses_page = keyset_paginate(query, sort_columns, per_page=10, with_total=with_total)
         
-        has_filters = any([category, date_from, date_to, min_amount, max_amount, search])
+        if not has_filters:
+            expenses_page.total = rollups.user_totals(current_user.id)[1]
         
-        return render_template('expenses.html', expenses=expenses_paginated, form=form, has_filters=has_filters)
+        return render_template('expenses.html', expenses=expenses_page, form=form, has_filters=has_filters,
+                               bulk_form=BulkExpenseForm(formdata=None), export_form=ExportJobForm(formdata=None))
+
+
+    @app.route('/expenses/bulk', methods=['POST'])
+    @login_required
+    def bulk_expenses():
+        form = BulkExpenseForm()
+        filter_args = {name: request.form.get(name, '') for name in FILTER_FIELDS}
+        back = url_for('expenses', **{name: value for name, value in filter_args.items() if value})
+        
+        if not form.validate_on_submit():
+            for errors in form.errors.values():
+                flash(errors[0], 'danger')
+            return redirect(back)
+        
+        # Every selection is scoped to the current user inside the statement itself
+        if form.scope.data == 'filter':
+            conditions, _ = expense_filter_conditions(current_user.id, filter_args)
+            where = selection_conditions(current_user.id, conditions=conditions)
+        else:
+            ids = request.form.getlist('ids', type=int)
+            if not ids:
+                flash('Select at least one expense.', 'warning')
+                return redirect(back)
+            where = selection_conditions(current_user.id, ids=ids)
+        
+        if form.action.data == 'delete':
+            count = bulk_delete(current_user.id, where)
+            flash(f'Deleted {count} expense(s).', 'success')
+        elif form.action.data == 'recategorize':
+            count = bulk_recategorize(current_user.id, where, form.new_category.data)
+            flash(f'Moved {count} expense(s) to {form.new_category.data}.', 'success')
+        else:
+            try:
+                count = bulk_shift_dates(current_user.id, where, form.days.data, current_user.home_currency)
+            except MissingRate as error:
+                db.session.rollback()
+                flash(str(error), 'danger')
+            else:
+                flash(f'Shifted {count} expense(s) by {form.days.data} day(s).', 'success')
+        return redirect(back)
+
+
+    @app.route('/expenses/search')
+    @login_required
+    @replica_reads
+    def search_expenses():
+        term = request.args.get('q', '').strip()
+        results = ranked_search(current_user.id, term) if term else []
+        return jsonify(expenses=[expense_to_dict(expense) for expense in results])
 
 
     @app.route('/expense/add', methods=['GET', 'POST'])
@@ -208,20 +309,32 @@ def register_routes(app):
     def add_expense():
         form = ExpenseForm()
         if form.validate_on_submit():
-            expense = Expense(
-                amount=form.amount.data,
-                category=form.category.data,
-                date=form.date.data,
-                description=form.description.data,
-                user_id=current_user.id
-            )
-            db.session.add(expense)
-            db.session.commit()
-            flash('Expense added successfully!', 'success')
-            return redirect(url_for('expenses'))
+            try:
+                amount_minor, home_amount_minor = expense_amounts(form)
+            except MissingRate as error:
+                form.currency.errors.append(str(error))
+            else:
+                expense = Expense(
+                    amount_minor=amount_minor,
+                    currency=form.currency.data,
+                    home_amount_minor=home_amount_minor,
+                    category=form.category.data,
+                    date=form.date.data,
+                    description=form.description.data,
+                    user_id=current_user.id
+                )
+                db.session.add(expense)
+                rollups.record_expense(expense)
+                apply_budget_deltas(current_user.id, expense_spend(expense))
+                bump_data_version(current_user.id)
+                db.session.commit()
+                flash('Expense added successfully!', 'success')
+                return redirect(url_for('expenses'))
         
         if not form.date.data:
             form.date.data = date.today()
+        if not form.currency.data:
+            form.currency.data = current_user.home_currency
         
         return render_template('expense_form.html', form=form, title='Add Expense')
 
@@ -237,13 +350,26 @@ def register_routes(app):
         
         form = ExpenseForm(obj=expense)
         if form.validate_on_submit():
-            expense.amount = form.amount.data
-            expense.category = form.category.data
-            expense.date = form.date.data
-            expense.description = form.description.data
-            db.session.commit()
-            flash('Expense updated successfully!', 'success')
-            return redirect(url_for('expenses'))
+            try:
+                amount_minor, home_amount_minor = expense_amounts(form)
+            except MissingRate as error:
+                form.currency.errors.append(str(error))
+            else:
+                rollups.unrecord_expense(expense)
+                spend = Counter(expense_spend(expense, -1))
+                expense.amount_minor = amount_minor
+                expense.currency = form.currency.data
+                expense.home_amount_minor = home_amount_minor
+                expense.category = form.category.data
+                expense.date = form.date.data
+                expense.description = form.description.data
+                rollups.record_expense(expense)
+                spend.update(expense_spend(expense))
+                apply_budget_deltas(current_user.id, spend)
+                bump_data_version(current_user.id)
+                db.session.commit()
+                flash('Expense updated successfully!', 'success')
+                return redirect(url_for('expenses'))
         
         return render_template('expense_form.html', form=form, title='Edit Expense')
 
@@ -257,125 +383,148 @@ def register_routes(app):
             flash('You do not have permission to delete this expense.', 'danger')
             return redirect(url_for('expenses'))
         
+        rollups.unrecord_expense(expense)
+        apply_budget_deltas(current_user.id, expense_spend(expense, -1))
         db.session.delete(expense)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Expense deleted successfully!', 'success')
         return redirect(url_for('expenses'))
 
 
-    @app.route('/export/csv')
+    @app.route('/expenses/import', methods=['GET', 'POST'])
     @login_required
-    def export_csv():
-        
-        query = Expense.query.filter_by(user_id=current_user.id)
-        
-        category = request.args.get('category', '')
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
-        min_amount = request.args.get('min_amount', '')
-        max_amount = request.args.get('max_amount', '')
-        search = request.args.get('search', '')
-        
-        if category:
-            query = query.filter(Expense.category == category)
-        
-        if date_from:
-            try:
-                date_from_parsed = datetime.strptime(date_from, '%Y-%m-%d').date()
-                query = query.filter(Expense.date >= date_from_parsed)
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                date_to_parsed = datetime.strptime(date_to, '%Y-%m-%d').date()
-                query = query.filter(Expense.date <= date_to_parsed)
-            except ValueError:
-                pass
+    def import_expenses_view():
+        form = ImportForm()
+        result = None
         
-        if min_amount:
-            try:
-                min_val = float(min_amount)
-                query = query.filter(Expense.amount >= min_val)
-            except ValueError:
-                pass
-        
-        if max_amount:
-            try:
-                max_val = float(max_amount)
-                query = query.filter(Expense.amount <= max_val)
-            except ValueError:
-                pass
-        
-        if search:
-            query = query.filter(Expense.description.ilike(f'%{search}%'))
-        
-        expenses = query.order_by(Expense.date.desc()).all()
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        writer.writerow(['Date', 'Category', 'Amount', 'Description'])
+        if form.validate_on_submit():
+            upload = form.file.data
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+            if upload.filename.lower().endswith(('.ofx', '.qfx')):
+                rows = parse_ofx(stream)
+            else:
+                rows = parse_csv(stream)
+            
+            result = import_expenses(current_user.id, rows, skip_duplicates=form.skip_duplicates.data)
+            flash(f'Imported {result.inserted} expenses.', 'success' if result.inserted else 'info')
         
-        for expense in expenses:
-            writer.writerow([
-                expense.date.strftime('%Y-%m-%d'),
-                expense.category.capitalize(),
-                f'{expense.amount:.2f}',
-                expense.description or ''
-            ])
+        return render_template('import_form.html', form=form, result=result)
+
+
+    @app.route('/export/csv')
+    @login_required
+    @replica_reads
+    def export_csv():
+        conditions, filter_values = expense_filter_conditions(current_user.id, request.args)
+        compress = request.args.get('gzip', type=int) == 1
         
-        output.seek(0)
+        rows = export_rows(current_user.id, conditions, archived_filter_conditions(current_user.id, request.args, filter_values))
+        filename = f'expenses_{date.today().strftime("%Y%m%d")}.csv'
+        if compress:
+            filename += '.gz'
         
         return Response(
-            output.getvalue(),
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=expenses_{date.today().strftime("%Y%m%d")}.csv'}
+            stream_with_context(iter_csv(rows, compress=compress)),
+            mimetype='application/gzip' if compress else 'text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
 
 
+    def queue_report(kind, params):
+        try:
+            enqueue_job(current_user.id, kind, params)
+        except JobLimitReached as exc:
+            flash(str(exc), 'danger')
+        else:
+            flash('Your report is being prepared. It will appear below when ready.', 'success')
+        return redirect(url_for('reports'))
+
+
+    @app.route('/reports')
+    @login_required
+    def reports():
+        form = StatementForm()
+        form.month.choices = statement_month_choices(date.today())
+        jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc(), Job.id.desc()).limit(20).all()
+        return render_template('reports.html', jobs=jobs, form=form, export_form=ExportJobForm())
+
+
+    @app.route('/reports/statement', methods=['POST'])
+    @login_required
+    def queue_statement():
+        form = StatementForm()
+        form.month.choices = statement_month_choices(date.today())
+        if not form.validate_on_submit():
+            flash('Choose a month to generate a statement for.', 'danger')
+            return redirect(url_for('reports'))
+        year, month = map(int, form.month.data.split('-'))
+        return queue_report('statement', {'year': year, 'month': month, 'format': form.format.data})
+
+
+    @app.route('/reports/export', methods=['POST'])
+    @login_required
+    def queue_export():
+        form = ExportJobForm()
+        if not form.validate_on_submit():
+            flash('Could not queue the export; please try again.', 'danger')
+            return redirect(url_for('expenses'))
+        # The filters come from the expenses page URL, as for /export/csv
+        params = {field: request.args[field] for field in FILTER_FIELDS if request.args.get(field)}
+        if form.gzip.data:
+            params['gzip'] = 1
+        return queue_report('export_csv', params)
+
+
+    @app.route('/reports/<int:id>/status')
+    @login_required
+    def report_status(id):
+        job = Job.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+        return jsonify(job_to_dict(job))
+
+
+    @app.route('/reports/<int:id>/download')
+    @login_required
+    def download_report(id):
+        job = Job.query.filter_by(id=id, user_id=current_user.id, status=JOB_DONE).first_or_404()
+        return send_file(result_path(job.id), mimetype=job.mimetype, as_attachment=True,
+                         download_name=job.result_name)
+
+
     @app.route('/budgets', methods=['GET', 'POST'])
     @login_required
+    @replica_reads
     def budgets():
         form = BudgetForm()
         
         if form.validate_on_submit():
             budget = Budget(
                 category=form.category.data,
-                limit_amount=form.limit_amount.data,
+                limit_minor=to_minor(form.limit_amount.data),
+                currency=current_user.home_currency,
                 start_date=form.start_date.data,
                 end_date=form.end_date.data,
                 user_id=current_user.id
             )
             db.session.add(budget)
+            track_budget(budget)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('Budget created successfully!', 'success')
             return redirect(url_for('budgets'))
         
-        user_budgets = Budget.query.filter_by(user_id=current_user.id).order_by(Budget.start_date.desc()).all()
-        
-        budgets_data = []
-        
-        for budget in user_budgets:
-            spent_amount = db.session.query(func.sum(Expense.amount)).filter(
-                Expense.user_id == current_user.id,
-                Expense.category == budget.category,
-                Expense.date >= budget.start_date,
-                Expense.date <= budget.end_date
-            ).scalar() or 0.0
-            
-            remaining = budget.limit_amount - spent_amount
-            
-            budgets_data.append({
-                'budget': budget,
-                'spent': spent_amount,
-                'remaining': remaining,
-                'progress_percent': min(100, (spent_amount / budget.limit_amount) * 100) if budget.limit_amount > 0 else 0
-            })
+        budgets_data = evaluate_budgets(current_user.id)
         
         return render_template('budgets.html', budgets_data=budgets_data, form=form)
 
 
+    @app.route('/budgets/status')
+    @login_required
+    def budgets_status():
+        budgets_data = evaluate_budgets(current_user.id)
+        return jsonify(budgets=[budget_status_to_dict(item) for item in budgets_data])
+
+
     @app.route('/budget/delete/<int:id>', methods=['POST'])
     @login_required
     def delete_budget(id):
@@ -386,6 +535,7 @@ def register_routes(app):
             return redirect(url_for('budgets'))
         
         db.session.delete(budget)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Budget deleted successfully!', 'success')
         return redirect(url_for('budgets'))
@@ -401,16 +551,24 @@ def register_routes(app):
                 bill_name=form.bill_name.data,
                 due_date=form.due_date.data,
                 amount=form.amount.data,
+                frequency=form.frequency.data or None,
+                repeat_interval=form.repeat_interval.data,
+                end_date=form.end_date.data,
                 user_id=current_user.id
             )
+            reminder.next_due = initial_next_due(reminder)
             db.session.add(reminder)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('Reminder added successfully!', 'success')
             return redirect(url_for('reminders'))
         
         user_reminders = Reminder.query.filter_by(user_id=current_user.id).order_by(Reminder.due_date.asc()).all()
+        today = date.today()
+        upcoming = list(iter_due(Reminder, today, today + timedelta(days=UPCOMING_DAYS), current_user.id))
         
-        return render_template('reminders.html', reminders=user_reminders, form=form)
+        return render_template('reminders.html', reminders=user_reminders, upcoming=upcoming,
+                               upcoming_days=UPCOMING_DAYS, form=form)
 
 
     @app.route('/reminder/delete/<int:id>', methods=['POST'])
@@ -423,11 +581,63 @@ def register_routes(app):
             return redirect(url_for('reminders'))
         
         db.session.delete(reminder)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Reminder deleted successfully!', 'success')
         return redirect(url_for('reminders'))
 
 
+    @app.route('/recurring', methods=['GET', 'POST'])
+    @login_required
+    def recurring_expenses():
+        form = RecurringExpenseForm()
+        
+        if form.validate_on_submit():
+            template = RecurringExpense(
+                amount_minor=to_minor(form.amount.data),
+                currency=form.currency.data,
+                category=form.category.data,
+                description=form.description.data,
+                frequency=form.frequency.data,
+                repeat_interval=form.repeat_interval.data,
+                start_date=form.start_date.data,
+                end_date=form.end_date.data,
+                user_id=current_user.id
+            )
+            template.next_due = initial_next_due(template)
+            db.session.add(template)
+            bump_data_version(current_user.id)
+            db.session.commit()
+            flash('Recurring expense added. Expenses are created as each date arrives.', 'success')
+            return redirect(url_for('recurring_expenses'))
+        
+        if not form.currency.data:
+            form.currency.data = current_user.home_currency
+        
+        templates = RecurringExpense.query.filter_by(user_id=current_user.id).order_by(RecurringExpense.next_due.asc()).all()
+        today = date.today()
+        upcoming = list(iter_due(RecurringExpense, today, today + timedelta(days=UPCOMING_DAYS), current_user.id))
+        
+        return render_template('recurring.html', templates=templates, upcoming=upcoming,
+                               upcoming_days=UPCOMING_DAYS, form=form)
+
+
+    @app.route('/recurring/delete/<int:id>', methods=['POST'])
+    @login_required
+    def delete_recurring_expense(id):
+        template = RecurringExpense.query.get_or_404(id)
+        
+        if template.user_id != current_user.id:
+            flash('You do not have permission to delete this recurring expense.', 'danger')
+            return redirect(url_for('recurring_expenses'))
+        
+        db.session.delete(template)
+        bump_data_version(current_user.id)
+        db.session.commit()
+        flash('Recurring expense deleted. Expenses already created are kept.', 'success')
+        return redirect(url_for('recurring_expenses'))
+
+
     @app.route('/goals', methods=['GET', 'POST'])
     @login_required
     def goals():
@@ -436,16 +646,21 @@ def register_routes(app):
         if form.validate_on_submit():
             goal = Goal(
                 name=form.name.data,
-                target_amount=form.target_amount.data,
-                current_amount=form.current_amount.data,
+                target_minor=to_minor(form.target_amount.data),
+                current_minor=to_minor(form.current_amount.data),
+                currency=form.currency.data,
                 due_date=form.due_date.data,
                 user_id=current_user.id
             )
             db.session.add(goal)
+            bump_data_version(current_user.id)
             db.session.commit()
             flash('Goal created successfully!', 'success')
             return redirect(url_for('goals'))
         
+        if not form.currency.data:
+            form.currency.data = current_user.home_currency
+        
         user_goals = Goal.query.filter_by(user_id=current_user.id).order_by(Goal.due_date.asc()).all()
         
         goals_data = []
@@ -470,6 +685,7 @@ def register_routes(app):
             return redirect(url_for('goals'))
         
         db.session.delete(goal)
+        bump_data_version(current_user.id)
         db.session.commit()
         flash('Goal deleted successfully!', 'success')
         return redirect(url_for('goals'))
@@ -0,0 +1,213 @@
+"""Full-text search over expense descriptions.
+
+SQLite gets an external-content FTS5 table kept in sync by triggers on the
+expense table. Besides the description it indexes an owner token ("u<user
+id>"), so a match only walks the searching user's rows rather than every
+user's matches; its content comes from the expense_fts_source view. PostgreSQL gets a GIN index over to_tsvector(description),
+which the database maintains itself. Search terms are split into words and
+each word is prefix-matched, so "gro" finds "Groceries". When neither index
+is available the search falls back to the old ILIKE substring match.
+"""
+import logging
+import re
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import column, literal_column, table, text
+from sqlalchemy.exc import DBAPIError
+
+from app import db
+from archive import reaches_archive
+from models import ArchivedExpense, Expense
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'expense_fts'
+FTS_SOURCE = 'expense_fts_source'
+
+_SQLITE_SETUP = [
+    f"""CREATE VIEW IF NOT EXISTS {FTS_SOURCE} AS
+        SELECT id, description, 'u' || user_id AS owner FROM expense""",
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        description, owner, content='{FTS_SOURCE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, owner) VALUES (new.id, new.description, 'u' || new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, owner)
+        VALUES ('delete', old.id, old.description, 'u' || old.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF description, user_id ON expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, owner)
+        VALUES ('delete', old.id, old.description, 'u' || old.user_id);
+        INSERT INTO {FTS_TABLE}(rowid, description, owner) VALUES (new.id, new.description, 'u' || new.user_id);
+    END""",
+]
+# Tables created before the owner column are dropped and rebuilt by `flask init-db`
+_SQLITE_TEARDOWN = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+_POSTGRES_SETUP = [
+    """CREATE INDEX IF NOT EXISTS ix_expense_description_fts
+       ON expense USING GIN (to_tsvector('simple', coalesce(description, '')))""",
+]
+
+_fts_table = table(FTS_TABLE, column('rowid'))
+
+
+def setup_search_index(app, create=True):
+    """Create the FTS index for the current backend and record whether it is usable.
+
+    With create=False (production boots) the index is only looked up, so a
+    worker never runs DDL; `flask init-db` creates it.
+    """
+    from shards import data_engines
+    engines = data_engines()  # every shard carries its own expense table
+    backend = engines[0].dialect.name
+    app.extensions['expense_search'] = None
+    if backend not in ('sqlite', 'postgresql'):
+        return
+
+    try:
+        found = []
+        for engine in engines:
+            with engine.begin() as conn:
+                if backend == 'sqlite':
+                    sql = conn.execute(
+                        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                        {'name': FTS_TABLE},
+                    ).scalar()
+                    exists = sql is not None and 'owner' in sql
+                    if not create:
+                        statements = []
+                    elif exists:
+                        statements = _SQLITE_SETUP[:1] + _SQLITE_SETUP[2:]
+                    else:
+                        statements = _SQLITE_TEARDOWN + _SQLITE_SETUP + [
+                            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+                        ]
+                else:
+                    exists = conn.execute(
+                        text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                        {'name': 'ix_expense_description_fts'},
+                    ).first()
+                    statements = _POSTGRES_SETUP if create else []
+                for statement in statements:
+                    conn.execute(text(statement))
+            found.append(exists)
+    except DBAPIError:
+        logger.warning('Full-text search index unavailable; falling back to ILIKE search', exc_info=True)
+        return
+
+    if create or all(found):
+        app.extensions['expense_search'] = backend
+
+
+@contextmanager
+def deferred_indexing(connection):
+    """Index expenses inserted inside the block with one statement per id range, not a trigger per row.
+
+    Yields a list to append the (first id, last id) ranges of the inserted
+    rows to. Only SQLite's FTS table needs this; elsewhere it does nothing.
+    The insert trigger is dropped for the block and recreated when it
+    ends, also when it fails. The transaction is opened with BEGIN before
+    the drop, since pysqlite would otherwise run the DDL in autocommit
+    mode: the drop then holds the write lock until commit, so other writers
+    wait rather than insert unindexed rows, and a rollback restores the
+    trigger.
+    """
+    if current_app.extensions.get('expense_search') != 'sqlite':
+        yield []
+        return
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+    connection.execute(text(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai'))
+    ranges = []
+    try:
+        yield ranges
+        for first_id, last_id in ranges:
+            connection.execute(text(
+                f"INSERT INTO {FTS_TABLE}(rowid, description, owner) "
+                f"SELECT id, description, 'u' || user_id FROM expense WHERE id BETWEEN :first_id AND :last_id"
+            ), {'first_id': first_id, 'last_id': last_id})
+    finally:
+        connection.execute(text(_SQLITE_SETUP[2]))
+
+
+def rebuild_search_index():
+    """Re-index every description (only needed for the SQLite FTS5 table)."""
+    if current_app.extensions.get('expense_search') == 'sqlite':
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"),
+                           bind_arguments={'mapper': Expense})
+        db.session.commit()
+
+
+def _search_words(term):
+    return re.findall(r'\w+', term.lower())
+
+
+def _tsvector(entity=Expense):
+    return db.func.to_tsvector(literal_column("'simple'"), db.func.coalesce(entity.description, ''))
+
+
+def _tsquery(words):
+    return db.func.to_tsquery(literal_column("'simple'"), ' & '.join(f'{word}:*' for word in words))
+
+
+def _fts5_match(user_id, words):
+    query = f'owner:"u{int(user_id)}" ' + ' '.join(f'description:"{word}"*' for word in words)
+    return text(f'{FTS_TABLE} MATCH :fts_query').bindparams(fts_query=query)
+
+
+def description_search_condition(term, user_id, entity=Expense):
+    """Return a WHERE clause matching the user's expenses whose description matches `term`.
+
+    `entity` may be ArchivedExpense; the SQLite FTS table only covers the
+    hot expense table, so archived rows fall back to ILIKE there.
+    """
+    backend = current_app.extensions.get('expense_search')
+    words = _search_words(term)
+
+    if backend == 'sqlite' and words and entity is Expense:
+        # The owner token keeps the match to this user's rows, however common the words
+        matching_ids = db.select(_fts_table.c.rowid).where(_fts5_match(user_id, words))
+        return Expense.id.in_(matching_ids)
+    if backend == 'postgresql' and words:
+        return _tsvector(entity).op('@@')(_tsquery(words))
+    return entity.description.ilike(f'%{term}%')
+
+
+def ranked_search(user_id, term, limit=20):
+    """Return the user's expenses matching `term`, most relevant first.
+
+    Archived expenses (newest first) only fill up a result that has fewer
+    than `limit` matches in the hot table.
+    """
+    backend = current_app.extensions.get('expense_search')
+    words = _search_words(term)
+    query = Expense.query.filter(Expense.user_id == user_id)
+
+    if backend == 'sqlite' and words:
+        query = query.join(_fts_table, _fts_table.c.rowid == Expense.id).filter(
+            _fts5_match(user_id, words)
+        ).order_by(text(f'bm25({FTS_TABLE})'))
+    elif backend == 'postgresql' and words:
+        query = query.filter(_tsvector().op('@@')(_tsquery(words))).order_by(
+            db.func.ts_rank(_tsvector(), _tsquery(words)).desc()
+        )
+    else:
+        query = query.filter(Expense.description.ilike(f'%{term}%'))
+
+    results = query.order_by(Expense.date.desc(), Expense.id.desc()).limit(limit).all()
+    if len(results) < limit and reaches_archive(None):
+        results += ArchivedExpense.query.filter(
+            ArchivedExpense.user_id == user_id,
+            description_search_condition(term, user_id, ArchivedExpense),
+        ).order_by(ArchivedExpense.date.desc(), ArchivedExpense.id.desc()).limit(limit - len(results)).all()
+    return results
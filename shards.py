@@ -0,0 +1,479 @@
+"""Horizontal sharding of user data by user_id.
+
+DATABASE_SHARD_URLS (comma separated) adds one bind per shard, named
+shard_0, shard_1, ... in list order; only ever append to the list.
+DATABASE_URL then becomes the directory database. It holds the tables
+every user shares (GLOBAL_TABLES), among them shard_directory, which
+records the shard each user lives on. Every other table lives on the
+owning user's shard, so one user's queries and transactions touch a single
+shard. Without DATABASE_SHARD_URLS everything stays in DATABASE_URL.
+
+New users are placed by a consistent hash ring with SHARD_VNODES points
+per shard, so a new shard takes over only about 1/N of the ring. After
+registration the directory entry is authoritative, which is what lets a
+user be moved.
+
+RoutingSession.get_bind() sends statements on sharded tables to the shard
+selected in session.info. The user loader selects the logged-in user's
+shard on every request; login and registration select it themselves; CLI
+commands visit each_shard(); the job runner selects each job's shard. A
+statement on a sharded table with no shard selected raises NoShardSelected
+rather than guessing.
+
+Auto-increment ids on shard N start after N * SHARD_ID_SPAN. That way rows
+keep their ids when their owner moves, and sync cursors, URLs and report
+files stay valid. PostgreSQL sequences ignore explicitly inserted ids.
+SQLite numbers new rows after the highest id in a table, so a user moved to
+a lower-numbered shard pulls that shard's new ids into the source's range,
+where they can repeat ids the source has already given out. A move refuses
+to overwrite a row with the same id, so use SQLite shards for development
+only.
+
+`flask move-user` works online:
+
+1. The directory entry is marked moving and the mover waits
+   SHARD_DIRECTORY_TTL, so every process sees the mark. From then on the
+   user's writes are refused with a 503 while reads still come from the
+   source.
+2. Every row is copied in one source and one destination transaction, and
+   the row counts are compared.
+3. Once both have ended, the entry is pointed at the destination. After
+   another wait, the source rows are deleted, unless the user's
+   data_version there changed since the copy; that means a write slipped
+   past the guard, and the rows are kept for inspection.
+
+The mover reads and writes the directory on connections of its own, never
+through db.session, so it neither sees nor flushes whatever a request
+handled in the same application context left in the session.
+
+If a move is interrupted before the switch, the user stays marked as
+moving; running it again clears whatever reached the destination and
+copies from scratch. Rows left on the old shard after the switch are never
+read, and are cleared if the user ever moves back.
+`flask rebalance-shards` moves users whose directory shard differs from the
+ring's choice: after adding a shard, or with --exclude to drain one.
+"""
+import bisect
+import hashlib
+import logging
+import time
+
+from flask import current_app, jsonify, request
+from sqlalchemy import MetaData, delete, event, func, insert, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.util import find_tables
+
+from app import db
+from cache import LRUCache
+from db_routing import SHARD_PREFIX, RoutingSession
+from models import ShardDirectory, User
+
+logger = logging.getLogger(__name__)
+
+# Kept in the directory database; every other table lives on the owner's shard
+GLOBAL_TABLES = frozenset({'shard_directory', 'exchange_rate', 'archive_state'})
+MOVE_BATCH_SIZE = 1000
+_SHARD = 'shard'
+_READ_ONLY = 'shard_read_only'
+
+
+class NoShardSelected(RuntimeError):
+    """A statement on a sharded table ran before the session selected a shard."""
+
+
+class UserMoving(Exception):
+    """The user is being moved to another shard; their writes are refused until it finishes."""
+
+
+class MoveConflict(Exception):
+    """A move stopped before it could lose data; see the message for what was kept."""
+
+
+def _point(value):
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring mapping user ids to shard keys."""
+
+    def __init__(self, shards, vnodes=64):
+        points = sorted((_point(f'{shard}#{index}'), shard) for shard in shards for index in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id):
+        index = bisect.bisect(self.points, _point(str(user_id))) % len(self.points)
+        return self.shards[index]
+
+
+def shard_number(key):
+    return int(key[len(SHARD_PREFIX):])
+
+
+class ShardRouter:
+    """The shard binds, the placement ring and a TTL'd cache of directory entries."""
+
+    def __init__(self, keys, vnodes=64, ttl=5, max_entries=65536):
+        self.keys = sorted(keys, key=shard_number)
+        self.ring = HashRing(self.keys, vnodes)
+        self.ttl = ttl
+        self.directory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def engine_for(self, session, mapper, clause):
+        """The shard engine for a statement, or None to leave it to the directory database."""
+        if mapper is not None:
+            tables = [inspect(mapper).local_table]
+        elif clause is not None:
+            tables = find_tables(clause, include_crud=True)
+        else:
+            tables = []
+        if tables and all(table.name in GLOBAL_TABLES for table in tables):
+            return None
+        key = session.info.get(_SHARD)
+        if key is None:
+            if not tables:
+                return None  # e.g. SELECT 1
+            raise NoShardSelected(f'No shard selected for a statement on {", ".join(sorted({t.name for t in tables}))}')
+        return db.engines[key]
+
+    def lookup(self, user_id):
+        """(shard, moving_to) from the user's directory entry, or None when there is none."""
+        entry = self.directory.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        row = db.session.execute(
+            select(ShardDirectory.shard, ShardDirectory.moving_to).where(ShardDirectory.user_id == user_id)
+        ).first()
+        if row is None:
+            return None
+        entry = (row.shard, row.moving_to)
+        self.directory.set(user_id, entry)
+        return entry
+
+    def forget(self, user_id):
+        self.directory.delete(user_id)
+
+    def metrics_lines(self):
+        return [
+            '# HELP app_shard_directory_hits_total Shard directory lookups served from the cache.',
+            '# TYPE app_shard_directory_hits_total counter',
+            f'app_shard_directory_hits_total {self.hits}',
+            '# HELP app_shard_directory_misses_total Shard directory lookups that queried the directory database.',
+            '# TYPE app_shard_directory_misses_total counter',
+            f'app_shard_directory_misses_total {self.misses}',
+        ]
+
+
+def _user_moving(error):
+    # Drop the refused write, so later statements in this session do not flush it again
+    db.session.rollback()
+    message = 'Your account is being moved to another server. Please try again in a minute.'
+    headers = {'Retry-After': str(current_app.config['SHARD_DIRECTORY_TTL'] * 2)}
+    if request.blueprint == 'api':
+        return jsonify(error=message), 503, headers
+    return message, 503, headers
+
+
+def init_sharding(app):
+    app.config.setdefault('SHARD_VNODES', 64)
+    app.config.setdefault('SHARD_ID_SPAN', 100_000_000)
+    app.config.setdefault('SHARD_DIRECTORY_TTL', 5)
+    app.register_error_handler(UserMoving, _user_moving)
+    keys = [key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(SHARD_PREFIX)]
+    if not keys:
+        return None
+    app.extensions['shard_router'] = ShardRouter(keys, app.config['SHARD_VNODES'], app.config['SHARD_DIRECTORY_TTL'])
+    return app.extensions['shard_router']
+
+
+def _router():
+    return current_app.extensions.get('shard_router')
+
+
+def use_shard(key, read_only=False):
+    """Send the session's statements on sharded tables to `key` (None: no shard)."""
+    db.session.info[_SHARD] = key
+    db.session.info[_READ_ONLY] = read_only
+
+
+def select_user_shard(user_id):
+    """Route the session to the user's shard; False when the directory has no such user.
+
+    While the user is being moved, the session refuses writes with UserMoving.
+    """
+    router = _router()
+    if router is None:
+        return True
+    entry = router.lookup(user_id)
+    if entry is None:
+        return False
+    shard, moving_to = entry
+    use_shard(shard, read_only=moving_to is not None)
+    return True
+
+
+def each_shard():
+    """Yield each shard key with the session routed to it (None, once, without sharding).
+
+    The session is closed between shards, so commit inside the loop.
+    """
+    router = _router()
+    if router is None:
+        yield None
+        return
+    try:
+        for key in router.keys:
+            db.session.close()
+            use_shard(key)
+            yield key
+    finally:
+        db.session.close()
+        use_shard(None)
+
+
+def data_engines():
+    """Engines holding user data: every shard, or the primary without sharding."""
+    router = _router()
+    if router is None:
+        return [db.engine]
+    return [db.engines[key] for key in router.keys]
+
+
+def find_user(email=None, username=None):
+    """The User with this email or username, with the session routed to their shard; None if unknown."""
+    criteria = {name: value for name, value in (('email', email), ('username', username)) if value is not None}
+    if _router() is None:
+        return User.query.filter_by(**criteria).first()
+    entry = ShardDirectory.query.filter_by(**criteria).first()
+    if entry is None or not select_user_shard(entry.user_id):
+        return None
+    return db.session.get(User, entry.user_id)
+
+
+def place_user(user):
+    """Give a new, unsaved User its id and shard from the directory (no-op without sharding)."""
+    router = _router()
+    if router is None:
+        return
+    entry = ShardDirectory(shard='', username=user.username, email=user.email)
+    db.session.add(entry)
+    db.session.flush()
+    entry.shard = router.ring.shard_for(entry.user_id)
+    user.id = entry.user_id
+    use_shard(entry.shard)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _refuse_flush_while_moving(session, flush_context, instances):
+    if session.info.get(_READ_ONLY) and (session.new or session.dirty or session.deleted):
+        raise UserMoving()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _refuse_writes_while_moving(orm_execute_state):
+    if orm_execute_state.session.info.get(_READ_ONLY) and (
+        orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete
+    ):
+        raise UserMoving()
+
+
+def sharded_tables():
+    """Tables that live on the shards, parents before children."""
+    return [table for table in db.metadata.sorted_tables if table.name not in GLOBAL_TABLES]
+
+
+def _start_ids_at(connection, tables, base):
+    for table in tables:
+        column = table.autoincrement_column
+        if column is None:
+            continue
+        if connection.dialect.name == 'sqlite':
+            connection.execute(text(
+                'INSERT INTO sqlite_sequence (name, seq) SELECT :name, :base '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)'
+            ), {'name': table.name, 'base': base})
+        elif connection.dialect.name == 'postgresql':
+            sequence = connection.execute(text('SELECT pg_get_serial_sequence(:table, :column)'), {
+                'table': connection.dialect.identifier_preparer.format_table(table), 'column': column.name,
+            }).scalar()
+            if sequence and connection.execute(text(f'SELECT last_value FROM {sequence}')).scalar() < base:
+                connection.execute(text('SELECT setval(:sequence, :base)'), {'sequence': sequence, 'base': base})
+
+
+def create_schema():
+    """Create missing tables: every table without sharding, else the global ones plus each shard's.
+
+    Replica binds are left alone: they get their schema by replication, and
+    an unreachable replica must not stop the app from booting.
+    """
+    router = _router()
+    if router is None:
+        db.create_all(bind_key=None)
+        return
+    db.metadata.create_all(db.engine, tables=[table for table in db.metadata.sorted_tables if table.name in GLOBAL_TABLES])
+    # Copies, so the shard-only DDL options do not leak into the models' metadata
+    shard_metadata = MetaData()
+    tables = [table.to_metadata(shard_metadata) for table in sharded_tables()]
+    for table in tables:
+        if table.autoincrement_column is not None:
+            # SQLite only keeps a starting id for AUTOINCREMENT tables
+            table.dialect_kwargs['sqlite_autoincrement'] = True
+    span = current_app.config['SHARD_ID_SPAN']
+    for key in router.keys:
+        engine = db.engines[key]
+        shard_metadata.create_all(engine)
+        if shard_number(key):
+            with engine.begin() as connection:
+                _start_ids_at(connection, tables, shard_number(key) * span)
+
+
+def _owner_filter(table, user_id):
+    if table.name == User.__tablename__:
+        return table.c.id == user_id
+    if 'user_id' in table.c:
+        return table.c.user_id == user_id
+    for foreign_key in table.foreign_keys:
+        parent = foreign_key.column.table
+        if 'user_id' in parent.c:
+            return foreign_key.parent.in_(select(foreign_key.column).where(parent.c.user_id == user_id))
+    raise ValueError(f'Cannot tell which user owns the rows of {table.name}')
+
+
+def _delete_rows(connection, user_id):
+    for table in reversed(sharded_tables()):
+        connection.execute(delete(table).where(_owner_filter(table, user_id)))
+
+
+def _copy_rows(source, target, user_id):
+    """Copy every row the user owns; return {table name: rows copied}."""
+    copied = {}
+    for table in sharded_tables():
+        query = select(table).where(_owner_filter(table, user_id)).order_by(*table.primary_key.columns)
+        copied[table.name] = 0
+        for rows in source.execute(query.execution_options(stream_results=True)).mappings().partitions(MOVE_BATCH_SIZE):
+            target.execute(insert(table), [dict(row) for row in rows])
+            copied[table.name] += len(rows)
+    return copied
+
+
+def _count_rows(connection, user_id):
+    return {
+        table.name: connection.execute(select(func.count()).select_from(table).where(_owner_filter(table, user_id))).scalar()
+        for table in sharded_tables()
+    }
+
+
+def _data_version(connection, user_id):
+    users = User.__table__
+    return connection.execute(
+        select(users.c.data_version).where(users.c.id == user_id).with_for_update()
+    ).scalar()
+
+
+def _directory_entry(user_id):
+    with db.engine.connect() as directory:
+        return directory.execute(
+            select(ShardDirectory.shard, ShardDirectory.moving_to).where(ShardDirectory.user_id == user_id)
+        ).first()
+
+
+def _set_directory(user_id, **values):
+    """Update the user's directory entry in a transaction of its own."""
+    with db.engine.begin() as directory:
+        directory.execute(update(ShardDirectory).where(ShardDirectory.user_id == user_id).values(**values))
+    _router().forget(user_id)
+
+
+def _copy_user(user_id, source, target):
+    """Copy a user to `target` and point the directory there; return (rows copied, source data_version)."""
+    with db.engines[source].connect() as src:
+        if src.dialect.name == 'postgresql':
+            # One snapshot for every table, so rows archived mid-copy are not copied twice
+            src.execution_options(isolation_level='REPEATABLE READ')
+        with src.begin():
+            # Locks the user row, so a write that was in flight when the mark went up finishes before the copy
+            version = _data_version(src, user_id)
+            try:
+                with db.engines[target].begin() as dst:
+                    _delete_rows(dst, user_id)
+                    copied = _copy_rows(src, dst, user_id)
+                    counts = _count_rows(dst, user_id)
+                    if counts != copied:
+                        raise MoveConflict(f'User {user_id}: copied {copied} but {target} holds {counts}')
+            except IntegrityError as exc:
+                raise MoveConflict(f'User {user_id}: an id already exists on {target}') from exc
+    # Later writes are refused by the moving mark; one that slips through changes data_version, which is checked before the source rows go
+    _set_directory(user_id, shard=target, moving_to=None)
+    return sum(copied.values()), version
+
+
+def move_users(moves, sleep=time.sleep):
+    """Move users to other shards while the app keeps serving; return {user_id: rows moved or None}.
+
+    `moves` is [(user_id, target shard)]. A batch is marked moving
+    together, so the directory TTL is waited out twice per batch rather
+    than per user. A user whose move failed maps to None; the reason is
+    logged.
+    """
+    router = _router()
+    if router is None:
+        raise ValueError('Sharding is not configured (DATABASE_SHARD_URLS is empty).')
+    results, sources = {}, {}
+    for user_id, target in moves:
+        if target not in router.keys:
+            raise ValueError(f'Unknown shard {target!r}; expected one of {", ".join(router.keys)}.')
+        entry = _directory_entry(user_id)
+        if entry is None:
+            raise ValueError(f'User {user_id} is not in the shard directory.')
+        if entry.shard == target:
+            results[user_id] = 0
+            continue
+        sources[user_id] = entry.shard
+        _set_directory(user_id, moving_to=target)
+    if not sources:
+        return results
+    sleep(router.ttl)
+
+    copied = {}
+    for user_id, target in moves:
+        if user_id not in sources:
+            continue
+        try:
+            copied[user_id] = _copy_user(user_id, sources[user_id], target)
+        except MoveConflict:
+            logger.exception('Moving user %s to %s failed; it stays on %s', user_id, target, sources[user_id])
+            _set_directory(user_id, moving_to=None)
+            results[user_id] = None
+    if not copied:
+        return results
+    # Processes that still route the moved users to the source only read from it
+    sleep(router.ttl)
+
+    for user_id, (rows, version) in copied.items():
+        source = sources[user_id]
+        with db.engines[source].begin() as src:
+            if _data_version(src, user_id) != version:
+                logger.error('User %s was written on %s during the move; its rows there were kept', user_id, source)
+                results[user_id] = None
+                continue
+            _delete_rows(src, user_id)
+        results[user_id] = rows
+    return results
+
+
+def misplaced_users(exclude=()):
+    """[(user_id, current shard, ring shard)] for users the ring (without `exclude`) places elsewhere."""
+    router = _router()
+    if router is None:
+        raise ValueError('Sharding is not configured (DATABASE_SHARD_URLS is empty).')
+    keys = [key for key in router.keys if key not in exclude]
+    if not keys:
+        raise ValueError('Every shard is excluded.')
+    ring = HashRing(keys, current_app.config['SHARD_VNODES']) if exclude else router.ring
+    rows = db.session.execute(select(ShardDirectory.user_id, ShardDirectory.shard).order_by(ShardDirectory.user_id))
+    return [(user_id, shard, ring.shard_for(user_id)) for user_id, shard in rows if ring.shard_for(user_id) != shard]
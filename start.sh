@@ -3,8 +3,13 @@
 # Exit immediately if a command exits with a non-zero status.
 set -e
 
-# Run Flask shell commands to create all tables (initial migration)
-python -c "from app import app, db; with app.app_context(): db.create_all()"
+# Production boots never run DDL, so bring the schema up to date first:
+# upgrade-db alters tables created by older versions (see migrations.py),
+# init-db creates missing tables and the search index. Both are safe to
+# re-run on every deploy.
+export APP_ENV="${APP_ENV:-production}"
+flask --app app upgrade-db
+flask --app app init-db
 
-# Start the Gunicorn WSGI server
-gunicorn app:app
+# Start the Gunicorn WSGI server; worker model and limits are in gunicorn.conf.py
+exec gunicorn -c gunicorn.conf.py app:app
@@ -0,0 +1,90 @@
+"""Application startup: cold-start timing, schema setup and warmup.
+
+A profile taken inside the running process would see modules that are
+already imported, so the boot is replayed in a subprocess: the import of
+`app` itself is timed, then create_app() records its own phases on
+app.extensions['startup_profile'].
+
+init_database() and warm_up() are shared by `flask init-db` and the
+gunicorn hooks in gunicorn.conf.py. Deploys run `flask upgrade-db` before
+`flask init-db` (see start.sh), since creating tables never alters
+existing ones.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Dependencies only some pages need; importing one during boot is a regression
+DEFERRED_MODULES = ('numpy',)
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter() - started
+application = app_module.create_app()
+total = time.perf_counter() - started
+phases = [('import', imported)] + application.extensions['startup_profile'].phases
+heavy = [name for name in sys.argv[1:] if name in sys.modules]
+print(json.dumps({'phases': phases, 'total': total, 'heavy_modules': heavy}))
+"""
+
+
+def cold_start_profile(env=None):
+    """Boot the app in a new interpreter and return its phase timings (seconds).
+
+    Returns {'phases': [[name, seconds], ...], 'total': seconds,
+    'heavy_modules': [...]} where heavy_modules lists the DEFERRED_MODULES
+    that were imported during boot anyway.
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', _PROBE, *DEFERRED_MODULES],
+        cwd=PROJECT_DIR,
+        env={**os.environ, **(env or {})},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def init_database(app):
+    """Create missing tables and the search index (production boots skip this)."""
+    from search import setup_search_index
+    from shards import create_schema
+    with app.app_context():
+        create_schema()
+        setup_search_index(app, create=True)
+
+
+def warm_up(app, connections=1):
+    """Compile every template, open `connections` pooled connections per engine and load the archive cutoff.
+
+    Run in each server process before it takes traffic, so the first
+    requests do not pay for template parsing, connection setup or the
+    cutoff lookup.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+
+    from app import db
+    from archive import archive_cutoff
+    from templating import warm_templates
+    with app.app_context():
+        warm_templates(app)
+        archive_cutoff()
+        for key, engine in db.engines.items():
+            try:
+                opened = [engine.connect() for _ in range(max(connections, 1))]
+            except DBAPIError:
+                # An unreachable replica is handled by its health check later
+                logger.warning('Could not pre-open connections for bind %s', key or 'primary', exc_info=True)
+                continue
+            for connection in opened:
+                connection.execute(text('SELECT 1'))
+                connection.close()
@@ -0,0 +1,295 @@
+"""Delta sync of a user's expenses, budgets, reminders and goals.
+
+Every transaction that creates, changes or deletes rows of a synced model
+appends one change_log entry per row when it commits. The entries are
+tagged with the owner's data_version, which that commit bumps again. The
+bump takes the user row's lock, so one user's versions are assigned and
+committed in order, and each version belongs to a single transaction. A
+client's cursor is the (version, change id) of the last entry it has seen.
+Nothing that commits later can land behind that cursor.
+
+ORM writes are picked up by session events. Set-based writes (bulk edits,
+imports, rate reconversion) call record_changes() with the ids they
+touched.
+
+GET /api/v1/sync without a cursor starts with a snapshot: every current row,
+entity by entity in id order, archived expenses included. After that it
+continues with the log from the version the snapshot started at. With a
+cursor it returns the entries after it, in batches of at most
+SYNC_MAX_BATCH. Each entry comes with the row's current state, or a
+delete. Replaying a row is harmless, so the handoff may repeat a few.
+
+`flask prune-changes` deletes entries older than SYNC_RETENTION_DAYS and
+records each user's newest pruned position in sync_floor. A cursor behind
+that position raises CursorExpired, and the client has to start over.
+"""
+import base64
+import binascii
+import json
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import delete, event, func, insert, literal, select, tuple_, update
+
+from app import db
+from archive import archive_cutoff, with_archive
+from cache import get_data_version
+from db_routing import RoutingSession
+from models import ArchivedExpense, Budget, ChangeLog, Expense, Goal, Reminder, SyncFloor, User
+from pagination import InvalidCursor
+
+UPSERT, DELETE = 'upsert', 'delete'
+# Snapshot order; also the entity names used in change_log and responses
+SYNCED_MODELS = {'expense': Expense, 'budget': Budget, 'reminder': Reminder, 'goal': Goal}
+_ENTITY_NAMES = {model: name for name, model in SYNCED_MODELS.items()}
+_PENDING = 'sync_changes'
+_PENDING_RANGES = 'sync_change_ranges'
+_SYNC = {'synchronize_session': False}
+
+
+class CursorExpired(Exception):
+    """The entries after a cursor were pruned; the client must sync from scratch."""
+
+
+def init_sync(app):
+    app.config.setdefault('SYNC_BATCH_SIZE', 500)
+    app.config.setdefault('SYNC_MAX_BATCH', 2000)
+    app.config.setdefault('SYNC_RETENTION_DAYS', 90)
+    if not event.contains(RoutingSession, 'after_flush', _collect_flushed):
+        event.listen(RoutingSession, 'after_flush', _collect_flushed)
+        event.listen(RoutingSession, 'before_commit', _write_changes)
+        event.listen(RoutingSession, 'after_rollback', _discard_changes)
+
+
+def record_changes(user_id, entity, ids, op=UPSERT):
+    """Note set-based writes to synced rows; they are logged when the session commits.
+
+    A `range` of upserted ids (SQLite imports) is logged with one INSERT ...
+    SELECT over the entity's table instead of a parameter set per id.
+    """
+    if isinstance(ids, range) and op == UPSERT:
+        db.session.info.setdefault(_PENDING_RANGES, []).append((user_id, entity, ids))
+        return
+    pending = db.session.info.setdefault(_PENDING, {})
+    for entity_id in ids:
+        pending[(user_id, entity, entity_id)] = op
+
+
+def _collect_flushed(session, flush_context):
+    # The new/dirty/deleted collections still describe the flush that just ran
+    pending = session.info.setdefault(_PENDING, {})
+    for objects, op, check_modified in (
+        (session.new, UPSERT, False), (session.dirty, UPSERT, True), (session.deleted, DELETE, False),
+    ):
+        for obj in objects:
+            name = _ENTITY_NAMES.get(type(obj))
+            if name is None or (check_modified and not session.is_modified(obj)):
+                continue
+            pending[(obj.user_id, name, obj.id)] = op
+
+
+def _write_changes(session):
+    # Runs before commit's own flush, so flush here to collect everything
+    session.flush()
+    pending = session.info.pop(_PENDING, None) or {}
+    ranges = session.info.pop(_PENDING_RANGES, None) or []
+    if not pending and not ranges:
+        return
+
+    by_user = defaultdict(list)
+    for (user_id, entity, entity_id), op in pending.items():
+        by_user[user_id].append((entity, entity_id, op))
+    for user_id, _, _ in ranges:
+        by_user.setdefault(user_id, [])
+    users = User.__table__
+    versions = dict(session.execute(
+        update(users).where(users.c.id.in_(sorted(by_user)))
+        .values(data_version=users.c.data_version + 1)
+        .returning(users.c.id, users.c.data_version)
+    ).all())
+
+    now = datetime.now()
+    rows = [
+        {'user_id': user_id, 'version': versions[user_id], 'entity': entity, 'entity_id': entity_id,
+         'op': op, 'changed_at': now}
+        for user_id, changes in by_user.items() if user_id in versions
+        for entity, entity_id, op in changes
+    ]
+    if rows:
+        session.execute(insert(ChangeLog), rows)
+    for user_id, entity, ids in ranges:
+        if user_id not in versions or not ids:
+            continue
+        model = SYNCED_MODELS[entity]
+        session.execute(insert(ChangeLog).from_select(
+            ['user_id', 'version', 'entity', 'entity_id', 'op', 'changed_at'],
+            select(model.user_id, literal(versions[user_id]), literal(entity), model.id, literal(UPSERT), literal(now))
+            .where(model.user_id == user_id, model.id.between(ids.start, ids.stop - 1)),
+        ))
+
+
+def _discard_changes(session):
+    session.info.pop(_PENDING, None)
+    session.info.pop(_PENDING_RANGES, None)
+
+
+def encode_sync_cursor(state):
+    payload = json.dumps(state, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_sync_cursor(token):
+    """Return the cursor state: {'s': entity index, 'i': last id, 'v': version} or {'v', 'i'}."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode((token + '=' * (-len(token) % 4)).encode()))
+        if not isinstance(state.get('v'), int) or not isinstance(state.get('i'), (int, type(None))):
+            raise InvalidCursor(token)
+        if 's' in state and not (isinstance(state['s'], int) and 0 <= state['s'] < len(SYNCED_MODELS)):
+            raise InvalidCursor(token)
+    except (binascii.Error, ValueError, AttributeError) as exc:
+        raise InvalidCursor(token) from exc
+    return state
+
+
+def row_to_dict(row):
+    """Every column of a synced row but user_id, dates as ISO strings."""
+    data = {}
+    for column in row.__table__.columns:
+        if column.key == 'user_id':
+            continue
+        value = getattr(row, column.key)
+        data[column.key] = value.isoformat() if isinstance(value, date) else value
+    return data
+
+
+def _snapshot_rows(user_id, name, after_id, limit):
+    model = SYNCED_MODELS[name]
+    if model is Expense and archive_cutoff() is not None:
+        entity = with_archive(
+            [Expense.user_id == user_id, Expense.id > after_id],
+            [ArchivedExpense.user_id == user_id, ArchivedExpense.id > after_id],
+        )
+        query = db.session.query(entity)
+    else:
+        entity = model
+        query = model.query.filter(model.user_id == user_id, model.id > after_id)
+    return query.order_by(entity.id).limit(limit).all()
+
+
+def _snapshot_batch(user_id, state, limit):
+    names = list(SYNCED_MODELS)
+    index, after_id = state['s'], state['i'] or 0
+    changes = []
+    while index < len(names) and len(changes) < limit:
+        rows = _snapshot_rows(user_id, names[index], after_id, limit - len(changes))
+        changes.extend({'entity': names[index], 'id': row.id, 'op': UPSERT, 'data': row_to_dict(row)} for row in rows)
+        if len(changes) < limit:
+            index, after_id = index + 1, 0
+        else:
+            after_id = rows[-1].id
+    if index < len(names):
+        return changes, {'s': index, 'i': after_id, 'v': state['v']}, True
+    # Entries up to the snapshot's starting version are reflected in the rows
+    return changes, {'v': state['v'], 'i': None}, True
+
+
+def _current_rows(user_id, ids_by_entity):
+    rows = {}
+    for name, ids in ids_by_entity.items():
+        model = SYNCED_MODELS[name]
+        for row in model.query.filter(model.user_id == user_id, model.id.in_(ids)):
+            rows[(name, row.id)] = row
+    archived = [entity_id for entity_id in ids_by_entity.get('expense', ()) if ('expense', entity_id) not in rows]
+    if archived:
+        for row in ArchivedExpense.query.filter(ArchivedExpense.user_id == user_id, ArchivedExpense.id.in_(archived)):
+            rows[('expense', row.id)] = row
+    return rows
+
+
+def _check_floor(user_id, version, change_id):
+    floor = db.session.get(SyncFloor, user_id)
+    if floor is None:
+        return
+    if change_id is None:
+        behind = version < floor.version
+    else:
+        behind = (version, change_id) < (floor.version, floor.change_id)
+    if behind:
+        raise CursorExpired()
+
+
+def _log_batch(user_id, state, limit):
+    version, last_id = state['v'], state['i']
+    _check_floor(user_id, version, last_id)
+    if last_id is None:
+        position = ChangeLog.version > version
+    else:
+        position = tuple_(ChangeLog.version, ChangeLog.id) > tuple_(version, last_id)
+    entries = db.session.execute(
+        select(ChangeLog.version, ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .where(ChangeLog.user_id == user_id, position)
+        .order_by(ChangeLog.version, ChangeLog.id)
+        .limit(limit)
+    ).all()
+    if not entries:
+        return [], state, False
+
+    # Only the last entry per row matters within a batch
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.entity_id), None)
+        latest[(entry.entity, entry.entity_id)] = entry.op
+    ids_by_entity = defaultdict(list)
+    for (name, entity_id), op in latest.items():
+        if op == UPSERT:
+            ids_by_entity[name].append(entity_id)
+    rows = _current_rows(user_id, ids_by_entity)
+
+    changes = []
+    for (name, entity_id), op in latest.items():
+        row = rows.get((name, entity_id)) if op == UPSERT else None
+        if row is None:
+            # Deleted, possibly by a later entry this batch has not reached
+            changes.append({'entity': name, 'id': entity_id, 'op': DELETE})
+        else:
+            changes.append({'entity': name, 'id': entity_id, 'op': UPSERT, 'data': row_to_dict(row)})
+    last = entries[-1]
+    return changes, {'v': last.version, 'i': last.id}, len(entries) == limit
+
+
+def sync_batch(user_id, cursor=None, limit=500):
+    """Return (changes, next cursor, has_more) for a user after `cursor` (None: from scratch).
+
+    Raises InvalidCursor for a malformed cursor and CursorExpired when the
+    entries after it were pruned.
+    """
+    if not cursor:
+        state = {'s': 0, 'i': 0, 'v': get_data_version(user_id)}
+    else:
+        state = decode_sync_cursor(cursor)
+    if 's' in state:
+        changes, state, has_more = _snapshot_batch(user_id, state, limit)
+    else:
+        changes, state, has_more = _log_batch(user_id, state, limit)
+    return changes, encode_sync_cursor(state), has_more
+
+
+def prune_changes(before):
+    """Delete change_log entries recorded before `before`; return how many."""
+    newest = db.session.execute(
+        select(ChangeLog.user_id, func.max(ChangeLog.id)).where(ChangeLog.changed_at < before).group_by(ChangeLog.user_id)
+    ).all()
+    if not newest:
+        return 0
+    # A user's change ids grow with their version (both are assigned under the user row lock)
+    positions = dict(db.session.execute(
+        select(ChangeLog.id, ChangeLog.version).where(ChangeLog.id.in_([change_id for _, change_id in newest]))
+    ).all())
+    for user_id, change_id in newest:
+        floor = db.session.get(SyncFloor, user_id) or SyncFloor(user_id=user_id, version=0, change_id=0)
+        if (positions[change_id], change_id) > (floor.version, floor.change_id):
+            floor.version, floor.change_id = positions[change_id], change_id
+        db.session.add(floor)
+    result = db.session.execute(delete(ChangeLog).where(ChangeLog.changed_at < before), execution_options=_SYNC)
+    db.session.commit()
+    return result.rowcount
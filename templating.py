@@ -0,0 +1,128 @@
+"""Template compilation and rendering caches.
+
+Compiled templates are written to a Jinja bytecode cache on disk
+(JINJA_BYTECODE_CACHE_DIR), so a new gunicorn worker loads them instead of
+re-parsing every template source; `flask warm-templates` fills it ahead of
+time.
+
+Expensive blocks can be wrapped in a fragment cache tag:
+
+    {% cache 'dashboard-recent' %} ... {% endcache %}
+    {% cache 'budget-progress', item.budget.id %} ... {% endcache %}
+
+The rendered HTML is stored in a bounded LRU keyed by the fragment name,
+any extra key values, the current user and their data version, so a write
+makes the user's old fragments unreachable just like the response cache.
+Fragments must not contain per-session values such as CSRF tokens.
+"""
+import logging
+import os
+import threading
+
+from flask import g, has_request_context
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import LRUCache, get_data_version
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        html = self.backend.get(key)
+        if html is not None:
+            with self.counter_lock:
+                self.hits += 1
+            return html
+        with self.counter_lock:
+            self.misses += 1
+        html = render()
+        self.backend.set(key, html)
+        return html
+
+    def metrics_lines(self):
+        with self.counter_lock:
+            hits, misses = self.hits, self.misses
+        return [
+            '# HELP app_fragment_cache_hits_total Template fragment cache hits.',
+            '# TYPE app_fragment_cache_hits_total counter',
+            f'app_fragment_cache_hits_total {hits}',
+            '# HELP app_fragment_cache_misses_total Template fragment cache misses.',
+            '# TYPE app_fragment_cache_misses_total counter',
+            f'app_fragment_cache_misses_total {misses}',
+        ]
+
+
+def _request_data_version(user_id):
+    # One lookup per request however many fragments the page has
+    if 'fragment_data_version' not in g:
+        g.fragment_data_version = get_data_version(user_id)
+    return g.fragment_data_version
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache name[, key...] %}...{% endcache %} tag."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_fragment', [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_fragment(self, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or not has_request_context() or not current_user.is_authenticated:
+            return caller()
+        user_id = current_user.id
+        key = ':'.join(['fragment', *map(str, parts), str(user_id), str(_request_data_version(user_id))])
+        return Markup(cache.get_or_render(key, lambda: str(caller())))
+
+
+def init_templating(app):
+    """Install the bytecode cache and the fragment cache tag on the app's Jinja environment."""
+    app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+    app.config.setdefault('FRAGMENT_CACHE_MAX_ENTRIES', 2048)
+    app.config.setdefault('FRAGMENT_CACHE_TTL', 600)
+
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if directory:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+        except OSError:
+            logger.warning('Jinja bytecode cache directory %s is not writable; compiling templates in memory', directory)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    fragment_cache = FragmentCache(LRUCache(
+        max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'], ttl=app.config['FRAGMENT_CACHE_TTL'],
+    ))
+    app.jinja_env.fragment_cache = fragment_cache
+    app.extensions['fragment_cache'] = fragment_cache
+    return fragment_cache
+
+
+def warm_templates(app):
+    """Compile every template (filling the bytecode cache); return how many were loaded."""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
@@ -0,0 +1,34 @@
+"""Shared setup for the test suite.
+
+app.py builds the application on first import from DATABASE_URL, so the
+environment is set here, before any test module imports it. All tests
+share one throwaway SQLite file; each test signs up a user of its own, so
+no test sees another's data or cache entries.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "tests.db")}'
+
+from app import app  # noqa: E402
+
+PASSWORD = 'test-password'
+_user_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    """A test client signed in as a new user, whose credentials are client.email and client.password."""
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.email = f'user{next(_user_numbers)}@example.com'
+    client.password = PASSWORD
+    client.post('/register', data={'username': client.email.split('@')[0], 'email': client.email,
+                                   'password': PASSWORD, 'confirm_password': PASSWORD})
+    client.post('/login', data={'email': client.email, 'password': PASSWORD})
+    return client
@@ -0,0 +1,36 @@
+"""Bulk edits reject incomplete forms with a message instead of reaching the database."""
+import pytest
+from sqlalchemy import select
+
+from app import app, db
+from models import Expense
+
+
+def _categories(client):
+    with app.app_context():
+        return db.session.scalars(
+            select(Expense.category).where(Expense.description == client.email)
+        ).all()
+
+
+@pytest.mark.parametrize('data, message', [
+    ({'action': 'recategorize'}, 'Choose the category to move the expenses to.'),
+    ({'action': 'recategorize', 'new_category': ''}, 'Choose the category to move the expenses to.'),
+    ({'action': 'shift'}, 'Enter a non-zero number of days to shift by.'),
+    ({'action': 'shift', 'days': ''}, 'Enter a non-zero number of days to shift by.'),
+    ({'action': 'shift', 'days': '0'}, 'Enter a non-zero number of days to shift by.'),
+], ids=['recategorize-missing', 'recategorize-empty', 'shift-missing', 'shift-empty', 'shift-zero'])
+def test_incomplete_bulk_form_is_flashed(client, data, message):
+    client.post('/expense/add', data={'amount': '5.00', 'currency': 'USD', 'category': 'food',
+                                      'date': '2026-01-15', 'description': client.email})
+    response = client.post('/expenses/bulk', data={'scope': 'filter', **data}, follow_redirects=True)
+    assert response.status_code == 200
+    assert message in response.get_data(as_text=True)
+    assert _categories(client) == ['food']
+
+
+def test_recategorize_with_a_category(client):
+    client.post('/expense/add', data={'amount': '5.00', 'currency': 'USD', 'category': 'food',
+                                      'date': '2026-01-15', 'description': client.email})
+    client.post('/expenses/bulk', data={'scope': 'filter', 'action': 'recategorize', 'new_category': 'transport'})
+    assert _categories(client) == ['transport']
@@ -0,0 +1,84 @@
+"""The response cache never serves a page older than the user's last write."""
+import io
+import sys
+import threading
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from app import app, db
+from cache import LRUCache, ResponseCache
+from models import Expense
+
+PAGES = ('/dashboard', '/analytics')
+TODAY = date.today().isoformat()
+
+
+def _expense_id(description):
+    with app.app_context():
+        return db.session.scalar(select(Expense.id).where(Expense.description == description))
+
+
+def _add(client):
+    client.post('/expense/add', data={'amount': '5.25', 'currency': 'USD', 'category': 'food',
+                                      'date': TODAY, 'description': 'Added'})
+
+
+def _edit(client):
+    client.post(f'/expense/edit/{_expense_id(client.email)}', data={
+        'amount': '7.50', 'currency': 'USD', 'category': 'food', 'date': TODAY, 'description': client.email,
+    })
+
+
+def _delete(client):
+    client.post(f'/expense/delete/{_expense_id(client.email)}')
+
+
+def _import(client):
+    upload = io.BytesIO(f'Date,Category,Amount,Description\n{TODAY},food,2.50,Imported\n'.encode())
+    client.post('/expenses/import', data={'file': (upload, 'expenses.csv')}, content_type='multipart/form-data')
+
+
+@pytest.mark.parametrize('write, total', [
+    (_add, '$15.25'),
+    (_edit, '$7.50'),
+    (_delete, '$0.00'),
+    (_import, '$12.50'),
+], ids=['add', 'edit', 'delete', 'import'])
+def test_next_read_after_a_write_shows_it(client, write, total):
+    # The description identifies the user's own seed expense
+    client.post('/expense/add', data={'amount': '10.00', 'currency': 'USD', 'category': 'food',
+                                      'date': TODAY, 'description': client.email})
+    cache = app.extensions['response_cache']
+    for page in PAGES:
+        client.get(page)
+        hits = cache.hits
+        client.get(page)
+        assert cache.hits == hits + 1, f'{page} was not served from the cache'
+
+    write(client)
+    for page in PAGES:
+        assert total in client.get(page).get_data(as_text=True)
+
+
+def test_counters_lose_no_updates_across_threads():
+    threads, lookups = 8, 20000
+    cache = ResponseCache(LRUCache(max_entries=16))
+    cache.backend.set('hit', 'value')
+
+    def look_up():
+        for index in range(lookups):
+            cache.get_or_compute('hit' if index % 2 else f'miss-{index}', lambda: 'value')
+
+    workers = [threading.Thread(target=look_up) for _ in range(threads)]
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(previous)
+    assert cache.hits + cache.misses == threads * lookups
@@ -0,0 +1,73 @@
+"""current_user comes from the identity cache, and signing out or deleting an account takes effect at once."""
+import re
+
+import pytest
+from sqlalchemy import delete, event, select
+
+from app import app, db
+from models import User
+
+PATH = '/api/v1/categories'
+
+
+def _second_client(client):
+    """Another device signed in as the same user."""
+    other = app.test_client()
+    other.post('/login', data={'email': client.email, 'password': client.password})
+    assert other.get(PATH).status_code == 200
+    return other
+
+
+def _user_id(client):
+    with app.app_context():
+        return db.session.scalar(select(User.id).where(User.email == client.email))
+
+
+def test_cached_requests_do_not_query_the_user_table(client):
+    statements = []
+
+    def record(conn, cursor, statement, *_):
+        statements.append(statement)
+
+    client.get(PATH)  # may load the user into the cache
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for _ in range(20):
+            assert client.get(PATH).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    # The ETag's data_version read is a separate, intended lookup
+    assert [statement for statement in statements
+            if re.search(r'FROM "?user"?\b', statement) and 'data_version' not in statement] == []
+
+
+def test_logout_ends_only_the_current_session(client):
+    other = _second_client(client)
+    client.get('/logout')
+    assert client.get(PATH).status_code == 401
+    assert other.get(PATH).status_code == 200
+
+
+def test_log_out_everywhere_ends_every_session(client):
+    other = _second_client(client)
+    copied = app.test_client()
+    copied.set_cookie('session', client.get_cookie('session').value)
+
+    client.post('/logout/everywhere')
+    for session in (client, other, copied):
+        assert session.get(PATH).status_code == 401
+
+
+@pytest.mark.parametrize('how', ['orm', 'core'])
+def test_deleted_account_is_refused(client, how):
+    user_id = _user_id(client)
+    assert client.get(PATH).status_code == 200  # caches the user
+    with app.app_context():
+        if how == 'orm':
+            db.session.delete(db.session.get(User, user_id))
+        else:
+            db.session.execute(delete(User).where(User.id == user_id))
+        db.session.commit()
+    assert client.get(PATH).status_code == 401
@@ -0,0 +1,118 @@
+"""Production boots stay cheap, and start.sh's deploy steps leave a working schema."""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+from sqlalchemy import create_engine, inspect
+from werkzeug.security import generate_password_hash
+
+from app import db
+from startup import PROJECT_DIR, cold_start_profile
+
+# The schema as it was before any of the performance work, with one user
+_LEGACY_SCHEMA = """
+CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(64) NOT NULL, email VARCHAR(120) NOT NULL,
+                   password_hash VARCHAR(256), PRIMARY KEY (id));
+CREATE TABLE expense (id INTEGER NOT NULL, amount FLOAT NOT NULL, category VARCHAR(100) NOT NULL,
+                      date DATE NOT NULL, description VARCHAR(255), user_id INTEGER NOT NULL,
+                      PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE budget (id INTEGER NOT NULL, category VARCHAR(64) NOT NULL, limit_amount FLOAT NOT NULL,
+                     start_date DATE NOT NULL, end_date DATE NOT NULL, user_id INTEGER NOT NULL,
+                     PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE reminder (id INTEGER NOT NULL, bill_name VARCHAR(100) NOT NULL, due_date DATE NOT NULL,
+                       amount FLOAT NOT NULL, user_id INTEGER NOT NULL,
+                       PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE goal (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, target_amount FLOAT NOT NULL,
+                   current_amount FLOAT, due_date DATE NOT NULL, user_id INTEGER NOT NULL,
+                   PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE UNIQUE INDEX ix_user_email ON user (email);
+CREATE UNIQUE INDEX ix_user_username ON user (username);
+CREATE INDEX ix_expense_user_id ON expense (user_id);
+CREATE INDEX ix_expense_date ON expense (date);
+CREATE INDEX ix_expense_category ON expense (category);
+CREATE INDEX ix_budget_category ON budget (category);
+CREATE INDEX ix_budget_user_id ON budget (user_id);
+CREATE INDEX ix_budget_start_date ON budget (start_date);
+CREATE INDEX ix_reminder_user_id ON reminder (user_id);
+CREATE INDEX ix_reminder_due_date ON reminder (due_date);
+CREATE INDEX ix_goal_due_date ON goal (due_date);
+CREATE INDEX ix_goal_user_id ON goal (user_id);
+INSERT INTO expense VALUES (1, 12.5, 'food', date('now'), 'Lunch', 1);
+INSERT INTO budget VALUES (1, 'food', 200.0, date('now', 'start of month'), date('now', '+1 month'), 1);
+INSERT INTO reminder VALUES (1, 'Rent', date('now'), 900.0, 1);
+INSERT INTO goal VALUES (1, 'Holiday', 1000.0, NULL, date('now', '+1 year'), 1);
+"""
+PAGES = ('/dashboard', '/analytics', '/expenses', '/budgets', '/reminders', '/recurring', '/goals')
+
+# Signs in as the legacy user and prints each page's status
+_PROBE = """
+import json, sys
+from app import app
+app.config['WTF_CSRF_ENABLED'] = False
+client = app.test_client()
+client.post('/login', data={'email': 'legacy@example.com', 'password': 'legacy-password'})
+print(json.dumps({page: client.get(page).status_code for page in sys.argv[1:]}))
+"""
+
+
+def _production_env(db_path):
+    return {'APP_ENV': 'production', 'DATABASE_URL': f'sqlite:///{db_path}', 'LOG_LEVEL': 'WARNING',
+            'AUTO_CREATE_SCHEMA': '0'}
+
+
+def _tables(db_path):
+    if not os.path.exists(db_path):
+        return set()
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _schema(db_path):
+    """{table: (columns, indexes)} as SQLite reports them."""
+    inspector = inspect(create_engine(f'sqlite:///{db_path}'))
+    return {
+        table: ({(column['name'], str(column['type']), column['nullable']) for column in inspector.get_columns(table)},
+                {(index['name'], tuple(index['column_names'])) for index in inspector.get_indexes(table)})
+        for table in inspector.get_table_names()
+    }
+
+
+def _deploy(db_path):
+    """Run the schema steps of start.sh."""
+    for command in ('upgrade-db', 'init-db'):
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', command], cwd=PROJECT_DIR,
+                       env={**os.environ, **_production_env(db_path)}, capture_output=True, check=True)
+
+
+def test_production_boot_runs_no_ddl(tmp_path):
+    db_path = tmp_path / 'boot.db'
+    cold_start_profile(_production_env(db_path))
+    assert _tables(db_path) == set()
+
+
+def test_production_boot_defers_heavy_imports(tmp_path):
+    assert cold_start_profile(_production_env(tmp_path / 'boot.db'))['heavy_modules'] == []
+
+
+def test_deploy_creates_every_table(tmp_path):
+    db_path = tmp_path / 'new.db'
+    _deploy(db_path)
+    assert {table.name for table in db.metadata.sorted_tables} <= _tables(db_path)
+
+
+def test_deploy_upgrades_a_legacy_database(tmp_path):
+    db_path = tmp_path / 'legacy.db'
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(_LEGACY_SCHEMA)
+        conn.execute("INSERT INTO user VALUES (1, 'legacy', 'legacy@example.com', ?)",
+                     (generate_password_hash('legacy-password'),))
+    _deploy(db_path)
+    _deploy(tmp_path / 'new.db')
+    assert _schema(db_path) == _schema(tmp_path / 'new.db')
+
+    result = subprocess.run([sys.executable, '-c', _PROBE, *PAGES], cwd=PROJECT_DIR,
+                            env={**os.environ, **_production_env(db_path)}, capture_output=True, text=True,
+                            check=True)
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == {page: 200 for page in PAGES}